@@ -25,6 +25,13 @@ import requests
 from pathlib import Path
 import subprocess
 
+# 复用 services 下的底层模块（上游连接池等）；打包时通过 --paths 收录
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "services")
+if SERVICES_DIR not in sys.path:
+    sys.path.insert(0, SERVICES_DIR)
+import app_config
+import llm_client
+
 
 # ---------------------------
 # 工具：端口选择与资源路径
@@ -130,30 +137,38 @@ class LLMProxyHandler(BaseHTTPRequestHandler):
             val = os.environ.get(var)
             if val:
                 return val
-        try:
-            base = Path(__file__).resolve().parent.parent
-            cfg_path = base / "config" / "app.json"
-            if cfg_path.exists():
-                with open(cfg_path, "r", encoding="utf-8") as f:
-                    j = json.load(f)
-                k = j.get("llmKey")
-                if k:
-                    return k
-        except Exception:
-            pass
+        k = app_config.load().get("llmKey")
+        if k:
+            return k
         return None
     def _set_cors(self):
         self.send_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
         self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
 
     def do_OPTIONS(self):
         self.send_response(200)
         self._set_cors()
         self.end_headers()
 
+    def do_GET(self):
+        # 缓存命中/未命中统计
+        if self.path.split('?', 1)[0] == "/llm/stats":
+            stats = {"cache": llm_client.get_cache().stats(), "upstream": llm_client.get_limiter().stats()}
+            data = json.dumps(stats, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self._set_cors()
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(404)
+        self._set_cors()
+        self.end_headers()
+        self.wfile.write(b"Not Found")
+
     def do_POST(self):
-        if self.path not in ("/llm", "/v1/chat/completions"):
+        if self.path.split("?", 1)[0] not in ("/llm", "/v1/chat/completions"):
             self.send_response(404)
             self._set_cors()
             self.end_headers()
@@ -171,62 +186,27 @@ class LLMProxyHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": f"invalid json: {e}"}).encode("utf-8"))
             return
 
+        # 响应缓存：相同请求直接返回缓存结果；"cache": false 时跳过读取（仍写回新结果）
+        use_cache = payload.get("cache") is not False
+
         # 多模型聚合：providers 列表
         providers = payload.get("providers")
         if isinstance(providers, list) and providers:
-            results = []
-            for i, prov in enumerate(providers):
-                ep = prov.get("endpoint")
-                key = self._resolve_api_key(prov.get("name"), ep, prov.get("api_key"))
-                fb = prov.get("forward_body") or {}
-                if not ep:
-                    results.append({"provider": f"p{i}", "error": "missing endpoint"})
-                    continue
-                # 内置模拟：builtin:echo
-                if isinstance(ep, str) and ep.startswith("builtin:echo"):
-                    content = " ".join([
-                        msg.get("content", "") for msg in fb.get("messages", []) if isinstance(msg, dict)
-                    ]) or fb.get("prompt") or "OK"
-                    j = {
-                        "choices": [{"message": {"role": "assistant", "content": f"Echo: {content}"}}]
-                    }
-                    text = j["choices"][0]["message"]["content"]
-                    results.append({"provider": prov.get("name") or f"p{i}", "text": text, "raw": j})
-                    continue
-                try:
-                    headers = {"Content-Type": "application/json"}
-                    if key:
-                        headers["Authorization"] = f"Bearer {key}"
-                    resp = requests.post(ep, json=fb, headers=headers, timeout=30)
-                    resp.raise_for_status()
-                    try:
-                        j = resp.json()
-                    except Exception:
-                        j = {"raw": resp.text}
-                    text = (
-                        j.get("choices", [{}])[0].get("message", {}).get("content")
-                        or j.get("output")
-                        or json.dumps(j, ensure_ascii=False)
-                    )
-                    results.append({"provider": prov.get("name") or f"p{i}", "text": text, "raw": j})
-                except requests.exceptions.HTTPError as e:
-                    content = e.response.text if getattr(e, "response", None) is not None else ""
-                    results.append({"provider": prov.get("name") or f"p{i}", "error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": content})
-                except requests.exceptions.ConnectionError as e:
-                    results.append({"provider": prov.get("name") or f"p{i}", "error": f"ConnectionError {e}"})
-                except requests.exceptions.Timeout as e:
-                    results.append({"provider": prov.get("name") or f"p{i}", "error": f"Timeout {e}"})
-                except Exception as e:
-                    results.append({"provider": prov.get("name") or f"p{i}", "error": str(e)})
-
-            combined = "\n\n".join([
-                f"【{r.get('provider')}】\n{r.get('text') or r.get('error')}" for r in results
-            ])
+            if payload.get("stream"):
+                # 流式：各 provider 的增量交错写入同一个 SSE 流
+                llm_client.write_fan_out_stream(self, providers, self._resolve_api_key,
+                                                deadline=payload.get("deadline"), provider_timeout=payload.get("timeout"),
+                                                use_cache=use_cache)
+                return
+            # 并发调用，deadline 到期时返回已完成的部分结果
+            result = llm_client.fan_out(providers, self._resolve_api_key,
+                                        deadline=payload.get("deadline"), provider_timeout=payload.get("timeout"),
+                                        use_cache=use_cache)
             self.send_response(200)
             self._set_cors()
             self.send_header("Content-Type", "application/json")
             self.end_headers()
-            self.wfile.write(json.dumps({"outputs": results, "combined": combined}, ensure_ascii=False).encode("utf-8"))
+            self.wfile.write(json.dumps(result, ensure_ascii=False).encode("utf-8"))
             return
 
         # 单模型直通
@@ -236,7 +216,7 @@ class LLMProxyHandler(BaseHTTPRequestHandler):
             "model": payload.get("model", ""),
             "messages": payload.get("messages", []),
             "temperature": payload.get("temperature", 0.2),
-            "stream": False,
+            "stream": bool(payload.get("stream")),
         }
         if not endpoint:
             self.send_response(400)
@@ -245,6 +225,11 @@ class LLMProxyHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": "missing endpoint"}).encode("utf-8"))
             return
 
+        # 流式直通：上游 SSE 分块到达即转发
+        if payload.get("stream") or forward_body.get("stream"):
+            llm_client.relay_stream(self, endpoint, forward_body, api_key, use_cache=use_cache)
+            return
+
         # 内置模拟：builtin:echo
         if isinstance(endpoint, str) and endpoint.startswith("builtin:echo"):
             content = " ".join([
@@ -262,25 +247,21 @@ class LLMProxyHandler(BaseHTTPRequestHandler):
             return
 
         try:
-            headers = {"Content-Type": "application/json"}
-            if api_key:
-                headers["Authorization"] = f"Bearer {api_key}"
-            resp = requests.post(endpoint, json=forward_body, headers=headers, timeout=30)
-            resp.raise_for_status()
-            data = resp.text.encode("utf-8")
-            self.send_response(200)
+            status, text, cached = llm_client.complete(endpoint, forward_body, api_key, use_cache=use_cache)
+            data = text.encode("utf-8") if text or status < 400 else json.dumps({"error": f"HTTPError {status}"}).encode("utf-8")
+            self.send_response(status)
             self._set_cors()
             self.send_header("Content-Type", "application/json")
+            self.send_header("X-Cache", cached.upper())
             self.end_headers()
             self.wfile.write(data)
-        except requests.exceptions.HTTPError as e:
-            content = e.response.text if getattr(e, "response", None) is not None else ""
-            code = getattr(e.response, "status_code", 500)
-            self.send_response(code)
+        except llm_client.UpstreamBusy as e:
+            self.send_response(429)
             self._set_cors()
             self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "1")
             self.end_headers()
-            self.wfile.write(content.encode("utf-8") if content else json.dumps({"error": str(e)}).encode("utf-8"))
+            self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
         except requests.exceptions.ConnectionError as e:
             self.send_response(502)
             self._set_cors()
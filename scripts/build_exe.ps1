@@ -28,7 +28,9 @@ $pyArgs = @(
   "--noconfirm", "--clean", "--onefile", "--noconsole",
   "--name", "AlphaCouncil",
   "--add-data", "ABC/app/ui;app/ui",
-  "--add-data", "ABC/build/VERSION;."
+  "--add-data", "ABC/build/VERSION;.",
+  # 启动器复用 services 下的底层模块（上游连接池等）
+  "--paths", "ABC/services"
 )
 if (Test-Path "ABC/build/version_info.txt") { $pyArgs += "--version-file=ABC/build/version_info.txt" }
 if (Test-Path "ABC/build/icon.ico") { $pyArgs += "--icon=ABC/build/icon.ico" }
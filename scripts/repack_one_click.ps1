@@ -78,6 +78,7 @@ try {
         '--name','AlphaCouncil',
         '--add-data','ABC/app/ui;app/ui',
         '--add-data','ABC/build/VERSION;.',
+        '--paths','ABC/services',
         '--version-file','ABC/build/version_info.txt',
         'ABC/app/launcher.py'
     )
@@ -26,6 +26,7 @@ $args = @(
     '--name','AlphaCouncil',
     '--add-data','ABC/app/ui;app/ui',
     '--add-data','ABC/build/VERSION;.',
+    '--paths','ABC/services',
     '--version-file','ABC/build/version_info.txt',
     'ABC/app/launcher.py'
 )
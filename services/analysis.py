@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, List, Optional
+
+CONDITION_KEYS = ('low', 'high', 'max_pe', 'min_div', 'min_rsi', 'max_vol')
+# 未指定时的默认阈值
+DEFAULT_MIN_RSI = 45.0
+DEFAULT_MAX_VOL = 0.50
+
+
+def parse_conditions(qs: Dict[str, List[str]]) -> Dict[str, Optional[float]]:
+    """从查询参数解析条件阈值；未提供或非法时为 None。"""
+    def _num(q):
+        try:
+            return float((qs.get(q, [''])[0] or '').strip()) if qs.get(q) else None
+        except Exception:
+            return None
+    return {k: _num(k) for k in CONDITION_KEYS}
+
+
+def _float(v) -> float:
+    # Alpha Vantage 对缺失字段返回 'None' / '-'，按 0 处理
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def evaluate(sym: str, last: float, tech: Dict[str, Optional[float]], funda: Dict, conds: Dict[str, Optional[float]]) -> Dict:
+    """由最新价、指标快照与基本面生成 /data/analyze 的结果（技术面指标 + 策略建议 + 条件评估）。"""
+    p20 = tech.get('p20') or last
+    p60 = tech.get('p60') or last
+    e20 = tech.get('e20') or last
+    rsi14 = tech.get('rsi14') or 50
+    vol = tech.get('vol') or 0.25
+    chg = ((last - p60) / (p60 or last) * 100) if p60 else 0
+    low = tech['low'] if tech.get('low') is not None else last
+    high = tech['high'] if tech.get('high') is not None else last
+
+    pe = _float(funda.get('PERatio'))
+    div = _float(funda.get('DividendYield'))
+
+    used_conds = {
+        'low': conds['low'] if conds['low'] is not None else low,
+        'high': conds['high'] if conds['high'] is not None else high,
+        'max_pe': conds['max_pe'] if conds['max_pe'] is not None else None,
+        'min_div': conds['min_div'] if conds['min_div'] is not None else None,
+        'min_rsi': conds['min_rsi'] if conds['min_rsi'] is not None else DEFAULT_MIN_RSI,
+        'max_vol': conds['max_vol'] if conds['max_vol'] is not None else DEFAULT_MAX_VOL
+    }
+
+    checks = []
+    def add_check(name, ok, detail):
+        checks.append({'name': name, 'ok': bool(ok), 'detail': detail})
+    add_check('价格≥下限', last >= used_conds['low'], f"last={last:.2f}, low={used_conds['low']:.2f}")
+    add_check('价格≤上限', last <= used_conds['high'], f"last={last:.2f}, high={used_conds['high']:.2f}")
+    if conds['max_pe'] is not None:
+        add_check('估值PE≤阈值', (pe or 0) <= conds['max_pe'], f"PE={pe}, max={conds['max_pe']}")
+    if conds['min_div'] is not None:
+        add_check('股息率≥阈值', (div or 0) >= conds['min_div'], f"Div={div}, min={conds['min_div']}")
+    add_check('RSI≥阈值', (rsi14 or 0) >= used_conds['min_rsi'], f"RSI14={rsi14:.1f}, min={used_conds['min_rsi']}")
+    add_check('波动率≤阈值', (vol or 0) <= used_conds['max_vol'], f"Vol={vol:.3f}, max={used_conds['max_vol']}")
+
+    tone = '偏强' if last > p60 else '偏弱'
+    pos = 0.7 if (last>e20 and last>p60) else (0.5 if last>e20 else 0.3)
+
+    return {
+        'symbol': sym,
+        'last': round(last,2),
+        'indicators': {
+            'p20': round(p20,2), 'p60': round(p60,2), 'e20': round(e20,2),
+            'rsi14': round(rsi14,1), 'vol': vol,
+            'low': round(low,2), 'high': round(high,2),
+            'chg_pct_vs_p60': round(chg,2)
+        },
+        'fundamentals': {
+            'PE': pe, 'DividendYield': div
+        },
+        'summary': f"价格 {last:.2f}，相对SMA60涨跌 {chg:.2f}%，波动率 {(vol*100):.1f}%。动量{tone}。建议仓位 {int(pos*100)}%。观察区间 {low:.2f}~{high:.2f}。",
+        'checks': checks
+        , 'conditions': used_conds
+    }
+
+
+def screen_thresholds(conds: Dict[str, Optional[float]]) -> Dict[str, Optional[float]]:
+    """SQL 筛选使用的阈值（默认值同 evaluate；low/high 为 None 表示取各自的观察区间）。"""
+    return {
+        'low': conds['low'],
+        'high': conds['high'],
+        'max_pe': conds['max_pe'],
+        'min_div': conds['min_div'],
+        'min_rsi': conds['min_rsi'] if conds['min_rsi'] is not None else DEFAULT_MIN_RSI,
+        'max_vol': conds['max_vol'] if conds['max_vol'] is not None else DEFAULT_MAX_VOL,
+    }
+
+
+def rank_key(result: Dict):
+    """排序：通过的条件数越多越靠前，其次按相对 SMA60 涨幅降序。"""
+    passed = sum(1 for c in result.get('checks') or [] if c.get('ok'))
+    return (-passed, -float((result.get('indicators') or {}).get('chg_pct_vs_p60') or 0))
+
+
+def screen_chunk(symbols: Iterable[str], conds: Dict[str, Optional[float]], db_path: Optional[str] = None) -> List[Dict]:
+    """进程池任务：对一组代码做本地分析（每个任务只打开一次数据库连接），基本面取已存的概览。"""
+    from data_store import StockDatabase, DB_PATH
+    db = StockDatabase(db_path or DB_PATH)
+    out = []
+    try:
+        for sym in symbols:
+            try:
+                state = db.get_indicator_state(sym)
+                if state is None or state.last_close is None:
+                    out.append({'symbol': sym, 'error': 'no history'})
+                    continue
+                funda = db.get_overview(sym, max_age=None) or {}
+                res = evaluate(sym, float(state.last_close), state.snapshot(), funda, conds)
+                res['passed'] = sum(1 for c in res['checks'] if c['ok'])
+                res['total'] = len(res['checks'])
+                res['date'] = state.last_date
+                out.append(res)
+            except Exception as e:
+                out.append({'symbol': sym, 'error': str(e)})
+    finally:
+        db.close()
+    return out
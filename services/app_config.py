@@ -0,0 +1,93 @@
+"""统一配置 config/app.json 的进程内快照（网关、LLM 代理、启动器共用）。
+
+load() 每次只 stat 一次文件：修改时间与大小未变时直接返回内存中的快照，变化后才重新解析；
+save() 合并写入（临时文件 + 原子替换）后使快照失效。快照整体替换，读取无需加锁。
+返回的字典为共享对象，调用方只读不改。
+"""
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(BASE_DIR, 'config')
+CONFIG_PATH = os.path.join(CONFIG_DIR, 'app.json')
+
+_STALE = object()
+_LOCK = threading.Lock()
+# (文件签名, 配置)；文件不存在时签名为 None
+_SNAPSHOT: Tuple[object, Dict] = (_STALE, {})
+_RELOADS = 0
+
+
+def _signature() -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(CONFIG_PATH)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _read() -> Dict:
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        cfg = json.load(f) or {}
+    if not isinstance(cfg, dict):
+        raise ValueError('config root must be an object')
+    return cfg
+
+
+def load() -> Dict:
+    """当前配置快照；文件缺失时为空字典。解析失败（如其他进程写到一半）时沿用上一份快照，下次调用重试。"""
+    global _SNAPSHOT, _RELOADS
+    sig = _signature()
+    snap = _SNAPSHOT
+    if snap[0] == sig:
+        return snap[1]
+    with _LOCK:
+        snap = _SNAPSHOT
+        if snap[0] == sig:
+            return snap[1]
+        if sig is None:
+            _SNAPSHOT = (None, {})
+            return _SNAPSHOT[1]
+        try:
+            cfg = _read()
+        except (OSError, ValueError):
+            return snap[1]
+        _SNAPSHOT = (sig, cfg)
+        _RELOADS += 1
+        return cfg
+
+
+def invalidate():
+    """丢弃快照，下次 load() 重新读取文件。"""
+    global _SNAPSHOT
+    with _LOCK:
+        _SNAPSHOT = (_STALE, _SNAPSHOT[1])
+
+
+def save(patch: Dict) -> Dict:
+    """把 patch 中非 None 的字段合并写入配置文件，返回写入后的配置；现有文件无法解析时从空配置开始。"""
+    global _SNAPSHOT
+    with _LOCK:
+        try:
+            current = _read()
+        except FileNotFoundError:
+            current = {}
+        except (OSError, ValueError) as e:
+            # 现有文件损坏时从空配置开始覆盖写入（用户靠重新保存来修复配置）
+            print(f"[WARN] 配置文件无法解析，将以本次写入覆盖：{CONFIG_PATH}（{e}）", flush=True)
+            current = {}
+        current.update({k: v for k, v in patch.items() if v is not None})
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        tmp = f"{CONFIG_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, CONFIG_PATH)
+        _SNAPSHOT = (_STALE, _SNAPSHOT[1])
+    return load()
+
+
+def stats() -> Dict:
+    snap = _SNAPSHOT
+    return {'path': CONFIG_PATH, 'loaded': snap[0] is not _STALE, 'keys': len(snap[1]), 'reloads': _RELOADS}
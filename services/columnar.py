@@ -0,0 +1,152 @@
+"""按代码存放的列式日线文件（由 SQLite 派生，可随时重建）。
+
+文件布局（小端）：64 字节头 + 各列连续存放，每列按 8 字节对齐：
+    头：magic 'ACOL' | version u16 | date_width u16 | count u64 | code 32s | generation u64 | 保留
+    列：date（date_width 字节定长 ASCII）、open/high/low/close（float64）、volume（int64）
+generation 为生成文件时数据库中该代码的价格版本号，读取方据此判断文件是否过期。
+读取时 mmap 整个文件，各列以 np.frombuffer 直接映射，不复制、不逐行转换。
+该格式同时用于安装之间的批量导出/导入。
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+MAGIC = b'ACOL'
+VERSION = 2
+HEADER = struct.Struct('<4sHHQ32sQ')
+HEADER_SIZE = 64
+NUMERIC_COLUMNS = (('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'), ('volume', '<i8'))
+SUFFIX = '.bin'
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def encode(code: str, cols: Dict[str, object], generation: int = 0) -> bytes:
+    """把列数据（date 为字符串序列，其余为数值数组）编码为列式文件内容。"""
+    dates = np.asarray([d.encode('ascii') for d in cols['date']], dtype='S')
+    count = len(dates)
+    width = max(dates.dtype.itemsize, 1) if count else 10
+    dates = dates.astype(f'S{width}')
+    head = HEADER.pack(MAGIC, VERSION, width, count, code.encode('utf-8')[:32], int(generation))
+    parts = [head.ljust(HEADER_SIZE, b'\0')]
+    block = dates.tobytes()
+    parts.append(block.ljust(_align(len(block)), b'\0'))
+    for name, dtype in NUMERIC_COLUMNS:
+        parts.append(np.ascontiguousarray(cols[name], dtype=dtype).tobytes())
+    return b''.join(parts)
+
+
+def decode(buf, zero_copy: bool = True) -> Dict[str, object]:
+    """解析列式文件内容（bytes / mmap），返回 {'code', 'generation', 'date', 'open', ..., 'volume'}；数组为只读视图。
+
+    version 1 的文件（无 generation，仍可导入）generation 为 None。
+    """
+    if len(buf) < HEADER_SIZE:
+        raise ValueError('columnar file too short')
+    magic, version, width, count, code, generation = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError('not a columnar history file')
+    off = HEADER_SIZE
+    out = {'code': code.rstrip(b'\0').decode('utf-8'), 'generation': generation if version >= 2 else None}
+    out['date'] = np.frombuffer(buf, dtype=f'S{width}', count=count, offset=off)
+    off += _align(width * count)
+    for name, dtype in NUMERIC_COLUMNS:
+        arr = np.frombuffer(buf, dtype=dtype, count=count, offset=off)
+        out[name] = arr if zero_copy else arr.copy()
+        off += 8 * count
+    if off > len(buf):
+        raise ValueError('columnar file truncated')
+    return out
+
+
+def date_strings(dates) -> list:
+    """定长日期列转换为字符串列表。"""
+    return np.char.decode(dates, 'ascii').tolist() if len(dates) else []
+
+
+class ColumnarStore:
+    """data/columnar/<CODE>.bin 的读写：写入先落临时文件再原子替换，读者看到的始终是完整文件。"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, code: str) -> str:
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9._-]', '_', code) + SUFFIX)
+
+    def exists(self, code: str) -> bool:
+        return os.path.exists(self.path(code))
+
+    def write(self, code: str, cols: Dict[str, object], generation: int = 0):
+        self.write_bytes(code, encode(code, cols, generation))
+
+    def write_bytes(self, code: str, data: bytes):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(code)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        # Windows 下文件正被映射读取时替换会失败，稍等读者释放后重试
+        for attempt in range(5):
+            try:
+                os.replace(tmp, path)
+                return
+            except PermissionError:
+                if attempt == 4:
+                    os.remove(tmp)
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+    def invalidate(self, code: str):
+        # 与 write_bytes 相同：Windows 下读者仍映射着文件时删除会失败，稍等后重试
+        for attempt in range(5):
+            try:
+                os.remove(self.path(code))
+                return
+            except FileNotFoundError:
+                return
+            except PermissionError:
+                if attempt == 4:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+    @contextmanager
+    def mapped(self, code: str) -> Iterator[Optional[Dict[str, object]]]:
+        """映射读取，退出 with 块时关闭映射（Windows 下映射未关闭时文件无法替换或删除）；
+        文件不存在或为空时产出 None。数组只在块内有效，需要保留的部分应先复制。"""
+        try:
+            with open(self.path(code), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size >= HEADER_SIZE else None
+        except FileNotFoundError:
+            buf = None
+        if buf is None:
+            yield None
+            return
+        data = None
+        try:
+            data = decode(buf)
+            yield data
+        finally:
+            # 先释放对映射的引用再关闭；调用方仍持有视图时关闭会失败，留给垃圾回收
+            if data is not None:
+                data.clear()
+            try:
+                buf.close()
+            except BufferError:
+                pass
+
+    def read_bytes(self, code: str) -> Optional[bytes]:
+        try:
+            with open(self.path(code), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,103 @@
+import csv
+import gzip
+import io
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# 每批写入的行数：批次之间回调进度，整个导入仍在同一事务内
+DEFAULT_BATCH = 5000
+# 多代码文件的代码列（任选其一）
+CODE_COLUMNS = ('code', 'symbol')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_text(raw) -> io.TextIOBase:
+    """把二进制流包装为逐行读取的文本流；按文件头自动识别 gzip，兼容带 BOM 的 UTF-8。"""
+    buf = raw if isinstance(raw, io.BufferedIOBase) else io.BufferedReader(raw, buffer_size=64 * 1024)
+    if buf.peek(2)[:2] == GZIP_MAGIC:
+        buf = gzip.GzipFile(fileobj=buf, mode='rb')
+    return io.TextIOWrapper(buf, encoding='utf-8-sig', newline='')
+
+
+def open_file(path: str) -> io.TextIOBase:
+    return open_text(open(path, 'rb'))
+
+
+def _num(v, cast=float):
+    v = (v or '').strip()
+    return cast(float(v)) if v else cast(0)
+
+
+class CsvImport:
+    """流式解析日线 CSV（表头含 date/open/high/low/close/volume，可选 code/symbol 列）。
+
+    iter_rows() 逐行产出 (code, date, open, high, low, close, volume) 元组；
+    缺少日期/代码或数值非法的行跳过并计数，errors 保留前几条原因便于排查。
+    """
+
+    MAX_ERRORS = 5
+
+    def __init__(self, text: io.TextIOBase, default_code: Optional[str] = None,
+                 normalize: Callable[[str], str] = lambda s: (s or '').strip().upper()):
+        self.text = text
+        self.normalize = normalize
+        self.default_code = normalize(default_code) if default_code else None
+        self.skipped = 0
+        self.errors = []
+
+    def _skip(self, line: int, reason: str):
+        self.skipped += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(f"line {line}: {reason}")
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        reader = csv.reader(self.text)
+        header = next(reader, None)
+        if not header:
+            return
+        cols = {h.strip().lower(): i for i, h in enumerate(header)}
+        if 'date' not in cols:
+            raise ValueError('csv header must contain a date column')
+        code_idx = next((cols[c] for c in CODE_COLUMNS if c in cols), None)
+        if code_idx is None and not self.default_code:
+            raise ValueError('missing symbol (pass symbol= or add a code column)')
+        idx = [cols.get(c) for c in ('date', 'open', 'high', 'low', 'close', 'volume')]
+        width = len(header)
+        for r in reader:
+            if not r:
+                continue
+            if len(r) < width:
+                r = r + [''] * (width - len(r))
+            code = self.normalize(r[code_idx]) if code_idx is not None else ''
+            code = code or self.default_code
+            date = r[idx[0]].strip()
+            if not code or not date:
+                self._skip(reader.line_num, 'missing code or date')
+                continue
+            try:
+                vals = [_num(r[i]) if i is not None else 0.0 for i in idx[1:5]]
+                volume = _num(r[idx[5]], int) if idx[5] is not None else 0
+            except ValueError as e:
+                self._skip(reader.line_num, str(e))
+                continue
+            yield (code, date, vals[0], vals[1], vals[2], vals[3], volume)
+
+
+def import_csv(text: io.TextIOBase, db, default_code: Optional[str] = None,
+               normalize: Optional[Callable[[str], str]] = None, batch_size: int = DEFAULT_BATCH,
+               progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """把 CSV 文本流导入 StockDatabase，返回 {imported, skipped, symbols: {code: 行数}, errors}。
+
+    progress 每批回调一次 {imported, skipped, symbols: 代码数}。
+    """
+    job = CsvImport(text, default_code, normalize) if normalize else CsvImport(text, default_code)
+
+    def on_batch(counts: Dict[str, int]):
+        progress({'imported': sum(counts.values()), 'skipped': job.skipped, 'symbols': len(counts)})
+
+    counts = db.import_price_rows(job.iter_rows(), batch_size=batch_size, progress=on_batch if progress else None)
+    return {
+        'imported': sum(counts.values()),
+        'skipped': job.skipped,
+        'symbols': counts,
+        'errors': job.errors,
+    }
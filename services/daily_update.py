@@ -5,34 +5,64 @@ import time
 import argparse
 import requests
 import json
-from typing import List
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 
-# 复用本项目的SQLite存储
+# 复用本项目的SQLite存储与上游连接池
 from data_store import StockDatabase
+from upstream import get_client
+import app_config
 
 ALPHA_API_KEY_ENV = "ALPHAVANTAGE_API_KEY"
 ALPHA_BASE = "https://www.alphavantage.co/query"
 
-# 统一配置文件路径
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-CONFIG_DIR = os.path.join(BASE_DIR, 'config')
-CONFIG_PATH = os.path.join(CONFIG_DIR, 'app.json')
+
+# compact 模式只返回最近 100 根日线；缺口（自然日）不超过该值时使用 compact，否则拉取完整历史
+COMPACT_MAX_GAP_DAYS = 120
+# 收盘后（UTC 22:00）才会出现当天的日线
+SESSION_ROLL_UTC_HOUR = 22
+
+LOGS_DIR = os.path.join(BASE_DIR, 'data', 'logs')
+CHECKPOINT_PATH = os.path.join(LOGS_DIR, 'daily_update-checkpoint.json')
+DEFAULT_WORKERS = 4
+# 配额提示（Note/Information）后的退避：从 60 秒起翻倍，最长 15 分钟；单个代码最多重试 5 次
+QUOTA_BACKOFF_START = 60
+QUOTA_BACKOFF_MAX = 900
+MAX_ATTEMPTS = 5
 
 def load_app_config():
+    return app_config.load()
+
+
+def last_session_date(now: float | None = None) -> str:
+    """最近一个已收盘交易日（仅排除周末，不含节假日）。"""
+    t = datetime.datetime.fromtimestamp(now if now is not None else time.time(), datetime.timezone.utc)
+    d = t.date() if t.hour >= SESSION_ROLL_UTC_HOUR else t.date() - datetime.timedelta(days=1)
+    while d.weekday() >= 5:
+        d -= datetime.timedelta(days=1)
+    return d.isoformat()
+
+
+def choose_outputsize(last_date: str | None, today: str) -> str:
+    """按缺口大小选择 compact / full；无历史或日期无法解析时拉取完整历史。"""
+    if not last_date:
+        return 'full'
     try:
-        if not os.path.exists(CONFIG_PATH):
-            return {}
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f) or {}
-    except Exception:
-        return {}
+        gap = (datetime.date.fromisoformat(today) - datetime.date.fromisoformat(last_date[:10])).days
+    except ValueError:
+        return 'full'
+    return 'compact' if gap <= COMPACT_MAX_GAP_DAYS else 'full'
 
 
-def fetch_alpha_daily(symbol: str, api_key: str):
+def fetch_alpha_daily(symbol: str, api_key: str, outputsize: str = 'compact'):
     try:
-        resp = requests.get(ALPHA_BASE, params={
-            'function': 'TIME_SERIES_DAILY_ADJUSTED', 'symbol': symbol, 'apikey': api_key
-        }, timeout=30)
+        resp = get_client().get(ALPHA_BASE, params={
+            'function': 'TIME_SERIES_DAILY_ADJUSTED', 'symbol': symbol, 'apikey': api_key,
+            'outputsize': outputsize
+        })
         resp.raise_for_status()
         j = resp.json()
         # 配额/次数用尽检测
@@ -85,13 +115,273 @@ def load_symbols(file_path: str | None, symbols_arg: List[str] | None) -> List[s
     return uniq
 
 
+class TokenBucket:
+    """令牌桶限速（线程安全）：每分钟 rate 个请求，最多累积 burst 个；pause() 让所有请求方暂停一段时间。"""
+
+    def __init__(self, rate_per_min: float, burst: int = 1):
+        self.interval = 60.0 / max(rate_per_min, 0.01)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) / self.interval)
+        self._last = now
+
+    def acquire(self, cancel: Optional[threading.Event] = None) -> bool:
+        """阻塞直到取得令牌；cancel 被置位时返回 False。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) * self.interval
+                else:
+                    wait = self._paused_until - now
+            if cancel is not None:
+                if cancel.wait(min(wait, 1.0)):
+                    return False
+            else:
+                time.sleep(min(wait, 1.0))
+
+    def pause(self, seconds: float):
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            # 暂停结束后从空桶开始，避免恢复瞬间集中请求
+            self._tokens = 0.0
+            self._last = self._paused_until
+
+
+class Checkpoint:
+    """断点文件：记录本次清单、目标交易日与已完成代码；同一交易日以相同清单重跑时跳过已完成部分。"""
+
+    def __init__(self, path: str, symbols: List[str], session: str = '', resume: bool = True):
+        self.path = path
+        self.symbols = list(symbols)
+        self.session = session
+        self.done = set()
+        self._lock = threading.Lock()
+        if resume:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f) or {}
+                if data.get('symbols') == self.symbols and data.get('session') == self.session:
+                    self.done = set(data.get('done') or [])
+            except Exception:
+                pass
+
+    def mark(self, code: str):
+        with self._lock:
+            self.done.add(code)
+            data = {'symbols': self.symbols, 'session': self.session, 'done': sorted(self.done),
+                    'updated_ts': int(time.time())}
+            # 网关内的任务与命令行/计划任务可能共用同一断点文件，临时文件按进程与线程区分
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except Exception:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _quota_kind(note: str) -> str:
+    """区分配额提示：'rate'（每分钟频率，退避后可重试）、'daily'（当日额度用尽）、'premium'（接口需付费）。
+
+    各类提示末尾都附有 https://www.alphavantage.co/premium/ 链接，只有明确写出 "premium endpoint" 才视为付费接口。
+    """
+    n = (note or '').lower()
+    if 'per minute' in n or 'frequency' in n:
+        return 'rate'
+    if 'premium endpoint' in n:
+        return 'premium'
+    if 'per day' in n or 'daily' in n:
+        return 'daily'
+    return 'rate'
+
+
+def run_update(symbols: List[str], api_key: str, rate_per_min: float, workers: int = DEFAULT_WORKERS,
+               burst: int = 1, full: bool = False, checkpoint_path: Optional[str] = CHECKPOINT_PATH,
+               on_event: Optional[Callable[[str, Dict], None]] = None,
+               cancel: Optional[threading.Event] = None) -> Dict:
+    """按配额并发执行增量更新，返回统计 {ok, fail, skipped, written, resumed, stopped, failed}。
+
+    - 令牌桶控制请求速率，workers 个线程在该预算内并行拉取；
+    - 遇到配额提示时全体暂停并指数退避后重试该代码；提示为每日额度用尽时停止本次运行；
+    - 每完成一个代码写入断点文件（checkpoint_path=None 时不记录），全部完成后删除。
+    on_event(kind, data) 在 start / symbol / done 时回调，kind='symbol' 的 data 含 code、status 与说明。
+    """
+    emit = on_event or (lambda kind, data: None)
+    cancel = cancel or threading.Event()
+    bucket = TokenBucket(rate_per_min, burst)
+    session = last_session_date()
+    ckpt = Checkpoint(checkpoint_path, symbols, session) if checkpoint_path else None
+    resumed = len(ckpt.done) if ckpt else 0
+    pending = [c for c in symbols if not (ckpt and c in ckpt.done)]
+    stats = {'ok': 0, 'fail': 0, 'skipped': 0, 'written': 0, 'resumed': resumed, 'stopped': None, 'failed': []}
+    lock = threading.Lock()
+    backoff = {'seconds': QUOTA_BACKOFF_START}
+    stop = threading.Event()
+    emit('start', {'total': len(symbols), 'pending': len(pending), 'resumed': resumed})
+
+    def finish(code: str, status: str, **info):
+        with lock:
+            stats['ok' if status in ('ok', 'skipped') else 'fail'] += 1
+            if status == 'skipped':
+                stats['skipped'] += 1
+            elif status == 'fail':
+                stats['failed'].append(code)
+            stats['written'] += info.get('written', 0)
+            done = stats['ok'] + stats['fail']
+        if ckpt and status != 'fail':
+            ckpt.mark(code)
+        emit('symbol', dict(info, code=code, status=status, done=done + resumed, total=len(symbols)))
+
+    def work(code: str):
+        if stop.is_set() or cancel.is_set():
+            return
+        db = StockDatabase()
+        try:
+            # 水位已覆盖最近一个已收盘交易日时无需请求上游
+            mark = None if full else db.get_watermark(code)
+            if mark and mark.get('last_date') and mark['last_date'] >= session:
+                return finish(code, 'skipped', message=f"已是最新（{mark['last_date']}）")
+            outputsize = 'full' if full else choose_outputsize(mark and mark.get('last_date'), session)
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                if not bucket.acquire(cancel) or stop.is_set():
+                    return
+                data = fetch_alpha_daily(code, api_key, outputsize)
+                if 'rows' in data:
+                    with lock:
+                        backoff['seconds'] = QUOTA_BACKOFF_START
+                    n = db.upsert_new_prices(code, data['rows'])
+                    last_date = max([r['date'] for r in data['rows']] + [(mark or {}).get('last_date') or ''])
+                    db.set_watermark(code, last_date or None, n)
+                    return finish(code, 'ok', written=n, outputsize=outputsize,
+                                  message=f"返回 {len(data['rows'])} 条，新增/变更 {n} 条")
+                if data.get('reason') == 'quota':
+                    note = data.get('note') or data.get('error') or ''
+                    kind = _quota_kind(note)
+                    if kind != 'rate':
+                        with lock:
+                            # 多个线程可能同时触发，保留第一个原因
+                            stats['stopped'] = stats['stopped'] or (
+                                'daily quota exhausted' if kind == 'daily' else 'premium endpoint')
+                        stop.set()
+                        emit('quota', {'code': code, 'note': note, 'stopped': True})
+                        return
+                    with lock:
+                        wait = backoff['seconds']
+                        backoff['seconds'] = min(wait * 2, QUOTA_BACKOFF_MAX)
+                    bucket.pause(wait)
+                    emit('quota', {'code': code, 'note': note, 'backoff': wait, 'attempt': attempt})
+                    continue
+                if data.get('reason') == 'network' and attempt < 3:
+                    bucket.pause(5 * attempt)
+                    continue
+                return finish(code, 'fail', message=data.get('error'), reason=data.get('reason'))
+            return finish(code, 'fail', message='quota retries exhausted', reason='quota')
+        except Exception as e:
+            return finish(code, 'fail', message=str(e))
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='daily-update') as pool:
+        list(pool.map(work, pending))
+    with lock:
+        if cancel.is_set() and not stats['stopped']:
+            stats['stopped'] = 'cancelled'
+        completed = not stats['stopped'] and not stats['failed']
+        summary = dict(stats)
+    if ckpt and completed:
+        ckpt.clear()
+    emit('done', summary)
+    return stats
+
+
+def _print_event(kind: str, data: Dict, file=None):
+    if kind == 'start':
+        extra = f"；从断点恢复，跳过已完成 {data['resumed']} 个" if data['resumed'] else ''
+        print(f"[INFO] 本次增量更新股票数：{data['total']}{extra}；源：Alpha Vantage；写入：SQLite", file=file, flush=True)
+    elif kind == 'symbol':
+        tag = {'ok': 'OK', 'skipped': 'SKIP', 'fail': 'FAIL'}[data['status']]
+        print(f"[{tag}] ({data['done']}/{data['total']}) {data['code']} {data.get('message') or ''}", file=file, flush=True)
+    elif kind == 'quota':
+        if data.get('stopped'):
+            print(f"[STOP] 额度用尽或接口受限，停止本次运行（下次运行将从断点继续）｜{data['note']}", file=file, flush=True)
+        else:
+            print(f"[WAIT] {data['code']} 触发配额限制，全部请求暂停 {data['backoff']} 秒后重试｜{data['note']}", file=file, flush=True)
+
+
+def _num_cfg(cfg: dict, name: str, default):
+    try:
+        v = float(cfg.get(name) or default)
+        return v if v > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+def resolve_settings(cfg: dict, rate: Optional[float] = None, workers: Optional[int] = None, sleep: int = 15):
+    """速率/并发/突发量：参数优先，其次配置 alphaRateLimit / updateWorkers / alphaBurst，最后按 sleep 换算。"""
+    rate = rate or _num_cfg(cfg, 'alphaRateLimit', 60.0 / max(sleep, 1))
+    workers = workers or int(_num_cfg(cfg, 'updateWorkers', DEFAULT_WORKERS))
+    burst = int(_num_cfg(cfg, 'alphaBurst', 1))
+    return rate, workers, burst
+
+
+def write_summary(path: Optional[str], start_ts: int, end_ts: int, stats: Dict, symbols: List[str],
+                  rate: float, workers: int, sleep: int, log_path: Optional[str] = None, **extra):
+    """写入执行摘要，便于前端查询最近一次状态。"""
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    summary = {
+        'start_ts': start_ts,
+        'end_ts': end_ts,
+        'ok': stats['ok'],
+        'fail': stats['fail'],
+        'skipped': stats['skipped'],
+        'written': stats['written'],
+        'resumed': stats['resumed'],
+        'stopped': stats['stopped'],
+        'failed': stats['failed'],
+        'rate_per_min': rate,
+        'workers': workers,
+        'sleep': sleep,
+        'symbols': symbols,
+        'log_path': log_path,
+        'db_path': os.path.join(BASE_DIR, 'data', 'stocks.db')
+    }
+    summary.update(extra)
+    with open(path or os.path.join(LOGS_DIR, 'daily_update-last.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
 def main():
     parser = argparse.ArgumentParser(description='AlphaCouncil 每日增量更新：从 Alpha Vantage 拉取日线并写入本地SQLite')
     parser.add_argument('-f', '--file', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'symbols.txt'), help='股票清单文件路径')
     parser.add_argument('-s', '--symbols', nargs='*', help='以逗号分隔的股票代码列表，如 AAPL,IBM')
-    parser.add_argument('--sleep', type=int, default=15, help='每次外部请求之间的休眠秒数（免费额度建议>=12）')
+    parser.add_argument('--sleep', type=int, default=15, help='未配置速率时，按每次请求间隔秒数换算速率（免费额度建议>=12）')
+    parser.add_argument('--rate', type=float, default=None, help='每分钟请求数（默认读取配置 alphaRateLimit，否则为 60/sleep）')
+    parser.add_argument('--workers', type=int, default=None, help=f'并发拉取线程数（默认读取配置 updateWorkers，否则为 {DEFAULT_WORKERS}）')
+    parser.add_argument('--fresh', action='store_true', help='忽略断点文件，从头执行')
     parser.add_argument('--summary', default=None, help='执行摘要JSON输出路径')
     parser.add_argument('--log', default=None, help='日志文件路径（由外部进程管理）')
+    parser.add_argument('--full', action='store_true', help='忽略水位，拉取完整历史并校对全部记录')
     args = parser.parse_args()
 
     cfg = load_app_config()
@@ -105,57 +395,22 @@ def main():
         print("[WARN] 未提供股票代码；请在 data/symbols.txt 写入或通过 --symbols 指定")
         sys.exit(0)
 
+    rate, workers, burst = resolve_settings(cfg, args.rate, args.workers, args.sleep)
+    if args.fresh:
+        Checkpoint(CHECKPOINT_PATH, symbols, resume=False).clear()
+
     start_ts = int(time.time())
-    print(f"[INFO] 本次增量更新股票数：{len(symbols)}；源：Alpha Vantage；写入：SQLite")
-    db = StockDatabase()
-    ok, fail = 0, 0
-    for i, code in enumerate(symbols, start=1):
-        print(f"[INFO] ({i}/{len(symbols)}) 拉取 {code} …")
-        data = fetch_alpha_daily(code, api_key)
-        if 'rows' in data:
-            try:
-                db.upsert_daily_prices(code, data['rows'])
-                ok += 1
-                print(f"[OK] {code} 写入 {len(data['rows'])} 条记录")
-            except Exception as e:
-                fail += 1
-                print(f"[FAIL] {code} 写入失败：{e}")
-        else:
-            fail += 1
-            reason = data.get('reason')
-            if reason == 'quota':
-                print(f"[FAIL] {code} 拉取失败：API 次数用完或配额受限｜{data.get('note') or data.get('error')}")
-            elif (data.get('error') or '').startswith('Timeout') or (data.get('error') or '').startswith('ConnectionError'):
-                print(f"[FAIL] {code} 拉取失败：网络问题或上游不可达｜{data.get('error')}")
-            else:
-                print(f"[FAIL] {code} 拉取失败：{data.get('error')}")
-        if i < len(symbols):
-            time.sleep(args.sleep)
-    db.close()
+    print(f"[INFO] 速率：每分钟 {rate:g} 次，并发 {workers}", flush=True)
+    stats = run_update(symbols, api_key, rate, workers=workers, burst=burst, full=args.full,
+                       on_event=_print_event)
     end_ts = int(time.time())
-    print(f"[DONE] 成功：{ok}，失败：{fail}，数据库：ABC/data/stocks.db")
-
-    # 写入执行摘要，便于前端查询最近一次状态
+    print(f"[DONE] 成功：{stats['ok']}（已最新跳过 {stats['skipped']}），失败：{stats['fail']}，"
+          f"写入 {stats['written']} 条，数据库：ABC/data/stocks.db")
     try:
-        base_dir = os.path.dirname(os.path.dirname(__file__))
-        logs_dir = os.path.join(base_dir, 'data', 'logs')
-        os.makedirs(logs_dir, exist_ok=True)
-        summary_path = args.summary or os.path.join(logs_dir, 'daily_update-last.json')
-        summary = {
-            'start_ts': start_ts,
-            'end_ts': end_ts,
-            'ok': ok,
-            'fail': fail,
-            'sleep': args.sleep,
-            'symbols': symbols,
-            'log_path': args.log,
-            'db_path': os.path.join(base_dir, 'data', 'stocks.db')
-        }
-        with open(summary_path, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
+        write_summary(args.summary, start_ts, end_ts, stats, symbols, rate, workers, args.sleep, args.log)
     except Exception as e:
         print(f"[WARN] 摘要写入失败：{e}")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,49 +2,100 @@
 import json
 import sys
 import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import time
 import requests
-import csv
+import io
+import tarfile
+import queue
 import subprocess
 import threading
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 try:
     import websockets
 except Exception:
     websockets = None
 
-# 简易内存缓存，降低免费API速率压力
-CACHE = {}
-CACHE_TTL = 60  # 秒
+from http_pool import PooledHTTPServer, RequestBody
+import app_config
+from upstream import get_client
+from quote_hub import QuoteHub, DeltaSubscriber, queue_sink
+import indicators
+import analysis
+import csv_import
+import columnar
+from singleflight import SingleFlight
+from jobs import JobManager, ACTIVE
+from response_cache import ResponseCache, DiskCache
+
+CACHE_TTL = 60  # 秒（未配置策略的键默认 TTL）
+# 日线在收盘后（UTC 22:00，覆盖美股夏/冬令时）才会出现新 bar，缓存到下一个交易时段
+SESSION_ROLL_UTC_HOUR = 22
+
+
+def _next_session_ts(now: float) -> float:
+    t = int(now // 86400) * 86400 + SESSION_ROLL_UTC_HOUR * 3600
+    if t <= now:
+        t += 86400
+    while time.gmtime(t).tm_wday >= 5:
+        t += 86400
+    return t
+
+
+# 按数据类型设置 TTL 与过期后可继续返回旧值的宽限期（stale-while-revalidate）
+CACHE_POLICIES = {
+    'global_quote': {'ttl': 15, 'stale': 60},
+    'daily': {'ttl': _next_session_ts, 'stale': 86400},
+    'overview': {'ttl': 12 * 3600, 'stale': 7 * 86400},
+    'news': {'ttl': 15 * 60, 'stale': 3600},
+}
+# 二级缓存落盘到 data/response_cache.db，网关重启后首屏无需重新拉取
+CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'response_cache.db')
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """有界 LRU 缓存，降低免费API速率压力且内存不随浏览的代码数无限增长。
+
+    首次使用时创建：Windows 下进程池以 spawn 启动子进程会重新导入本模块，模块级对象会在每个子进程里再建一份。
+    """
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = ResponseCache(max_entries=2000, max_bytes=32 * 1024 * 1024,
+                                       policies=CACHE_POLICIES, default_ttl=CACHE_TTL,
+                                       backend=DiskCache(CACHE_DB_PATH))
+    return _CACHE
+
+# 在途请求登记：相同缓存键的并发未命中只向上游发起一次
+_INFLIGHT = SingleFlight()
+_REFRESHING = set()
+_REFRESH_LOCK = threading.Lock()
 
 ALLOW_ORIGIN = "*"
 
-# 统一配置文件路径
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-CONFIG_DIR = os.path.join(BASE_DIR, 'config')
-CONFIG_PATH = os.path.join(CONFIG_DIR, 'app.json')
 AUDIT_DIR = os.path.join(BASE_DIR, 'data', 'logs')
 AUDIT_LOG = os.path.join(AUDIT_DIR, 'config_audit.log')
 _RL_BUCKETS = {}
-
-def _load_config():
-    try:
-        if not os.path.exists(CONFIG_PATH):
-            return {}
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f) or {}
-    except Exception:
-        return {}
-
-def _save_config(patch: dict):
-    os.makedirs(CONFIG_DIR, exist_ok=True)
-    current = _load_config()
-    current.update({k:v for k,v in patch.items() if v is not None})
-    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        json.dump(current, f, ensure_ascii=False, indent=2)
+_RL_LOCK = threading.Lock()
+
+# 并发服务：本地读取（SQLite/配置）与外部请求分通道，互不阻塞
+DEFAULT_WORKERS = 8
+DEFAULT_LOCAL_WORKERS = 4
+DEFAULT_QUEUE = 64
+# 长连接推送（SSE）单独成通道：每个连接占用一个线程最长 SSE_MAX_SECONDS，满额时直接拒绝（浏览器按 retry 重连），
+# 不占用 upstream/local 通道的线程；并发数可用 gatewayEventStreams 配置
+DEFAULT_EVENT_STREAMS = 8
+_EVENT_PATHS = ('/data/jobs/events',)
+_LOCAL_PATHS = ('/data/history_local', '/config', '/data/daily_update_status', '/data/schedule/status', '/data/stats',
+                '/data/run_daily_update', '/data/jobs', '/data/jobs/cancel', '/data/screen', '/data/news/search',
+                '/data/analyze_batch', '/data/columnar/export')
 
 def _client_ip(handler: BaseHTTPRequestHandler) -> str:
     try:
@@ -53,7 +104,7 @@ def _client_ip(handler: BaseHTTPRequestHandler) -> str:
         return 'unknown'
 
 def _allowed_ip(ip: str) -> bool:
-    cfg = _load_config()
+    cfg = app_config.load()
     lst = cfg.get('allowed_ips')
     if isinstance(lst, list) and lst:
         return ip in lst
@@ -63,35 +114,78 @@ def _allowed_ip(ip: str) -> bool:
 def _rate_limit_hit(bucket: str, ip: str, limit: int, window_sec: int = 60) -> bool:
     now = time.time()
     key = f"{bucket}:{ip}"
-    arr = _RL_BUCKETS.get(key) or []
-    arr = [t for t in arr if now - t < window_sec]
-    if len(arr) >= limit:
+    with _RL_LOCK:
+        arr = _RL_BUCKETS.get(key) or []
+        arr = [t for t in arr if now - t < window_sec]
+        if len(arr) >= limit:
+            _RL_BUCKETS[key] = arr
+            return True
+        arr.append(now)
         _RL_BUCKETS[key] = arr
-        return True
-    arr.append(now)
-    _RL_BUCKETS[key] = arr
-    return False
+        return False
+
+def _request_lane(method: str, path: str, query: str) -> str:
+    """按请求行选择线程池通道：本地读取走 local，SSE 推送走 events，其余（外部请求/较重任务）走 upstream。"""
+    if method == 'GET' and path in _EVENT_PATHS:
+        return 'events'
+    if method == 'OPTIONS' or path in _LOCAL_PATHS:
+        return 'local'
+    if path in ('/data/analyze', '/data/indicators') and 'source=local' in (query or '').lower():
+        return 'local'
+    return 'upstream'
+
+def _int_cfg(cfg: dict, name: str, default: int) -> int:
+    try:
+        v = int(cfg.get(name) or default)
+        return v if v > 0 else default
+    except (TypeError, ValueError):
+        return default
 
 ALPHA_API_KEY_ENV = "ALPHAVANTAGE_API_KEY"
 ALPHA_BASE = "https://www.alphavantage.co/query"
 
 
 def _cache_get(key):
-    item = CACHE.get(key)
-    if not item:
-        return None
-    ts, val = item
-    if time.time() - ts > CACHE_TTL:
-        return None
-    return val
+    """仅返回未过期的缓存值（用于拉取前复查，不计入命中统计）。"""
+    val, state = get_cache().get(key, record=False)
+    return val if state == 'fresh' else None
 
 
 def _cache_set(key, val):
-    CACHE[key] = (time.time(), val)
+    get_cache().set(key, val)
+
+
+def _cached_or_fetch(cache_key: str, fetch):
+    """缓存命中直接返回；过期但在宽限期内先返回旧值并后台刷新；未命中则合并在途请求后拉取。"""
+    val, state = get_cache().get(cache_key)
+    if state == 'fresh':
+        return val
+    if state == 'stale':
+        _refresh_in_background(cache_key, fetch)
+        return val
+    return _INFLIGHT.do(cache_key, fetch)
+
+
+def _refresh_in_background(cache_key: str, fetch):
+    with _REFRESH_LOCK:
+        if cache_key in _REFRESHING:
+            return
+        _REFRESHING.add(cache_key)
+
+    def run():
+        try:
+            _INFLIGHT.do(cache_key, fetch)
+        except Exception:
+            pass
+        finally:
+            with _REFRESH_LOCK:
+                _REFRESHING.discard(cache_key)
+
+    threading.Thread(target=run, name=f"refresh-{cache_key}", daemon=True).start()
 
 
 def _get_alpha_key():
-    cfg = _load_config()
+    cfg = app_config.load()
     return (cfg.get('alphaKey') or os.environ.get(ALPHA_API_KEY_ENV))
 
 
@@ -111,13 +205,17 @@ def fetch_alpha_global_quote(symbol: str):
         return {"error": f"missing {ALPHA_API_KEY_ENV}"}
     sym = normalize_symbol(symbol)
     cache_key = f"global_quote:{sym}"
+    return _cached_or_fetch(cache_key, lambda: _fetch_global_quote(sym, key, cache_key))
+
+
+def _fetch_global_quote(sym: str, key: str, cache_key: str):
     c = _cache_get(cache_key)
     if c:
         return c
     try:
-        resp = requests.get(ALPHA_BASE, params={
+        resp = get_client().get(ALPHA_BASE, params={
             'function': 'GLOBAL_QUOTE', 'symbol': sym, 'apikey': key
-        }, timeout=20)
+        })
         resp.raise_for_status()
         j = resp.json()
         # 配额/次数用尽检测
@@ -155,13 +253,17 @@ def fetch_alpha_daily(symbol: str):
         return {"error": f"missing {ALPHA_API_KEY_ENV}"}
     sym = normalize_symbol(symbol)
     cache_key = f"daily:{sym}"
+    return _cached_or_fetch(cache_key, lambda: _fetch_daily(sym, key, cache_key))
+
+
+def _fetch_daily(sym: str, key: str, cache_key: str):
     c = _cache_get(cache_key)
     if c:
         return c
     try:
-        resp = requests.get(ALPHA_BASE, params={
+        resp = get_client().get(ALPHA_BASE, params={
             'function': 'TIME_SERIES_DAILY', 'symbol': sym, 'apikey': key
-        }, timeout=30)
+        })
         resp.raise_for_status()
         j = resp.json()
         note = j.get('Note') or j.get('Information')
@@ -181,9 +283,9 @@ def fetch_alpha_daily(symbol: str):
             _cache_set(cache_key, data)
             return data
         # fallback: 使用60分钟级别最近100条近似替代
-        resp2 = requests.get(ALPHA_BASE, params={
+        resp2 = get_client().get(ALPHA_BASE, params={
             'function': 'TIME_SERIES_INTRADAY', 'symbol': sym, 'interval': '60min', 'apikey': key
-        }, timeout=30)
+        })
         resp2.raise_for_status()
         j2 = resp2.json()
         series2 = j2.get('Time Series (60min)') or {}
@@ -210,22 +312,52 @@ def fetch_alpha_daily(symbol: str):
         return {"error": str(e)}
 
 
+def _stored(method: str, *args):
+    """调用本地库的基本面/新闻读写方法；库不可用时返回 None，不影响在线拉取。"""
+    try:
+        from data_store import StockDatabase
+        db = StockDatabase()
+        try:
+            return getattr(db, method)(*args)
+        finally:
+            db.close()
+    except Exception:
+        return None
+
+
+def _stale_fallback(err: dict, stored):
+    """在线拉取失败（配额/网络）时退回本地已存的旧数据，并标记 stale。"""
+    if stored:
+        return dict(stored, stale=True, stale_reason=err.get('reason') or err.get('error'))
+    return err
+
+
 def fetch_alpha_overview(symbol: str):
-    key = _get_alpha_key()
-    if not key:
-        return {"error": f"missing {ALPHA_API_KEY_ENV}"}
     sym = normalize_symbol(symbol)
     cache_key = f"overview:{sym}"
+    return _cached_or_fetch(cache_key, lambda: _fetch_overview(sym, cache_key))
+
+
+def _fetch_overview(sym: str, cache_key: str):
     c = _cache_get(cache_key)
     if c:
         return c
+    # 先读本地库：新鲜期内（默认 7 天）直接使用，不消耗配额
+    stored = _stored('get_overview', sym)
+    if stored:
+        _cache_set(cache_key, stored)
+        return stored
+    key = _get_alpha_key()
+    if not key:
+        return _stale_fallback({"error": f"missing {ALPHA_API_KEY_ENV}"}, _stored('get_overview', sym, None))
     try:
-        resp = requests.get(ALPHA_BASE, params={'function': 'OVERVIEW', 'symbol': sym, 'apikey': key}, timeout=20)
+        resp = get_client().get(ALPHA_BASE, params={'function': 'OVERVIEW', 'symbol': sym, 'apikey': key})
         resp.raise_for_status()
         j = resp.json()
         note = j.get('Note') or j.get('Information')
         if note:
-            return {"error": "alpha vantage quota exceeded", "reason": "quota", "note": note}
+            err = {"error": "alpha vantage quota exceeded", "reason": "quota", "note": note}
+            return _stale_fallback(err, _stored('get_overview', sym, None))
         data = {
             'Symbol': j.get('Symbol'),
             'Name': j.get('Name'),
@@ -238,36 +370,55 @@ def fetch_alpha_overview(symbol: str):
             'ROE': j.get('ReturnOnEquityTTM'),
             'DebtToEquity': j.get('QuarterlyDebtToEquity'),
         }
+        # 空响应（代码不存在等）不入库
+        if data['Symbol']:
+            _stored('save_overview', sym, data)
         _cache_set(cache_key, data)
         return data
     except requests.exceptions.HTTPError as e:
-        return {"error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": getattr(e.response, 'text', '')}
+        err = {"error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": getattr(e.response, 'text', '')}
     except requests.exceptions.Timeout as e:
-        return {"error": f"Timeout {e}", "reason": "network"}
+        err = {"error": f"Timeout {e}", "reason": "network"}
     except requests.exceptions.ConnectionError as e:
-        return {"error": f"ConnectionError {e}", "reason": "network"}
+        err = {"error": f"ConnectionError {e}", "reason": "network"}
     except Exception as e:
-        return {"error": str(e)}
+        err = {"error": str(e)}
+    return _stale_fallback(err, _stored('get_overview', sym, None))
 
 
 def fetch_alpha_news(symbol: str):
-    key = _get_alpha_key()
-    if not key:
-        return {"error": f"missing {ALPHA_API_KEY_ENV}"}
     sym = normalize_symbol(symbol)
     cache_key = f"news:{sym}"
+    return _cached_or_fetch(cache_key, lambda: _fetch_news(symbol, sym, cache_key))
+
+
+def _stored_news(symbol: str, sym: str, *max_age):
+    stored = _stored('get_news', sym, *max_age)
+    return dict(stored, symbol=symbol) if stored else None
+
+
+def _fetch_news(symbol: str, sym: str, cache_key: str):
     c = _cache_get(cache_key)
     if c:
         return c
+    # 先读本地库：最近一次拉取在新鲜期内（默认 1 小时）直接使用
+    stored = _stored_news(symbol, sym)
+    if stored:
+        _cache_set(cache_key, stored)
+        return stored
+    key = _get_alpha_key()
+    if not key:
+        return _stale_fallback({"error": f"missing {ALPHA_API_KEY_ENV}"}, _stored_news(symbol, sym, None))
     try:
-        resp = requests.get(ALPHA_BASE, params={
+        resp = get_client().get(ALPHA_BASE, params={
             'function': 'NEWS_SENTIMENT', 'tickers': sym, 'apikey': key
-        }, timeout=20)
+        })
         resp.raise_for_status()
         j = resp.json()
         note = j.get('Note') or j.get('Information')
         if note:
-            return {"error": "alpha vantage quota exceeded", "reason": "quota", "note": note}
+            err = {"error": "alpha vantage quota exceeded", "reason": "quota", "note": note}
+            return _stale_fallback(err, _stored_news(symbol, sym, None))
         feed = j.get('feed') or []
         data = [{
             'title': item.get('title'),
@@ -277,16 +428,154 @@ def fetch_alpha_news(symbol: str):
             'sentiment': item.get('overall_sentiment_score'),
             'source': item.get('source')
         } for item in feed][:50]
-        _cache_set(cache_key, data)
-        return {'symbol': symbol, 'items': data, 'count': len(data)}
+        _stored('save_news', sym, data)
+        result = {'symbol': symbol, 'items': data, 'count': len(data)}
+        _cache_set(cache_key, result)
+        return result
     except requests.exceptions.HTTPError as e:
-        return {"error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": getattr(e.response, 'text', '')}
+        err = {"error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": getattr(e.response, 'text', '')}
     except requests.exceptions.Timeout as e:
-        return {"error": f"Timeout {e}", "reason": "network"}
+        err = {"error": f"Timeout {e}", "reason": "network"}
     except requests.exceptions.ConnectionError as e:
-        return {"error": f"ConnectionError {e}", "reason": "network"}
+        err = {"error": f"ConnectionError {e}", "reason": "network"}
     except Exception as e:
-        return {"error": str(e)}
+        err = {"error": str(e)}
+    return _stale_fallback(err, _stored_news(symbol, sym, None))
+
+
+WS_PUSH_INTERVAL = 2  # 秒
+WS_BATCH_WINDOW = 0.25  # 秒：多代码订阅时合并同一批次内到达的行情
+WS_MAX_SYMBOLS = 500  # 单连接最多订阅代码数
+WS_HUB = None
+
+
+def _ws_request_path(websocket, path=None) -> str:
+    """兼容 websockets 新旧版本：旧版以参数传入 path，新版从 websocket.request.path 读取。"""
+    if path:
+        return path
+    req = getattr(websocket, 'request', None)
+    return getattr(req, 'path', None) or getattr(websocket, 'path', None) or '/'
+
+
+def _ws_quote_payload(symbol: str) -> dict:
+    # 读取 Alpha Vantage（含缓存），构造统一payload
+    # 拉取失败（含配额用尽）时不带 last/volume，订阅者保留上次的价格，只收到 error/note
+    data = fetch_alpha_global_quote(symbol)
+    if data.get('error'):
+        payload = {'symbol': symbol, 'error': data['error'], 'ts': int(time.time())}
+        if data.get('note'):
+            payload['note'] = data['note']
+        return payload
+    return {
+        'symbol': data.get('symbol') or symbol,
+        'last': data.get('price') or data.get('close') or 0,
+        'volume': data.get('volume') or 0,
+        'error': None,
+        'note': None,
+        'ts': int(time.time())
+    }
+
+
+_SCREEN_POOL = None
+_SCREEN_WORKERS = 1
+_SCREEN_LOCK = threading.Lock()
+
+
+def _get_screen_pool() -> ProcessPoolExecutor:
+    """批量分析进程池（首次使用时创建，规模可由 config/app.json 的 screenWorkers 配置）。"""
+    global _SCREEN_POOL, _SCREEN_WORKERS
+    with _SCREEN_LOCK:
+        if _SCREEN_POOL is None:
+            _SCREEN_WORKERS = _int_cfg(app_config.load(), 'screenWorkers', min(8, os.cpu_count() or 2))
+            _SCREEN_POOL = ProcessPoolExecutor(max_workers=_SCREEN_WORKERS)
+        return _SCREEN_POOL
+
+
+_JOBS = None
+_JOBS_LOCK = threading.Lock()
+
+
+def get_jobs() -> JobManager:
+    """进程内任务队列：每日增量更新在网关内运行，进度通过 /data/jobs/events（SSE）推送。
+
+    首次使用时创建（其执行线程随之启动），进程池的 spawn 子进程导入本模块时不会启动。
+    """
+    global _JOBS
+    if _JOBS is None:
+        with _JOBS_LOCK:
+            if _JOBS is None:
+                _JOBS = JobManager()
+    return _JOBS
+
+# 单个 SSE 连接的最长保持时间（秒），到期后由浏览器自动重连
+SSE_MAX_SECONDS = 600
+SSE_KEEPALIVE = 15
+
+
+def _daily_update_job(symbols: list, sleep: int, full: bool, log_path: str, summary_path: str):
+    """构造每日增量任务：在任务线程中调用 daily_update.run_update，事件同时写入日志并推送给订阅者。"""
+    def run(job):
+        import daily_update
+        api_key = _get_alpha_key()
+        if not api_key:
+            raise RuntimeError(f"missing {ALPHA_API_KEY_ENV}")
+        rate, workers, burst = daily_update.resolve_settings(app_config.load(), sleep=sleep)
+        start_ts = int(time.time())
+        with open(log_path, 'w', encoding='utf-8') as log:
+            def on_event(kind, data):
+                daily_update._print_event(kind, data, file=log)
+                job.emit(kind, data)
+            stats = daily_update.run_update(symbols, api_key, rate, workers=workers, burst=burst, full=full,
+                                            on_event=on_event, cancel=job.cancel_event)
+        daily_update.write_summary(summary_path, start_ts, int(time.time()), stats, symbols, rate, workers,
+                                   sleep, log_path, job_id=job.id)
+        return stats
+    return run
+
+
+def _columnar_rows(stream):
+    """解析上传的列式文件（单个 .bin 或 tar 包），逐行产出 (code, date, open, high, low, close, volume)。"""
+    if stream.peek(4)[:4] == columnar.MAGIC:
+        files = [stream.read()]
+    else:
+        files = _tar_members(stream)
+    for buf in files:
+        cols = columnar.decode(buf)
+        code = cols['code']
+        if not code:
+            raise ValueError('columnar file without symbol')
+        yield from zip([code] * len(cols['date']), columnar.date_strings(cols['date']),
+                       *(cols[c].tolist() for c in ('open', 'high', 'low', 'close', 'volume')))
+
+
+def _tar_members(stream):
+    with tarfile.open(fileobj=stream, mode='r|*') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(columnar.SUFFIX):
+                yield tar.extractfile(member).read()
+
+
+def _screen_universe(symbols_q: str, universe: str) -> list:
+    """批量分析的代码集合：symbols 显式列表 / universe=db 本地库全部代码 / universe=file 股票清单。"""
+    if symbols_q:
+        syms = [normalize_symbol(x) for x in symbols_q.split(',') if x.strip()]
+    elif universe == 'db':
+        from data_store import StockDatabase
+        db = StockDatabase()
+        syms = [r[0] for r in db.conn.execute('SELECT DISTINCT code FROM daily_price').fetchall()]
+        db.close()
+    elif universe == 'file':
+        # 与 daily_update 一致：按清单原样作为入库代码
+        path = os.path.join(BASE_DIR, 'data', 'symbols.txt')
+        syms = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                x = line.split('#')[0].strip()
+                if x:
+                    syms.append(x)
+    else:
+        return []
+    return list(dict.fromkeys(syms))
 
 
 class Handler(BaseHTTPRequestHandler):
@@ -307,6 +596,16 @@ class Handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
 
+    def _write_bytes(self, code: int, data: bytes, content_type: str, filename: str = None):
+        self.send_response(code)
+        self._set_cors()
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if filename:
+            self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.end_headers()
+        self.wfile.write(data)
+
     def _read_json(self):
         length = int(self.headers.get('Content-Length') or '0')
         if length <= 0:
@@ -317,6 +616,123 @@ class Handler(BaseHTTPRequestHandler):
         except Exception:
             return {}
 
+    def _start_stream(self, content_type: str = 'application/x-ndjson'):
+        """开始流式响应：不设置 Content-Length，写完后关闭连接。"""
+        self.close_connection = True
+        self.send_response(200)
+        self._set_cors()
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _write_line(self, obj):
+        self.wfile.write((json.dumps(obj, ensure_ascii=False) + "\n").encode('utf-8'))
+        self.wfile.flush()
+
+    def _write_event(self, event: str, data, event_id=None):
+        msg = f"event: {event}\n"
+        if event_id is not None:
+            msg += f"id: {event_id}\n"
+        msg += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        self.wfile.write(msg.encode('utf-8'))
+        self.wfile.flush()
+
+    def _stream_job_events(self, job=None):
+        # 先订阅再发送快照，避免两者之间的事件丢失
+        q = get_jobs().subscribe(job.id if job else None)
+        try:
+            self._start_stream('text/event-stream')
+            self.wfile.write(b'retry: 3000\n\n')
+            self._write_event('snapshot', job.to_dict() if job else {'jobs': get_jobs().list()})
+            if job is not None and job.status not in ACTIVE:
+                return
+            deadline = time.time() + SSE_MAX_SECONDS
+            while time.time() < deadline:
+                try:
+                    ev = q.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    self.wfile.write(b': keep-alive\n\n')
+                    self.wfile.flush()
+                    continue
+                self._write_event(ev['type'], ev, ev['seq'])
+                if job is not None and ev['type'] == 'finished':
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            get_jobs().unsubscribe(q)
+
+    def _wants_progress(self, qs) -> bool:
+        if (qs.get('progress', [''])[0] or '').lower() in ('true', '1', 'yes'):
+            return True
+        return 'application/x-ndjson' in (self.headers.get('Accept') or '')
+
+    def _import_csv(self, text, symbol: str, stream: bool, body=None, **extra):
+        """CSV 导入（GET 读文件 / POST 上传共用）：分批写入同一事务；stream=True 时逐批输出 NDJSON 进度。"""
+        from data_store import StockDatabase
+        progress = None
+        if stream:
+            self._start_stream()
+
+            def progress(p):
+                if body is not None:
+                    p['bytes'] = body.bytes_read
+                self._write_line(dict(p, type='progress'))
+        db = StockDatabase()
+        try:
+            result = csv_import.import_csv(text, db, default_code=symbol or None,
+                                           normalize=normalize_symbol, progress=progress)
+        except Exception as e:
+            code = 400 if isinstance(e, (ValueError, UnicodeDecodeError, OSError, EOFError)) else 500
+            if stream:
+                return self._write_line({'type': 'error', 'error': str(e)})
+            return self._write_json(code, {"error": str(e)})
+        finally:
+            db.close()
+            try:
+                text.close()
+            except Exception:
+                pass
+        if symbol:
+            result['symbol'] = normalize_symbol(symbol)
+        result.update(extra)
+        if stream:
+            return self._write_line(dict(result, type='done'))
+        return self._write_json(200, result)
+
+    def _screen(self, symbols, conds, stream: bool, top: int = 0):
+        pool = _get_screen_pool()
+        # 每个进程约分到 4 个批次，兼顾负载均衡与连接复用
+        size = max(10, -(-len(symbols) // (_SCREEN_WORKERS * 4)))
+        chunks = [symbols[i:i + size] for i in range(0, len(symbols), size)]
+        futures = [pool.submit(analysis.screen_chunk, chunk, conds) for chunk in chunks]
+        results, errors = [], []
+        if stream:
+            self._start_stream()
+        try:
+            for fut in as_completed(futures):
+                try:
+                    part = fut.result()
+                except Exception as e:
+                    part = [{'error': str(e)}]
+                for r in part:
+                    (errors if r.get('error') else results).append(r)
+                    if stream:
+                        self._write_line(dict(r, type='result'))
+        except (BrokenPipeError, ConnectionResetError):
+            for f in futures:
+                f.cancel()
+            return
+        results.sort(key=analysis.rank_key)
+        summary = {'count': len(symbols), 'ok': len(results), 'failed': len(errors)}
+        if top > 0:
+            results = results[:top]
+        ranking = [{'symbol': r['symbol'], 'passed': r['passed'], 'total': r['total'],
+                    'last': r['last'], 'chg_pct_vs_p60': r['indicators']['chg_pct_vs_p60']} for r in results]
+        if stream:
+            return self._write_line(dict(summary, type='done', ranking=ranking))
+        return self._write_json(200, dict(summary, results=results, errors=errors, ranking=ranking))
+
     def do_GET(self):
         try:
             parsed = urlparse(self.path)
@@ -362,48 +778,83 @@ class Handler(BaseHTTPRequestHandler):
             limit = int((qs.get('limit', ['500'])[0] or '500'))
             if not symbol:
                 return self._write_json(400, {"error": "missing symbol"})
+            # format=columns 时按列返回（dates/open/high/low/close/volume，时间升序），体积更小
+            fmt = (qs.get('format', [''])[0] or '').strip().lower()
             try:
-                from data_store import StockDatabase
+                from data_store import StockDatabase, PRICE_COLUMNS
                 db = StockDatabase()
-                rows = db.get_daily_prices(normalize_symbol(symbol), limit=limit)
+                sym = normalize_symbol(symbol)
+                if fmt == 'columns':
+                    cols = db.get_price_columns(sym, columns=PRICE_COLUMNS, limit=limit)
+                    db.close()
+                    out = {k: (v if k == 'date' else v.tolist()) for k, v in cols.items()}
+                    return self._write_json(200, {"symbol": sym, "columns": out, "count": len(cols['date'])})
+                # 读取列式文件映射（倒序），再组装为逐行结构，保持原有返回格式
+                cols = db.get_price_columns(sym, columns=PRICE_COLUMNS, order='desc', limit=limit)
                 db.close()
-                return self._write_json(200, {"symbol": normalize_symbol(symbol), "rows": rows, "count": len(rows)})
+                lists = [cols[c] if c == 'date' else cols[c].tolist() for c in PRICE_COLUMNS]
+                rows = [dict(zip(PRICE_COLUMNS, r)) for r in zip(*lists)]
+                return self._write_json(200, {"symbol": sym, "rows": rows, "count": len(rows)})
             except Exception as e:
                 return self._write_json(500, {"error": str(e)})
 
-        # 从CSV导入到SQLite（便于离线数据导入）
+        # 列式历史文件导出：symbol= 返回单个 .bin；symbols=A,B 或 universe=db|file 返回 tar 流
+        if path == "/data/columnar/export":
+            symbol = (qs.get('symbol', [''])[0] or '').strip()
+            symbols_q = (qs.get('symbols', [''])[0] or '').strip()
+            universe = (qs.get('universe', [''])[0] or '').strip().lower()
+            try:
+                from data_store import StockDatabase
+                db = StockDatabase()
+            except Exception as e:
+                return self._write_json(500, {'error': str(e)})
+            try:
+                try:
+                    if symbol:
+                        sym = normalize_symbol(symbol)
+                        data = db.columnar_bytes(sym)
+                        if not data:
+                            return self._write_json(404, {'error': 'no history'})
+                        return self._write_bytes(200, data, 'application/octet-stream',
+                                                 filename=os.path.basename(db.columnar.path(sym)))
+                    symbols = _screen_universe(symbols_q, universe)
+                except Exception as e:
+                    return self._write_json(500, {'error': str(e)})
+                if not symbols:
+                    return self._write_json(400, {'error': 'missing symbol (symbol=IBM, symbols=IBM,AAPL or universe=db|file)'})
+                self._start_stream('application/x-tar')
+                with tarfile.open(fileobj=self.wfile, mode='w|') as tar:
+                    for sym in symbols:
+                        data = db.columnar_bytes(sym)
+                        if not data:
+                            continue
+                        info = tarfile.TarInfo(os.path.basename(db.columnar.path(sym)))
+                        info.size = len(data)
+                        info.mtime = int(time.time())
+                        tar.addfile(info, io.BytesIO(data))
+            finally:
+                db.close()
+            return
+
+        # 从CSV导入到SQLite（便于离线数据导入）；文件含 code 列时可不传 symbol（多代码文件），.gz 自动解压
         if path == "/data/import_csv":
             symbol = (qs.get('symbol', [''])[0] or '').strip()
             file_q = (qs.get('file', [''])[0] or '').strip()
-            if not symbol:
+            if not symbol and not file_q:
                 return self._write_json(400, {"error": "missing symbol"})
             base_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'import')
             default_path = os.path.join(base_dir, f"{symbol}.csv")
+            if not file_q and not os.path.exists(default_path) and os.path.exists(default_path + '.gz'):
+                default_path += '.gz'
             csv_path = file_q or default_path
             try:
                 os.makedirs(base_dir, exist_ok=True)
-                rows = []
-                with open(csv_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    # 期望列：date, open, high, low, close, volume
-                    for r in reader:
-                        rows.append({
-                            'date': r.get('date'),
-                            'open': float(r.get('open') or 0),
-                            'high': float(r.get('high') or 0),
-                            'low': float(r.get('low') or 0),
-                            'close': float(r.get('close') or 0),
-                            'volume': int(r.get('volume') or 0),
-                        })
-                from data_store import StockDatabase
-                db = StockDatabase()
-                db.upsert_daily_prices(symbol, rows)
-                db.close()
-                return self._write_json(200, {"symbol": symbol, "imported": len(rows), "path": csv_path})
+                text = csv_import.open_file(csv_path)
             except FileNotFoundError:
                 return self._write_json(404, {"error": f"csv not found: {csv_path}"})
             except Exception as e:
                 return self._write_json(500, {"error": str(e)})
+            return self._import_csv(text, symbol, self._wants_progress(qs), path=csv_path)
 
         if path == "/data/fundamentals":
             symbol = (qs.get('symbol', [''])[0] or '').strip()
@@ -425,6 +876,34 @@ class Handler(BaseHTTPRequestHandler):
             code = 200 if not err else (429 if reason=='quota' else (504 if 'Timeout' in err else (502 if 'ConnectionError' in err else (500 if 'HTTPError' in err else 400))))
             return self._write_json(code, data)
 
+        # 新闻检索：在本地已存的新闻中全文搜索（FTS5 + bm25 排序），不消耗配额
+        if path == "/data/news/search":
+            q = (qs.get('q', [''])[0] or '').strip()
+            symbols = [normalize_symbol(x) for x in (qs.get('symbols', [''])[0] or '').split(',') if x.strip()]
+            since = (qs.get('since', [''])[0] or '').strip() or None
+            until = (qs.get('until', [''])[0] or '').strip() or None
+            try:
+                limit = max(1, min(int((qs.get('limit', ['20'])[0] or '20')), 200))
+                offset = max(0, int((qs.get('offset', ['0'])[0] or '0')))
+                min_s = (qs.get('min_sentiment', [''])[0] or '').strip()
+                max_s = (qs.get('max_sentiment', [''])[0] or '').strip()
+                min_s = float(min_s) if min_s else None
+                max_s = float(max_s) if max_s else None
+            except ValueError:
+                return self._write_json(400, {'error': 'invalid limit/offset/min_sentiment/max_sentiment'})
+            t0 = time.perf_counter()
+            try:
+                from data_store import StockDatabase
+                db = StockDatabase()
+                total, engine, rows = db.search_news(q, symbols, since, until, min_s, max_s, limit, offset)
+                db.close()
+            except Exception as e:
+                return self._write_json(500, {'error': str(e)})
+            return self._write_json(200, {
+                'q': q, 'count': total, 'limit': limit, 'offset': offset, 'engine': engine,
+                'took_ms': round((time.perf_counter() - t0) * 1000, 1), 'results': rows,
+            })
+
         # 综合分析：返回技术面指标 + 策略建议 + 条件评估
         if path == "/data/analyze":
             symbol = (qs.get('symbol', [''])[0] or '').strip()
@@ -432,31 +911,23 @@ class Handler(BaseHTTPRequestHandler):
                 return self._write_json(400, {"error": "missing symbol"})
             sym = normalize_symbol(symbol)
             source = (qs.get('source', [''])[0] or '').strip().lower()
-            def _num(q, d=None):
-                try:
-                    return float((qs.get(q, [str(d or '')])[0] or '').strip()) if qs.get(q) else d
-                except Exception:
-                    return d
-            conds = {
-                'low': _num('low'),
-                'high': _num('high'),
-                'max_pe': _num('max_pe'),
-                'min_div': _num('min_div'),
-                'min_rsi': _num('min_rsi'),
-                'max_vol': _num('max_vol')
-            }
+            conds = analysis.parse_conditions(qs)
 
             if source == 'local':
+                # 本地：读取持久化的滚动指标状态（仅新 bar 增量更新），耗时不随历史长度增长
                 try:
                     from data_store import StockDatabase
                     db = StockDatabase()
-                    rows = db.get_daily_prices(sym, limit=500)
+                    state = db.get_indicator_state(sym)
                     db.close()
-                    hist = {'symbol': sym, 'rows': rows, 'count': len(rows)}
                 except Exception as e:
                     return self._write_json(500, {'error': str(e)})
-                quote = {'price': rows[0]['close'] if rows else None}
-                funda = {}
+                if state is None or state.last_close is None:
+                    return self._write_json(404, {'error': 'no history'})
+                last = float(state.last_close)
+                tech = state.snapshot()
+                # 基本面取本地已存的概览（不限新鲜期），离线时 PE/股息率条件照常生效
+                funda = _stored('get_overview', sym, None) or {}
             else:
                 quote = fetch_alpha_global_quote(sym)
                 hist = fetch_alpha_daily(sym)
@@ -467,118 +938,132 @@ class Handler(BaseHTTPRequestHandler):
                     try:
                         from data_store import StockDatabase
                         db = StockDatabase()
-                        rows = db.get_daily_prices(sym, limit=500)
+                        closes = db.get_price_columns(sym, columns=('close',), limit=500)['close']
                         db.close()
-                        hist = {'symbol': sym, 'rows': rows, 'count': len(rows), 'note': 'fallback_local'}
                     except Exception as e:
                         return self._write_json(400, {'error': hist.get('error')})
+                    prices = closes[closes != 0]
+                else:
+                    prices = [float(r.get('close') or r.get('price') or 0) for r in hist.get('rows', []) if (r.get('close') or r.get('price'))]
+                if not len(prices):
+                    return self._write_json(404, {'error': 'no history'})
+                last = float(quote.get('price') or prices[-1])
+                tech = indicators.technical_snapshot(prices)
+
+            return self._write_json(200, analysis.evaluate(sym, last, tech, funda, conds))
+
+        # 选股：直接查询物化的指标快照表（索引筛选，不逐个计算）
+        if path == "/data/screen":
+            conds = analysis.parse_conditions(qs)
+            thresholds = analysis.screen_thresholds(conds)
+            try:
+                limit = max(1, min(int((qs.get('limit', ['100'])[0] or '100')), 5000))
+                offset = max(0, int((qs.get('offset', ['0'])[0] or '0')))
+                min_passed = (qs.get('min_passed', [''])[0] or '').strip()
+                min_passed = int(min_passed) if min_passed else None
+            except ValueError:
+                return self._write_json(400, {'error': 'invalid limit/offset/min_passed'})
+            refresh = (qs.get('refresh', [''])[0] or '').lower() in ('true', '1', 'yes')
+            try:
+                from data_store import StockDatabase
+                db = StockDatabase()
+                rebuilt = 0
+                if refresh or not db.conn.execute('SELECT 1 FROM indicator_snapshot LIMIT 1').fetchone():
+                    rebuilt = db.refresh_missing_snapshots()
+                total, checks, rows = db.screen_snapshots(thresholds, min_passed, limit, offset)
+                db.close()
+            except Exception as e:
+                return self._write_json(500, {'error': str(e)})
+            for r in rows:
+                for k in ('last', 'p20', 'p60', 'e20', 'low', 'high', 'chg_pct_vs_p60'):
+                    if r[k] is not None:
+                        r[k] = round(r[k], 2)
+                if r['rsi14'] is not None:
+                    r['rsi14'] = round(r['rsi14'], 1)
+            out = {'count': total, 'checks': checks, 'conditions': thresholds, 'limit': limit, 'offset': offset,
+                   'results': rows}
+            if rebuilt:
+                out['rebuilt'] = rebuilt
+            return self._write_json(200, out)
+
+        # 批量分析：基于本地库，进程池并行计算，按完成顺序流式返回（NDJSON），最后给出排序结果
+        if path == "/data/analyze_batch":
+            symbols_q = (qs.get('symbols', [''])[0] or '').strip()
+            universe = (qs.get('universe', [''])[0] or '').strip().lower()
+            stream = (qs.get('stream', ['true'])[0] or 'true').lower() in ('true', '1', 'yes')
+            try:
+                top = int((qs.get('top', ['0'])[0] or '0'))
+            except ValueError:
+                top = 0
+            conds = analysis.parse_conditions(qs)
+            try:
+                symbols = _screen_universe(symbols_q, universe)
+            except Exception as e:
+                return self._write_json(500, {'error': str(e)})
+            if not symbols:
+                return self._write_json(400, {'error': 'missing symbols (symbols=IBM,AAPL or universe=db|file)'})
+            return self._screen(symbols, conds, stream, top)
 
-            prices = [float(r.get('close') or r.get('price') or 0) for r in hist.get('rows', []) if (r.get('close') or r.get('price'))]
-            if not prices:
+        # 指标序列（用于图表）：names=sma20,ema20,rsi14,boll40,vol60,macd
+        if path == "/data/indicators":
+            symbol = (qs.get('symbol', [''])[0] or '').strip()
+            if not symbol:
+                return self._write_json(400, {"error": "missing symbol"})
+            sym = normalize_symbol(symbol)
+            source = (qs.get('source', [''])[0] or '').strip().lower()
+            names = [x for x in (qs.get('names', [''])[0] or '').split(',') if x.strip()] or list(indicators.DEFAULT_SERIES)
+            try:
+                limit = int((qs.get('limit', ['500'])[0] or '500'))
+            except ValueError:
+                limit = 500
+            if source == 'local':
+                # 本地：按日期区间（start/end，可选）列式读取，直接得到收盘价数组
+                start = (qs.get('start', [''])[0] or '').strip() or None
+                end = (qs.get('end', [''])[0] or '').strip() or None
+                try:
+                    from data_store import StockDatabase
+                    db = StockDatabase()
+                    cols = db.get_price_columns(sym, start=start, end=end, columns=('date', 'close'), limit=limit)
+                    db.close()
+                except Exception as e:
+                    return self._write_json(500, {'error': str(e)})
+                dates, closes = cols['date'], cols['close']
+            else:
+                hist = fetch_alpha_daily(sym)
+                if hist.get('error'):
+                    err = hist.get('error') or ''
+                    code = 429 if hist.get('reason') == 'quota' else (504 if 'Timeout' in err else (502 if 'ConnectionError' in err else 500))
+                    return self._write_json(code, hist)
+                rows = (hist.get('rows') or [])[-limit:]
+                dates = [r.get('date') for r in rows]
+                closes = indicators.as_array([float(r.get('close') or 0) for r in rows])
+            if not dates:
                 return self._write_json(404, {'error': 'no history'})
-            last = float(quote.get('price') or prices[-1])
-
-            def sma(arr, n):
-                if len(arr) < n:
-                    return None
-                return sum(arr[-n:]) / n
-            def ema(arr, n):
-                if len(arr) < n:
-                    return None
-                k = 2/(n+1)
-                e = arr[-n]
-                for i in range(len(arr)-n+1, len(arr)):
-                    e = arr[i]*k + e*(1-k)
-                return e
-            def rsi(arr, n=14):
-                if len(arr) < n+1:
-                    return None
-                gains = 0.0
-                losses = 0.0
-                for i in range(len(arr)-n, len(arr)):
-                    d = arr[i] - arr[i-1]
-                    if d > 0:
-                        gains += d
-                    else:
-                        losses -= d
-                rs = gains / (losses or 1e-6)
-                return 100 - 100/(1+rs)
-            def annual_vol(arr):
-                if len(arr) < 30:
-                    return None
-                rets = [(arr[i]-arr[i-1])/arr[i-1] for i in range(1, len(arr))]
-                n = min(60, len(rets))
-                rets = rets[-n:]
-                avg = sum(rets)/n
-                varr = sum((x-avg)**2 for x in rets)/n
-                import math
-                return math.sqrt(varr) * math.sqrt(250)
-
-            p20 = sma(prices, 20) or last
-            p60 = sma(prices, 60) or last
-            e20 = ema(prices, 20) or last
-            rsi14 = rsi(prices, 14) or 50
-            vol = annual_vol(prices) or 0.25
-            chg = ((last - p60) / (p60 or last) * 100) if p60 else 0
-
-            n = min(40, len(prices))
-            slice_p = prices[-n:]
-            avg = sum(slice_p)/n if n>0 else last
-            import math
-            std = math.sqrt(sum((x-avg)**2 for x in slice_p)/n) if n>0 else 0.1
-            low = avg - 2*std
-            high = avg + 2*std
-
-            pe = float(funda.get('PERatio') or 0)
-            div = float(funda.get('DividendYield') or 0)
-
-            used_conds = {
-                'low': conds['low'] if conds['low'] is not None else low,
-                'high': conds['high'] if conds['high'] is not None else high,
-                'max_pe': conds['max_pe'] if conds['max_pe'] is not None else None,
-                'min_div': conds['min_div'] if conds['min_div'] is not None else None,
-                'min_rsi': conds['min_rsi'] if conds['min_rsi'] is not None else 45.0,
-                'max_vol': conds['max_vol'] if conds['max_vol'] is not None else 0.50
-            }
-
-            checks = []
-            def add_check(name, ok, detail):
-                checks.append({'name': name, 'ok': bool(ok), 'detail': detail})
-            add_check('价格≥下限', last >= used_conds['low'], f"last={last:.2f}, low={used_conds['low']:.2f}")
-            add_check('价格≤上限', last <= used_conds['high'], f"last={last:.2f}, high={used_conds['high']:.2f}")
-            if conds['max_pe'] is not None:
-                add_check('估值PE≤阈值', (pe or 0) <= conds['max_pe'], f"PE={pe}, max={conds['max_pe']}")
-            if conds['min_div'] is not None:
-                add_check('股息率≥阈值', (div or 0) >= conds['min_div'], f"Div={div}, min={conds['min_div']}")
-            add_check('RSI≥阈值', (rsi14 or 0) >= used_conds['min_rsi'], f"RSI14={rsi14:.1f}, min={used_conds['min_rsi']}")
-            add_check('波动率≤阈值', (vol or 0) <= used_conds['max_vol'], f"Vol={vol:.3f}, max={used_conds['max_vol']}")
-
-            tone = '偏强' if last > p60 else '偏弱'
-            pos = 0.7 if (last>e20 and last>p60) else (0.5 if last>e20 else 0.3)
-
+            series = {}
+            for name, val in indicators.compute(closes, names).items():
+                series[name] = {k: indicators.to_list(v) for k, v in val.items()} if isinstance(val, dict) else indicators.to_list(val)
             return self._write_json(200, {
                 'symbol': sym,
-                'last': round(last,2),
-                'indicators': {
-                    'p20': round(p20,2), 'p60': round(p60,2), 'e20': round(e20,2),
-                    'rsi14': round(rsi14,1), 'vol': vol,
-                    'low': round(low,2), 'high': round(high,2),
-                    'chg_pct_vs_p60': round(chg,2)
-                },
-                'fundamentals': {
-                    'PE': pe, 'DividendYield': div
-                },
-                'summary': f"价格 {last:.2f}，相对SMA60涨跌 {chg:.2f}%，波动率 {(vol*100):.1f}%。动量{tone}。建议仓位 {int(pos*100)}%。观察区间 {low:.2f}~{high:.2f}。",
-                'checks': checks
-                , 'conditions': used_conds
+                'dates': dates,
+                'close': indicators.to_list(closes),
+                'series': series,
+                'count': len(dates)
             })
 
+        # 运行状态：线程池占用/排队/拒绝计数
+        if path == "/data/stats":
+            pools = self.server.pool_stats() if hasattr(self.server, 'pool_stats') else {}
+            return self._write_json(200, {'pools': pools, 'singleflight': _INFLIGHT.stats(),
+                                          'cache': get_cache().stats(), 'upstream': get_client().stats(),
+                                          'ws': WS_HUB.stats() if WS_HUB else None, 'jobs': get_jobs().stats(),
+                                          'config': app_config.stats()})
+
         # 读取统一配置（敏感字段返回遮罩）
         if path == "/config":
             ip = _client_ip(self)
             if not _allowed_ip(ip):
                 return self._write_json(403, {"error": "forbidden", "ip": ip})
-            cfg = _load_config()
+            cfg = app_config.load()
             def mask(s):
                 n = len(s or '')
                 return '*' * min(n, 24) + ('…' if n > 24 else '') if n > 0 else ''
@@ -596,31 +1081,64 @@ class Handler(BaseHTTPRequestHandler):
                 'dashboardSimple': cfg.get('dashboardSimple')
             })
 
-        # 启动每日增量更新（异步子进程，返回pid与日志路径）
+        # 启动每日增量更新（进程内任务队列，返回任务ID与日志路径；与进行中的任务代码重叠时返回该任务）
         if path == "/data/run_daily_update":
             file_q = (qs.get('file', [''])[0] or '').strip()
             symbols_q = (qs.get('symbols', [''])[0] or '').strip()
             sleep_q = int((qs.get('sleep', ['15'])[0] or '15'))
+            full = (qs.get('full', [''])[0] or '').lower() in ('true', '1', 'yes')
             try:
-                base_dir = os.path.dirname(os.path.dirname(__file__))
-                script = os.path.join(os.path.dirname(__file__), 'daily_update.py')
-                symbols_file = file_q or os.path.join(base_dir, 'data', 'symbols.txt')
-                logs_dir = os.path.join(base_dir, 'data', 'logs')
+                import daily_update
+                symbols_file = file_q or os.path.join(BASE_DIR, 'data', 'symbols.txt')
+                # 只传 symbols 时仅更新这些代码（如“更新当前”）；同时传 file 时合并清单
+                use_file = file_q or not symbols_q
+                symbols = daily_update.load_symbols(symbols_file if use_file else None, [symbols_q] if symbols_q else None)
+                if not symbols:
+                    return self._write_json(400, {"error": "no symbols (data/symbols.txt is empty)"})
+                logs_dir = os.path.join(BASE_DIR, 'data', 'logs')
                 os.makedirs(logs_dir, exist_ok=True)
                 stamp = time.strftime('%Y%m%d-%H%M%S')
                 log_path = os.path.join(logs_dir, f'daily_update-{stamp}.log')
                 last_summary = os.path.join(logs_dir, 'daily_update-last.json')
-                args = [sys.executable or 'python', script, '-f', symbols_file, '--sleep', str(sleep_q)]
-                if symbols_q:
-                    args += ['-s', symbols_q]
-                # 将日志与摘要路径传递给子进程，便于前端查询
-                args += ['--summary', last_summary, '--log', log_path]
-                f = open(log_path, 'w', encoding='utf-8')
-                proc = subprocess.Popen(args, stdout=f, stderr=f)
-                return self._write_json(200, {"status": "started", "pid": proc.pid, "log_path": log_path, "summary_path": last_summary})
+                job, created = get_jobs().submit(
+                    'daily_update', _daily_update_job(symbols, sleep_q, full, log_path, last_summary),
+                    params={'symbols': symbols if len(symbols) <= 50 else len(symbols),
+                            'sleep': sleep_q, 'full': full, 'log_path': log_path},
+                    keys=symbols)
+                return self._write_json(200, {
+                    "status": "started" if created else "running",
+                    "deduplicated": not created,
+                    "job_id": job.id,
+                    "log_path": job.params.get('log_path'),
+                    "summary_path": last_summary,
+                    "events": f"/data/jobs/events?id={job.id}",
+                })
             except Exception as e:
                 return self._write_json(500, {"error": str(e)})
 
+        # 任务列表 / 单个任务状态（id=）
+        if path == "/data/jobs":
+            job_id = (qs.get('id', [''])[0] or '').strip()
+            if job_id:
+                job = get_jobs().get(job_id)
+                return self._write_json(200, job.to_dict()) if job else self._write_json(404, {"error": "job not found"})
+            return self._write_json(200, {"jobs": get_jobs().list()})
+
+        if path == "/data/jobs/cancel":
+            job_id = (qs.get('id', [''])[0] or '').strip()
+            job = get_jobs().cancel(job_id) if job_id else None
+            if job is None:
+                return self._write_json(404, {"error": "job not found"})
+            return self._write_json(200, job.to_dict())
+
+        # 任务进度推送（SSE）：id= 只推送该任务并在结束时关闭，否则推送全部任务事件
+        if path == "/data/jobs/events":
+            job_id = (qs.get('id', [''])[0] or '').strip()
+            job = get_jobs().get(job_id) if job_id else None
+            if job_id and job is None:
+                return self._write_json(404, {"error": "job not found"})
+            return self._stream_job_events(job)
+
         # 查询最近一次增量更新摘要
         if path == "/data/daily_update_status":
             try:
@@ -697,7 +1215,7 @@ class Handler(BaseHTTPRequestHandler):
             )
             allowed = {k: payload.get(k) for k in allow_keys if k in payload}
             try:
-                _save_config(allowed)
+                app_config.save(allowed)
                 # 审计：仅记录键名与长度，不记录明文
                 try:
                     os.makedirs(AUDIT_DIR, exist_ok=True)
@@ -719,37 +1237,42 @@ class Handler(BaseHTTPRequestHandler):
             except Exception as e:
                 return self._write_json(500, {"error": str(e)})
 
-        if path == "/data/import_csv":
+        # 列式历史文件导入：请求体为单个 .bin 或 tar（可 gzip 压缩）；写入 SQLite 后列式文件按需重建
+        if path == "/data/columnar/import":
+            self.close_connection = True
+            body = RequestBody(self.rfile, self.headers)
+            from data_store import StockDatabase
+            db = StockDatabase()
             try:
-                parsed = urlparse(self.path)
-                qs = parse_qs(parsed.query)
-                symbol = (qs.get('symbol', [''])[0] or '').strip()
-                if not symbol:
-                    return self._write_json(400, {"error": "missing symbol"})
+                counts = db.import_price_rows(_columnar_rows(io.BufferedReader(body, buffer_size=64 * 1024)))
+            except Exception as e:
+                return self._write_json(400, {"error": str(e)})
+            finally:
+                db.close()
+            return self._write_json(200, {"imported": sum(counts.values()), "symbols": counts})
+
+        # 上传导入：请求体为原始 CSV（text/csv，可 gzip 压缩，支持 chunked），边读边解析写入；
+        # 兼容旧的 JSON 形式 {"content": "..."}
+        if path == "/data/import_csv":
+            qs = parse_qs(parsed.query)
+            symbol = (qs.get('symbol', [''])[0] or '').strip()
+            ctype = (self.headers.get('Content-Type') or '').lower()
+            body = None
+            if ctype.startswith('application/json'):
                 raw = self._read_json()
                 content = raw.get('content') if isinstance(raw, dict) else None
                 if not content:
                     return self._write_json(400, {"error": "missing content"})
-                rows = []
-                import io
-                f = io.StringIO(content)
-                reader = csv.DictReader(f)
-                for r in reader:
-                    rows.append({
-                        'date': r.get('date'),
-                        'open': float(r.get('open') or 0),
-                        'high': float(r.get('high') or 0),
-                        'low': float(r.get('low') or 0),
-                        'close': float(r.get('close') or 0),
-                        'volume': int(r.get('volume') or 0),
-                    })
-                from data_store import StockDatabase
-                db = StockDatabase()
-                db.upsert_daily_prices(normalize_symbol(symbol), rows)
-                db.close()
-                return self._write_json(200, {"symbol": normalize_symbol(symbol), "imported": len(rows)})
-            except Exception as e:
-                return self._write_json(500, {"error": str(e)})
+                text = io.StringIO(content)
+            else:
+                # 出错时请求体可能未读完，响应后关闭连接
+                self.close_connection = True
+                body = RequestBody(self.rfile, self.headers)
+                try:
+                    text = csv_import.open_text(body)
+                except Exception as e:
+                    return self._write_json(400, {"error": f"invalid body: {e}"})
+            return self._import_csv(text, symbol, self._wants_progress(qs), body=body)
 
         return self._write_json(404, {"error": "Not Found"})
 
@@ -761,40 +1284,114 @@ def main():
             port = int(sys.argv[1])
         except ValueError:
             pass
-    server = HTTPServer(('0.0.0.0', port), Handler)
+    # 线程池规模与队列深度可在 config/app.json 中配置：gatewayWorkers / gatewayLocalWorkers / gatewayQueue / gatewayEventStreams
+    cfg = app_config.load()
+    queue_size = _int_cfg(cfg, 'gatewayQueue', DEFAULT_QUEUE)
+    lanes = {
+        'upstream': (_int_cfg(cfg, 'gatewayWorkers', DEFAULT_WORKERS), queue_size),
+        'local': (_int_cfg(cfg, 'gatewayLocalWorkers', DEFAULT_LOCAL_WORKERS), queue_size),
+        'events': (_int_cfg(cfg, 'gatewayEventStreams', DEFAULT_EVENT_STREAMS), 1),
+    }
+    server = PooledHTTPServer(('0.0.0.0', port), Handler, lanes, classify=_request_lane)
     print(f"Data gateway running on http://localhost:{port}/data/quote?symbol=IBM")
+    print(f"[HTTP] workers: upstream={lanes['upstream'][0]} local={lanes['local'][0]} events={lanes['events'][0]} queue={queue_size}")
 
     # 启动 WebSocket 推送服务（端口默认为 HTTP+1，例如 8789）
     ws_port = port + 1
     if websockets is None:
         print("[WS] websockets 未安装，跳过 WebSocket 服务。可在 requirements 中添加 'websockets'。")
     else:
-        async def ws_quote_handler(websocket, path):
+        hub = QuoteHub(_ws_quote_payload, interval=WS_PUSH_INTERVAL)
+        global WS_HUB
+        WS_HUB = hub
+
+        async def ws_quote_handler(websocket, path=None):
             # 解析 symbol 参数，形如 /ws/quote?symbol=IBM
             try:
-                parsed = urlparse(path or "/")
+                parsed = urlparse(_ws_request_path(websocket, path))
+                if parsed.path == '/ws/quotes':
+                    return await ws_multi_handler(websocket, parse_qs(parsed.query))
                 qs = parse_qs(parsed.query)
                 symbol = (qs.get('symbol', [''])[0] or '').strip()
                 if not symbol:
                     await websocket.send(json.dumps({"error":"missing symbol"}, ensure_ascii=False))
                     return
-                # 简单循环推送：读取 Alpha Vantage（含缓存），构造统一payload
-                while True:
-                    data = fetch_alpha_global_quote(symbol)
-                    payload = {
-                        'symbol': data.get('symbol') or symbol,
-                        'last': data.get('price') or data.get('close') or 0,
-                        'volume': data.get('volume') or 0,
-                        'ts': int(time.time())
-                    }
-                    await websocket.send(json.dumps(payload, ensure_ascii=False))
-                    await asyncio.sleep(2)
+                # 订阅共享轮询：同一代码的所有连接只触发一次行情读取
+                sym = normalize_symbol(symbol)
+                q = asyncio.Queue(maxsize=1)
+                sink = queue_sink(q)
+                hub.subscribe(sym, sink)
+                try:
+                    while True:
+                        payload = await q.get()
+                        await websocket.send(json.dumps(payload, ensure_ascii=False))
+                finally:
+                    hub.unsubscribe(sym, sink)
             except Exception as e:
                 try:
                     await websocket.send(json.dumps({"error": str(e)}, ensure_ascii=False))
                 except Exception:
                     pass
 
+        async def ws_multi_handler(websocket, qs):
+            """多代码订阅：/ws/quotes[?format=compact]
+            控制消息：{"op":"subscribe"|"unsubscribe","symbols":[...]}、{"op":"snapshot"}；
+            推送：每批次一帧，仅包含变化字段 {"type":"batch","ts":..,"updates":{"IBM":{"last":..}}}。
+            紧凑格式：{"t":"b","ts":..,"u":[["IBM",{"l":..,"v":..}]]}。
+            """
+            compact = (qs.get('format', [''])[0] or '').strip().lower() == 'compact'
+            sub = DeltaSubscriber(compact=compact)
+
+            async def reader():
+                async for raw in websocket:
+                    try:
+                        msg = json.loads(raw)
+                        op = (msg.get('op') or '').lower()
+                        symbols = msg.get('symbols') or []
+                        if isinstance(symbols, str):
+                            symbols = symbols.split(',')
+                        syms = [normalize_symbol(x) for x in symbols if str(x or '').strip()]
+                    except Exception:
+                        await websocket.send(json.dumps({"type": "error", "error": "invalid message"}))
+                        continue
+                    if op == 'subscribe':
+                        room = WS_MAX_SYMBOLS - len(sub.symbols)
+                        added = [x for x in dict.fromkeys(syms) if x not in sub.symbols][:max(0, room)]
+                        for x in added:
+                            sub.symbols.add(x)
+                            hub.subscribe(x, sub)
+                        await websocket.send(json.dumps({"type": "subscribed", "symbols": added,
+                                                         "total": len(sub.symbols)}, ensure_ascii=False))
+                    elif op == 'unsubscribe':
+                        removed = [x for x in syms if x in sub.symbols]
+                        for x in removed:
+                            hub.unsubscribe(x, sub)
+                            sub.forget(x)
+                        await websocket.send(json.dumps({"type": "unsubscribed", "symbols": removed,
+                                                         "total": len(sub.symbols)}, ensure_ascii=False))
+                    elif op == 'snapshot':
+                        sub.resend_all()
+                    else:
+                        await websocket.send(json.dumps({"type": "error", "error": f"unknown op: {op}"}))
+
+            async def sender():
+                while True:
+                    await sub.changed.wait()
+                    await asyncio.sleep(WS_BATCH_WINDOW)
+                    sub.changed.clear()
+                    updates = sub.drain()
+                    if updates:
+                        await websocket.send(sub.encode(updates))
+
+            tasks = [asyncio.ensure_future(reader()), asyncio.ensure_future(sender())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for t in tasks:
+                    t.cancel()
+                for x in list(sub.symbols):
+                    hub.unsubscribe(x, sub)
+
         async def ws_main():
             async with websockets.serve(ws_quote_handler, '0.0.0.0', ws_port, ping_interval=20, ping_timeout=20):
                 print(f"[WS] WebSocket running on ws://localhost:{ws_port}/ws/quote?symbol=IBM")
@@ -812,6 +1409,8 @@ def main():
         server.serve_forever()
     except KeyboardInterrupt:
         pass
+    finally:
+        server.server_close()
 
 
 if __name__ == '__main__':
@@ -1,33 +1,312 @@
 import os
+import json
+import time
 import sqlite3
-from typing import Iterable, Dict
+import threading
+from array import array
+from typing import Callable, Iterable, Dict, Optional, Sequence
+
+import numpy as np
+
+from indicators import IndicatorState
+from columnar import ColumnarStore, date_strings, encode
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'stocks.db')
 
+# 连接参数：WAL 下读写互不阻塞；写入方持锁时读者/写者最多等待 BUSY_TIMEOUT 秒
+BUSY_TIMEOUT = 30
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',       # 约 16MB 页缓存
+    'PRAGMA mmap_size=268435456',     # 256MB 内存映射读取
+    'PRAGMA temp_store=MEMORY',
+)
 
-class StockDatabase:
-    def __init__(self, db_path: str = DB_PATH):
+# 列投影查询允许的列；date 以字符串列表返回，其余为数值数组
+PRICE_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume')
+
+# 基本面/新闻的新鲜期（秒）：基本面按季度变化，保留一周；新闻一小时后重新拉取
+FRESHNESS = {
+    'overview': 7 * 24 * 3600,
+    'news': 3600,
+}
+NEWS_LIMIT = 50
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _thread_connections() -> Dict[str, sqlite3.Connection]:
+    """当前线程的连接表；在 fork 出的子进程中（如进程池）丢弃继承来的连接。"""
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.conns = {}
+    return _local.conns
+
+
+def get_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """按线程复用的 SQLite 连接：首次打开时设置 PRAGMA，建表每个进程每个库只执行一次。"""
+    conns = _thread_connections()
+    conn = conns.get(db_path)
+    if conn is None:
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.conn = sqlite3.connect(db_path)
-        self._create_tables()
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _ensure_schema(conn, db_path)
+        conns[db_path] = conn
+    return conn
 
-    def _create_tables(self):
-        cur = self.conn.cursor()
-        cur.execute(
+
+def close_connections():
+    """关闭当前线程持有的全部连接（线程退出或测试清理时使用）。"""
+    conns = _thread_connections()
+    for conn in conns.values():
+        try:
+            conn.close()
+        except Exception:
+            pass
+    conns.clear()
+
+
+def _ensure_schema(conn: sqlite3.Connection, db_path: str):
+    if db_path in _schema_ready:
+        return
+    with _schema_lock:
+        if db_path in _schema_ready:
+            return
+        _create_tables(conn)
+        _schema_ready.add(db_path)
+
+
+def _create_tables(conn: sqlite3.Connection):
+    cur = conn.cursor()
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS daily_price (
+            code TEXT,
+            date TEXT,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            PRIMARY KEY (code, date)
+        )
+        '''
+    )
+    # 覆盖索引：按代码+日期区间只取收盘价（指标计算的主要读法）时无需回表
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_daily_price_code_date_close ON daily_price (code, date, close)')
+    # 每个代码的价格版本号：写入日线时在同一事务内递增，列式文件头记录生成时的版本，不一致即视为过期
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS price_version (
+            code TEXT PRIMARY KEY,
+            version INTEGER
+        )
+        '''
+    )
+    # 每个代码的滚动指标状态（追加新 bar 时 O(1) 更新，改写历史 bar 时失效重建）
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS indicator_state (
+            code TEXT PRIMARY KEY,
+            last_date TEXT,
+            state TEXT,
+            updated_at INTEGER
+        )
+        '''
+    )
+    # 物化的最新指标快照（/data/analyze 口径），供 /data/screen 直接用索引筛选
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS indicator_snapshot (
+            code TEXT PRIMARY KEY,
+            date TEXT,
+            last REAL,
+            p20 REAL,
+            p60 REAL,
+            e20 REAL,
+            rsi14 REAL,
+            vol REAL,
+            low REAL,
+            high REAL,
+            chg_pct_vs_p60 REAL,
+            updated_at INTEGER
+        )
+        '''
+    )
+    for col in ('rsi14', 'vol', 'chg_pct_vs_p60', 'last'):
+        cur.execute(f'CREATE INDEX IF NOT EXISTS idx_indicator_snapshot_{col} ON indicator_snapshot ({col})')
+    # 每日增量更新的水位：已入库的最新日期与最近一次检查时间
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS update_watermark (
+            code TEXT PRIMARY KEY,
+            last_date TEXT,
+            checked_at INTEGER,
+            rows_written INTEGER
+        )
+        '''
+    )
+    # 基本面概览：原始字段存 JSON，PE/股息率单独成列供快照筛选关联
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS fundamentals (
+            code TEXT PRIMARY KEY,
+            pe REAL,
+            div REAL,
+            data TEXT,
+            fetched_at INTEGER
+        )
+        '''
+    )
+    # 新闻：每篇文章一行（按 url 去重，情绪为文章整体得分），news_symbol 记录文章关联的代码；
+    # news_fetch 记录每个代码最近一次拉取时间（含无新闻的情况）
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS news_item (
+            url TEXT UNIQUE,
+            title TEXT,
+            summary TEXT,
+            source TEXT,
+            time_published TEXT,
+            sentiment REAL,
+            fetched_at INTEGER
+        )
+        '''
+    )
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_news_item_time ON news_item (time_published)')
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS news_symbol (
+            code TEXT,
+            url TEXT,
+            PRIMARY KEY (code, url)
+        ) WITHOUT ROWID
+        '''
+    )
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_news_symbol_url ON news_symbol (url, code)')
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS news_fetch (
+            code TEXT PRIMARY KEY,
+            fetched_at INTEGER,
+            count INTEGER
+        )
+        '''
+    )
+    _create_news_fts(conn)
+    conn.commit()
+
+
+def _create_news_fts(conn: sqlite3.Connection):
+    """新闻全文索引：FTS5 外部内容表（只存倒排索引，正文仍在 news_item），由触发器同步。
+
+    news_item 的写入使用 UPSERT（ON CONFLICT DO UPDATE）而非 REPLACE：REPLACE 的隐式删除不触发
+    DELETE 触发器，会让索引残留旧内容。SQLite 未编译 FTS5 时跳过，搜索退回 LIKE。
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'news_fts'").fetchone()
+    try:
+        conn.execute(
             '''
-            CREATE TABLE IF NOT EXISTS daily_price (
-                code TEXT,
-                date TEXT,
-                open REAL,
-                high REAL,
-                low REAL,
-                close REAL,
-                volume INTEGER,
-                PRIMARY KEY (code, date)
+            CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(
+                title, summary, source,
+                content='news_item', content_rowid='rowid', tokenize='unicode61'
             )
             '''
         )
-        self.conn.commit()
+    except sqlite3.OperationalError:
+        return
+    conn.executescript(
+        '''
+        CREATE TRIGGER IF NOT EXISTS news_item_ai AFTER INSERT ON news_item BEGIN
+            INSERT INTO news_fts (rowid, title, summary, source) VALUES (new.rowid, new.title, new.summary, new.source);
+        END;
+        CREATE TRIGGER IF NOT EXISTS news_item_ad AFTER DELETE ON news_item BEGIN
+            INSERT INTO news_fts (news_fts, rowid, title, summary, source)
+            VALUES ('delete', old.rowid, old.title, old.summary, old.source);
+        END;
+        CREATE TRIGGER IF NOT EXISTS news_item_au AFTER UPDATE ON news_item BEGIN
+            INSERT INTO news_fts (news_fts, rowid, title, summary, source)
+            VALUES ('delete', old.rowid, old.title, old.summary, old.source);
+            INSERT INTO news_fts (rowid, title, summary, source) VALUES (new.rowid, new.title, new.summary, new.source);
+        END;
+        '''
+    )
+    if not exists:
+        # 升级前已存的新闻补建索引
+        conn.execute("INSERT INTO news_fts (news_fts) VALUES ('rebuild')")
+
+
+def fts_query(text: str) -> str:
+    """把用户输入的关键词转换为 FTS5 查询：每个词加引号（避免标点被当作语法），多个词为 AND；
+    词尾的 * 保留为前缀匹配，OR 保留为逻辑或。"""
+    terms = []
+    for word in (text or '').split():
+        if word.upper() == 'OR' and terms and terms[-1] != 'OR':
+            terms.append('OR')
+            continue
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    while terms and terms[-1] == 'OR':
+        terms.pop()
+    return ' '.join(terms)
+
+
+def _float_or_none(v) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _news_time(value: str) -> str:
+    """日期/时间参数统一为 Alpha Vantage 的 time_published 格式（YYYYMMDDTHHMMSS 的前缀）。"""
+    return value.strip().replace('-', '').replace(':', '').replace(' ', 'T')
+
+
+def _is_fresh(fetched_at, max_age: Optional[float]) -> bool:
+    """max_age 为 None 时不限新鲜期（离线分析使用任意已存数据）。"""
+    return max_age is None or (fetched_at is not None and time.time() - fetched_at <= max_age)
+
+
+def _slice_columns(data: Dict[str, object], cols, start, end, asc: bool, limit) -> Dict[str, object]:
+    """在列式文件映射上按日期区间/条数切片；只复制切片部分，结果不再引用映射。"""
+    dates = data['date']
+    lo = int(np.searchsorted(dates, start.encode('ascii'), 'left')) if start else 0
+    hi = int(np.searchsorted(dates, end.encode('ascii'), 'right')) if end else len(dates)
+    if limit:
+        lo = max(lo, hi - int(limit))
+    hi = max(lo, hi)
+    sl = slice(lo, hi) if asc or hi == lo else slice(hi - 1, lo - 1 if lo else None, -1)
+    return {c: date_strings(dates[sl]) if c == 'date' else data[c][sl].copy() for c in cols}
+
+
+class StockDatabase:
+    """日线数据访问对象。默认使用线程内复用的连接（close() 只结束未提交事务，不关闭连接）；
+    pooled=False 时独占一个连接，close() 时关闭。"""
+
+    def __init__(self, db_path: str = DB_PATH, pooled: bool = True):
+        self.pooled = pooled
+        # 派生的列式历史文件（data/columnar/）：写入时失效，读取时按需重建
+        self.columnar = ColumnarStore(os.path.join(os.path.dirname(db_path), 'columnar'))
+        if pooled:
+            self.conn = get_connection(db_path)
+        else:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+            for pragma in PRAGMAS:
+                self.conn.execute(pragma)
+            _ensure_schema(self.conn, db_path)
+
+    def _create_tables(self):
+        _create_tables(self.conn)
 
     def upsert_daily_prices(self, code: str, rows: Iterable[Dict]):
         cur = self.conn.cursor()
@@ -49,7 +328,470 @@ class StockDatabase:
                 for r in rows
             ]
         )
+        self._bump_price_version([code])
         self.conn.commit()
+        self._advance_indicator_state(code, rows)
+        # 状态被失效或尚未建立时立即重建，指标快照随之刷新
+        self.get_indicator_state(code)
+        # 列式文件只失效，下次读取时再按数据库重建，增量写入不必重写整段历史
+        self._invalidate_columnar(code)
+
+    def upsert_new_prices(self, code: str, rows: Iterable[Dict]) -> int:
+        """只写入库中没有或数值有变化（如复权价调整）的行，返回实际写入条数。"""
+        rows = [r for r in rows if r.get('date')]
+        if not rows:
+            return 0
+        first = min(r['date'] for r in rows)
+        existing = {
+            d: (o, h, l, c, v) for d, o, h, l, c, v in self.conn.execute(
+                'SELECT date, open, high, low, close, volume FROM daily_price WHERE code = ? AND date >= ?',
+                (code, first)
+            )
+        }
+        changed = []
+        for r in rows:
+            vals = (float(r.get('open', 0) or 0), float(r.get('high', 0) or 0), float(r.get('low', 0) or 0),
+                    float(r.get('close', 0) or 0), int(r.get('volume', 0) or 0))
+            if existing.get(r['date']) != vals:
+                changed.append(r)
+        if changed:
+            self.upsert_daily_prices(code, changed)
+        return len(changed)
+
+    def get_watermark(self, code: str) -> Optional[Dict]:
+        """增量更新水位 {last_date, checked_at, rows_written}；没有记录时以库中最新日期为准。"""
+        row = self.conn.execute(
+            'SELECT last_date, checked_at, rows_written FROM update_watermark WHERE code = ?', (code,)
+        ).fetchone()
+        if row:
+            return {'last_date': row[0], 'checked_at': row[1], 'rows_written': row[2]}
+        row = self.conn.execute('SELECT MAX(date) FROM daily_price WHERE code = ?', (code,)).fetchone()
+        if row and row[0]:
+            return {'last_date': row[0], 'checked_at': None, 'rows_written': None}
+        return None
+
+    def set_watermark(self, code: str, last_date: Optional[str], rows_written: int):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO update_watermark (code, last_date, checked_at, rows_written) VALUES (?, ?, ?, ?)',
+            (code, last_date, int(time.time()), int(rows_written))
+        )
+        self.conn.commit()
+
+    def save_overview(self, code: str, data: Dict):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO fundamentals (code, pe, div, data, fetched_at) VALUES (?, ?, ?, ?, ?)',
+            (code, _float_or_none(data.get('PERatio')), _float_or_none(data.get('DividendYield')),
+             json.dumps(data, ensure_ascii=False), int(time.time()))
+        )
+        self.conn.commit()
+
+    def get_overview(self, code: str, max_age: Optional[float] = FRESHNESS['overview']) -> Optional[Dict]:
+        """已存的基本面概览；不存在或超过 max_age 秒时返回 None。附带 fetched_at。"""
+        row = self.conn.execute('SELECT data, fetched_at FROM fundamentals WHERE code = ?', (code,)).fetchone()
+        if not row or not _is_fresh(row[1], max_age):
+            return None
+        try:
+            data = json.loads(row[0])
+        except Exception:
+            return None
+        data['fetched_at'] = row[1]
+        return data
+
+    def save_news(self, code: str, items: Iterable[Dict]) -> int:
+        """写入一次新闻拉取结果：文章按 url 合并（同一文章更新情绪等字段）并关联到代码，记录拉取时间。"""
+        now = int(time.time())
+        rows = [
+            (it.get('url') or it.get('title'), it.get('title'), it.get('summary'), it.get('source'),
+             it.get('time_published'), _float_or_none(it.get('sentiment')), now)
+            for it in items if it.get('url') or it.get('title')
+        ]
+        self.conn.executemany(
+            '''
+            INSERT INTO news_item (url, title, summary, source, time_published, sentiment, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                title = excluded.title, summary = excluded.summary, source = excluded.source,
+                time_published = excluded.time_published, sentiment = excluded.sentiment,
+                fetched_at = excluded.fetched_at
+            ''',
+            rows
+        )
+        self.conn.executemany('INSERT OR IGNORE INTO news_symbol (code, url) VALUES (?, ?)', [(code, r[0]) for r in rows])
+        self.conn.execute(
+            'INSERT OR REPLACE INTO news_fetch (code, fetched_at, count) VALUES (?, ?, ?)', (code, now, len(rows))
+        )
+        self.conn.commit()
+        return len(rows)
+
+    def get_news(self, code: str, max_age: Optional[float] = FRESHNESS['news'],
+                 limit: int = NEWS_LIMIT) -> Optional[Dict]:
+        """已存的新闻（按发布时间倒序）；从未拉取或最近一次拉取超过 max_age 秒时返回 None。"""
+        row = self.conn.execute('SELECT fetched_at FROM news_fetch WHERE code = ?', (code,)).fetchone()
+        if not row or not _is_fresh(row[0], max_age):
+            return None
+        cur = self.conn.execute(
+            '''
+            SELECT n.title, n.summary, n.url, n.time_published, n.sentiment, n.source
+            FROM news_symbol s JOIN news_item n ON n.url = s.url
+            WHERE s.code = ?
+            ORDER BY n.time_published DESC
+            LIMIT ?
+            ''',
+            (code, int(limit))
+        )
+        names = [d[0] for d in cur.description]
+        items = [dict(zip(names, r)) for r in cur.fetchall()]
+        return {'items': items, 'count': len(items), 'fetched_at': row[0]}
+
+    def search_news(self, query: str = '', symbols: Optional[Sequence[str]] = None,
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    min_sentiment: Optional[float] = None, max_sentiment: Optional[float] = None,
+                    limit: int = 20, offset: int = 0):
+        """跨代码检索已存新闻，返回 (总数, 检索方式, 结果列表)。
+
+        有关键词时走 FTS5 索引按 bm25 排序（标题权重高于摘要），否则按发布时间倒序；
+        since/until 为发布时间区间（YYYY-MM-DD 或 Alpha Vantage 的 YYYYMMDDTHHMMSS），
+        每篇文章一条结果，symbols 列出关联的代码。
+        """
+        where, params = [], {'limit': int(limit), 'offset': int(offset)}
+        if symbols:
+            names = [f':sym{i}' for i in range(len(symbols))]
+            where.append(f"n.url IN (SELECT url FROM news_symbol WHERE code IN ({', '.join(names)}))")
+            params.update({n[1:]: s for n, s in zip(names, symbols)})
+        if since:
+            where.append('n.time_published >= :since')
+            params['since'] = _news_time(since)
+        if until:
+            # 只给日期时包含当天全部时间
+            until = _news_time(until)
+            where.append('n.time_published <= :until')
+            params['until'] = until + ('T999999' if len(until) <= 8 else '')
+        if min_sentiment is not None:
+            where.append('n.sentiment >= :min_sentiment')
+            params['min_sentiment'] = float(min_sentiment)
+        if max_sentiment is not None:
+            where.append('n.sentiment <= :max_sentiment')
+            params['max_sentiment'] = float(max_sentiment)
+        match = fts_query(query)
+        fts = bool(match) and self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'news_fts'").fetchone()
+        if fts:
+            # 通过 rank 列取 bm25 得分（标题/摘要/来源权重 10/3/1），FTS5 直接按 rank 有序输出
+            source = 'news_fts JOIN news_item n ON n.rowid = news_fts.rowid'
+            # 计数不需要得分；没有其他过滤条件时只查全文索引本身
+            count_sql = (f"SELECT COUNT(*) FROM {source} WHERE news_fts MATCH :match AND {' AND '.join(where)}"
+                         if where else 'SELECT COUNT(*) FROM news_fts WHERE news_fts MATCH :match')
+            where[:0] = ['news_fts MATCH :match', "news_fts.rank MATCH 'bm25(10.0, 3.0, 1.0)'"]
+            params['match'] = match
+            score, order, engine = 'news_fts.rank', 'news_fts.rank', 'fts5'
+        else:
+            source = 'news_item n'
+            count_sql = None
+            score, order, engine = 'NULL', 'n.time_published DESC', 'recent'
+            for i, word in enumerate((query or '').split()):
+                # 未编译 FTS5 时的退化方式：逐词 LIKE（全表扫描）
+                where.append(f"(n.title LIKE :w{i} ESCAPE '\\' OR n.summary LIKE :w{i} ESCAPE '\\')")
+                params[f'w{i}'] = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                engine = 'like'
+        cond = ('WHERE ' + ' AND '.join(where)) if where else ''
+        total = self.conn.execute(count_sql or f'SELECT COUNT(*) FROM {source} {cond}', params).fetchone()[0]
+        cur = self.conn.execute(
+            f'''
+            SELECT n.url, n.title, n.summary, n.source, n.time_published, n.sentiment, {score} AS score
+            FROM {source} {cond}
+            ORDER BY {order}
+            LIMIT :limit OFFSET :offset
+            ''',
+            params
+        )
+        names = [d[0] for d in cur.description]
+        rows = [dict(zip(names, r)) for r in cur.fetchall()]
+        # 只为当前页的文章查询关联代码
+        codes: Dict[str, list] = {}
+        if rows:
+            marks = ', '.join('?' * len(rows))
+            for url, code in self.conn.execute(
+                    f'SELECT url, code FROM news_symbol WHERE url IN ({marks})', [r['url'] for r in rows]):
+                codes.setdefault(url, []).append(code)
+        for row in rows:
+            row['symbols'] = codes.get(row['url'], [])
+            if row['score'] is None:
+                del row['score']
+            else:
+                # bm25 越小越相关，取反后越大越相关
+                row['score'] = round(-row['score'], 4)
+        return total, engine, rows
+
+    def import_price_rows(self, rows: Iterable[tuple], batch_size: int = 5000,
+                          progress: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+        """批量导入 (code, date, open, high, low, close, volume) 元组，返回各代码写入行数。
+
+        逐批 executemany，整个导入在同一事务内（失败整体回滚）；每批写完回调 progress(counts)。
+        涉及代码的滚动指标状态直接失效，下次读取时按全量历史重建。
+        """
+        counts: Dict[str, int] = {}
+        batch = []
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self._write_price_batch(batch, counts)
+                    batch = []
+                    if progress:
+                        progress(counts)
+            if batch:
+                self._write_price_batch(batch, counts)
+                if progress:
+                    progress(counts)
+            if counts:
+                self.conn.executemany('DELETE FROM indicator_state WHERE code = ?', [(c,) for c in counts])
+                self._bump_price_version(counts)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        # 批量导入只让列式文件失效，首次读取时再重建；指标状态与快照按新数据重建
+        for c in counts:
+            self._invalidate_columnar(c)
+            self.get_indicator_state(c)
+        return counts
+
+    def _write_price_batch(self, batch, counts: Dict[str, int]):
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO daily_price (code, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            batch
+        )
+        for row in batch:
+            counts[row[0]] = counts.get(row[0], 0) + 1
+
+    def _bump_price_version(self, codes: Iterable[str]):
+        """递增价格版本号（由调用方在写入日线的同一事务内调用并提交）。"""
+        params = [(c,) for c in codes]
+        self.conn.executemany('INSERT OR IGNORE INTO price_version (code, version) VALUES (?, 0)', params)
+        self.conn.executemany('UPDATE price_version SET version = version + 1 WHERE code = ?', params)
+
+    def get_price_version(self, code: str) -> int:
+        row = self.conn.execute('SELECT version FROM price_version WHERE code = ?', (code,)).fetchone()
+        return row[0] if row else 0
+
+    def _load_indicator_state(self, code: str) -> Optional[IndicatorState]:
+        row = self.conn.execute('SELECT state FROM indicator_state WHERE code = ?', (code,)).fetchone()
+        if not row:
+            return None
+        try:
+            return IndicatorState.from_dict(json.loads(row[0]))
+        except Exception:
+            return None
+
+    def _save_indicator_state(self, code: str, state: IndicatorState):
+        now = int(time.time())
+        self.conn.execute(
+            'INSERT OR REPLACE INTO indicator_state (code, last_date, state, updated_at) VALUES (?, ?, ?, ?)',
+            (code, state.last_date, json.dumps(state.to_dict()), now)
+        )
+        # 状态与快照同事务写入，快照始终对应最新状态
+        last = state.last_close
+        if last is not None:
+            tech = state.snapshot()
+            p60 = tech.get('p60') or last
+            chg = (last - p60) / p60 * 100 if p60 else 0.0
+            self.conn.execute(
+                '''
+                INSERT OR REPLACE INTO indicator_snapshot
+                    (code, date, last, p20, p60, e20, rsi14, vol, low, high, chg_pct_vs_p60, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (code, state.last_date, last, tech['p20'], tech['p60'], tech['e20'], tech['rsi14'], tech['vol'],
+                 tech['low'], tech['high'], chg, now)
+            )
+        self.conn.commit()
+
+    def _advance_indicator_state(self, code: str, rows: Iterable[Dict]):
+        """仅追加更晚日期的 bar 时增量更新状态；涉及已有日期（改写历史）时删除状态，下次读取时重建。"""
+        state = self._load_indicator_state(code)
+        if state is None:
+            return
+        new_rows = sorted((r for r in rows if r.get('date')), key=lambda r: r['date'])
+        if not new_rows:
+            return
+        if state.last_date is not None and new_rows[0]['date'] <= state.last_date:
+            self.conn.execute('DELETE FROM indicator_state WHERE code = ?', (code,))
+            self.conn.commit()
+            return
+        for r in new_rows:
+            state.update(r['date'], float(r.get('close', 0) or 0))
+        self._save_indicator_state(code, state)
+
+    def get_indicator_state(self, code: str) -> Optional[IndicatorState]:
+        """读取滚动指标状态；不存在或已失效时按全量历史重建一次并保存。无历史时返回 None。"""
+        state = self._load_indicator_state(code)
+        if state is not None:
+            return state
+        cols = self.get_price_columns(code, columns=('date', 'close'), as_numpy=False)
+        if not cols['date']:
+            return None
+        state = IndicatorState.from_series(cols['date'], cols['close'])
+        self._save_indicator_state(code, state)
+        return state
+
+    def refresh_missing_snapshots(self) -> int:
+        """为尚无指标快照的代码补建状态与快照（升级后首次使用或外部写入后），返回补建数量。"""
+        codes = [r[0] for r in self.conn.execute(
+            'SELECT DISTINCT code FROM daily_price WHERE code NOT IN (SELECT code FROM indicator_snapshot)'
+        ).fetchall()]
+        for code in codes:
+            self.conn.execute('DELETE FROM indicator_state WHERE code = ?', (code,))
+            self.get_indicator_state(code)
+        return len(codes)
+
+    def screen_snapshots(self, thresholds: Dict[str, Optional[float]], min_passed: Optional[int] = None,
+                         limit: int = 100, offset: int = 0):
+        """按指标快照筛选：每个条件在 SQL 中求值，返回 (总数, 条件数, 行列表)。
+
+        thresholds 为 analysis.screen_thresholds 的结果；min_passed 为至少满足的条件数（默认全部满足）。
+        指定 max_pe / min_div 时关联 fundamentals 表（仅使用已存的概览，不在线拉取）。
+        结果按满足条件数、相对 SMA60 涨幅降序排列。
+        """
+        checks, params = [], {}
+        # 价格区间：未指定时取观察区间（与 /data/analyze 一致）
+        checks.append('s.last >= COALESCE(:low, s.low, s.last)')
+        checks.append('s.last <= COALESCE(:high, s.high, s.last)')
+        params['low'] = thresholds.get('low')
+        params['high'] = thresholds.get('high')
+        # 基本面条件关联已存的概览（缺失按 0 计，与 evaluate 一致）
+        join = ''
+        if thresholds.get('max_pe') is not None:
+            checks.append('COALESCE(f.pe, 0) <= :max_pe')
+            params['max_pe'] = thresholds['max_pe']
+        if thresholds.get('min_div') is not None:
+            checks.append('COALESCE(f.div, 0) >= :min_div')
+            params['min_div'] = thresholds['min_div']
+        if 'max_pe' in params or 'min_div' in params:
+            join = 'LEFT JOIN fundamentals f ON f.code = s.code'
+        checks.append('COALESCE(s.rsi14, 50) >= :min_rsi')
+        params['min_rsi'] = thresholds['min_rsi']
+        checks.append('COALESCE(s.vol, 0.25) <= :max_vol')
+        params['max_vol'] = thresholds['max_vol']
+        passed = ' + '.join(f'({c})' for c in checks)
+        need = len(checks) if min_passed is None else max(0, min(int(min_passed), len(checks)))
+        params.update({'need': need, 'limit': int(limit), 'offset': int(offset)})
+        # 全部满足时直接用条件过滤（可走 rsi14 / vol 索引），否则按满足数过滤
+        where = ' AND '.join(checks) if need == len(checks) else f'({passed}) >= :need'
+        total = self.conn.execute(
+            f'SELECT COUNT(*) FROM indicator_snapshot s {join} WHERE {where}', params
+        ).fetchone()[0]
+        cur = self.conn.execute(
+            f'''
+            SELECT s.code, s.date, s.last, s.p20, s.p60, s.e20, s.rsi14, s.vol, s.low, s.high, s.chg_pct_vs_p60,
+                   ({passed}) AS passed
+            FROM indicator_snapshot s {join} WHERE {where}
+            ORDER BY passed DESC, s.chg_pct_vs_p60 DESC
+            LIMIT :limit OFFSET :offset
+            ''',
+            params
+        )
+        names = [d[0] for d in cur.description]
+        return total, len(checks), [dict(zip(names, r)) for r in cur.fetchall()]
+
+    def get_price_columns(self, code: str, start: Optional[str] = None, end: Optional[str] = None,
+                          columns: Sequence[str] = ('date', 'close'), order: str = 'asc',
+                          limit: Optional[int] = None, as_numpy: bool = True) -> Dict[str, object]:
+        """按列读取日线：[start, end] 日期区间（含端点）、列投影、升/降序，返回 {列名: 数组}。
+
+        date 列为字符串列表；数值列为 float64 / int64 的 ndarray，as_numpy=False 时为 array('d') / array('q')。
+        limit 取区间内最新的 N 条，再按 order 排列。
+        as_numpy 时优先从列式文件映射切片（缺失或版本号过期时按数据库重建），否则查询 SQLite。
+        """
+        cols = [c for c in columns if c in PRICE_COLUMNS]
+        if not cols:
+            raise ValueError(f'columns must be a subset of {PRICE_COLUMNS}')
+        asc = (order or 'asc').lower() != 'desc'
+        if as_numpy:
+            out = self._columnar_slice(code, cols, start, end, asc, limit)
+            if out is not None:
+                return out
+        return self._query_price_columns(code, cols, start, end, asc, limit, as_numpy)
+
+    def _query_price_columns(self, code, cols, start, end, asc, limit, as_numpy) -> Dict[str, object]:
+        where, params = ['code = ?'], [code]
+        if start:
+            where.append('date >= ?')
+            params.append(start)
+        if end:
+            where.append('date <= ?')
+            params.append(end)
+        sql = f"SELECT {', '.join(cols)} FROM daily_price WHERE {' AND '.join(where)}"
+        # 带 limit 的升序查询先倒序取最新 N 条，再在内存中翻转
+        reverse = bool(limit) and asc
+        sql += ' ORDER BY date ' + ('DESC' if (reverse or not asc) else 'ASC')
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        rows = self.conn.execute(sql, params).fetchall()
+        if reverse:
+            rows.reverse()
+        data = list(zip(*rows)) if rows else [()] * len(cols)
+        out = {}
+        for name, values in zip(cols, data):
+            if name == 'date':
+                out[name] = list(values)
+            elif name == 'volume':
+                out[name] = np.fromiter((v or 0 for v in values), dtype=np.int64, count=len(values)) if as_numpy \
+                    else array('q', (int(v or 0) for v in values))
+            else:
+                out[name] = np.fromiter((v or 0.0 for v in values), dtype=np.float64, count=len(values)) if as_numpy \
+                    else array('d', (float(v or 0.0) for v in values))
+        return out
+
+    def refresh_columnar(self, code: str):
+        """按数据库全量重建该代码的列式文件（无数据时删除）。失败只会让文件失效，不影响写入。"""
+        try:
+            # 先取版本号再读数据：其间若有写入，文件记录的版本偏旧，下次读取时会再次重建，不会误用
+            generation = self.get_price_version(code)
+            cols = self._query_price_columns(code, PRICE_COLUMNS, None, None, True, None, True)
+            if cols['date']:
+                self.columnar.write(code, cols, generation)
+            else:
+                self.columnar.invalidate(code)
+        except Exception:
+            self._invalidate_columnar(code)
+
+    def _invalidate_columnar(self, code: str):
+        try:
+            self.columnar.invalidate(code)
+        except Exception:
+            pass
+
+    def _columnar_current(self, code: str) -> bool:
+        """列式文件存在且版本号与数据库一致。失效删除失败（Windows 下文件被映射）
+        或与写入交错重建留下的旧文件，版本号都落后于数据库，会被识别为过期。"""
+        try:
+            with self.columnar.mapped(code) as data:
+                return data is not None and data['generation'] == self.get_price_version(code)
+        except ValueError:
+            return False
+
+    def _columnar_slice(self, code, cols, start, end, asc, limit) -> Optional[Dict[str, object]]:
+        """从列式文件切片；文件缺失或过期时先按数据库重建一次。仍不可用时返回 None，由调用方查询 SQLite。"""
+        for attempt in range(2):
+            try:
+                with self.columnar.mapped(code) as data:
+                    if data is not None and data['generation'] == self.get_price_version(code):
+                        return _slice_columns(data, cols, start, end, asc, limit)
+            except Exception:
+                pass
+            if attempt == 0:
+                self.refresh_columnar(code)
+        return None
+
+    def columnar_bytes(self, code: str) -> Optional[bytes]:
+        """列式文件的原始内容（用于导出）；缺失或过期时先按数据库重建，重建失败时直接按数据库编码，无历史时返回 None。"""
+        if not self._columnar_current(code):
+            self.refresh_columnar(code)
+            if not self._columnar_current(code):
+                generation = self.get_price_version(code)
+                cols = self._query_price_columns(code, PRICE_COLUMNS, None, None, True, None, True)
+                return encode(code, cols, generation) if cols['date'] else None
+        return self.columnar.read_bytes(code)
 
     def get_daily_prices(self, code: str, limit: int = 500):
         cur = self.conn.cursor()
@@ -77,6 +819,10 @@ class StockDatabase:
 
     def close(self):
         try:
-            self.conn.close()
+            if self.pooled:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+            else:
+                self.conn.close()
         except Exception:
             pass
\ No newline at end of file
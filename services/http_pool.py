@@ -0,0 +1,353 @@
+import io
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+from http.server import HTTPServer
+from urllib.parse import urlparse
+from typing import Callable, Dict, Tuple
+
+# 已接受但尚未发来数据的连接（预连接、空闲 keep-alive）最多等待的秒数与数量，超出即关闭
+PEEK_IDLE_TIMEOUT = 30
+MAX_PENDING = 256
+# 拒绝连接后读尽对端剩余请求数据的最长时间（秒）
+LINGER_SECONDS = 2
+
+
+class WorkerPool:
+    """固定数量工作线程 + 有界等待队列；队列满时 submit 返回 False，由调用方决定拒绝策略。
+
+    排队的任务按 priority 升序出队（数值越小越先执行），同一优先级内先进先出。
+    """
+
+    def __init__(self, name: str, workers: int = 4, queue_size: int = 32):
+        self.name = name
+        self.workers = max(1, int(workers or 1))
+        self.queue_size = max(1, int(queue_size or 1))
+        self._queue = queue.PriorityQueue(maxsize=self.queue_size)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._rejected = 0
+        self._done = 0
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn: Callable, *args, priority: int = 0) -> bool:
+        try:
+            self._queue.put_nowait((priority, next(self._seq), fn, args))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+    def _run(self):
+        while True:
+            _, _, fn, args = self._queue.get()
+            if fn is None:
+                return
+            with self._lock:
+                self._busy += 1
+            try:
+                fn(*args)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._done += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'busy': self._busy,
+                'queued': self._queue.qsize(),
+                'queue_size': self.queue_size,
+                'done': self._done,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self):
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait((float('inf'), next(self._seq), None, None))
+            except queue.Full:
+                break
+
+
+def peek_request_head(sock) -> bytes | None:
+    """不阻塞、不消费地窥视已到达的数据；对端已关闭时返回 None，暂无数据时返回 b''。"""
+    try:
+        sock.setblocking(False)
+        head = sock.recv(2048, socket.MSG_PEEK)
+    except (BlockingIOError, InterruptedError):
+        return b''
+    except OSError:
+        return None
+    finally:
+        try:
+            sock.settimeout(None)
+        except OSError:
+            pass
+    return head or None
+
+
+def parse_request_line(head: bytes) -> Tuple[str, str, str]:
+    """从请求头部解析请求行，返回 (method, path, query)；失败时返回空串。"""
+    line = head.split(b'\r\n', 1)[0].decode('latin-1', 'replace')
+    parts = line.split(' ')
+    if len(parts) < 2:
+        return '', '', ''
+    try:
+        parsed = urlparse(parts[1])
+    except Exception:
+        return parts[0].upper(), '', ''
+    return parts[0].upper(), parsed.path, parsed.query
+
+
+class PooledHTTPServer(HTTPServer):
+    """按通道（lane）分发到各自有界线程池的 HTTPServer。
+
+    lanes: {通道名: (线程数, 队列长度)}；classify(method, path, query) 返回通道名，未知通道落入第一个。
+    prioritize(method, path, query) 返回排队优先级（越小越先执行，默认 0）。
+    队列满时直接返回 reject_status，避免线程无限堆积。
+
+    需要按请求行分类时，accept 线程只把新连接交给分发线程：分发线程用 selector 等到首个数据到达后
+    再窥视请求行并入池，空闲连接不会阻塞 accept，也不占用工作线程。
+    """
+
+    # 浏览器预连接会一次打开多个连接，默认的 listen 队列（5）太短
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, lanes: Dict[str, Tuple[int, int]],
+                 classify: Callable[[str, str, str], str] | None = None, reject_status: int = 503,
+                 prioritize: Callable[[str, str, str], int] | None = None):
+        super().__init__(server_address, handler_class)
+        self.pools = {name: WorkerPool(name, w, q) for name, (w, q) in lanes.items()}
+        self.default_lane = next(iter(lanes))
+        self.classify = classify
+        self.prioritize = prioritize
+        self.reject_status = reject_status
+        self._incoming = queue.SimpleQueue()
+        self._closed = threading.Event()
+        self._pending = 0
+        self._expired = 0
+        self._dispatcher = None
+        self._wake_r = self._wake_w = None
+        if (classify and len(self.pools) > 1) or prioritize:
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='http-dispatch', daemon=True)
+            self._dispatcher.start()
+
+    def _route(self, head: bytes) -> Tuple[str, int]:
+        method, path, query = parse_request_line(head)
+        lane, priority = None, 0
+        try:
+            if self.classify:
+                lane = self.classify(method, path, query)
+            if self.prioritize:
+                priority = int(self.prioritize(method, path, query) or 0)
+        except Exception:
+            pass
+        return (lane if lane in self.pools else self.default_lane), priority
+
+    def process_request(self, request, client_address):
+        if self._dispatcher is None:
+            self._submit(request, client_address, self.default_lane, 0)
+            return
+        self._incoming.put((request, client_address))
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _submit(self, request, client_address, lane: str, priority: int, sel=None):
+        if not self.pools[lane].submit(self._process_in_worker, request, client_address, priority=priority):
+            self._reject(request, lane)
+            self._close_rejected(request, sel)
+
+    def _close_rejected(self, request, sel=None):
+        """拒绝后不立即关闭：对端可能仍在发送请求体，此时关闭会发 RST 冲掉刚写出的响应。
+        在分发线程中先半关闭写端，读尽对端剩余数据（最多 LINGER_SECONDS）后再关闭。"""
+        if sel is None:
+            self.shutdown_request(request)
+            return
+        try:
+            request.shutdown(socket.SHUT_WR)
+            request.setblocking(False)
+        except OSError:
+            self.close_request(request)
+            return
+        sel.register(request, selectors.EVENT_READ, ('linger', None, time.monotonic() + LINGER_SECONDS))
+
+    def _dispatch_loop(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self._wake_r, selectors.EVENT_READ)
+        try:
+            while not self._closed.is_set():
+                for key, _ in sel.select(timeout=1.0):
+                    if key.fileobj is self._wake_r:
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except OSError:
+                            pass
+                        continue
+                    kind, client_address, _ = key.data
+                    request = key.fileobj
+                    if kind == 'linger':
+                        self._drain(sel, request)
+                        continue
+                    sel.unregister(request)
+                    self._pending -= 1
+                    head = peek_request_head(request)
+                    if head is None:
+                        self.shutdown_request(request)
+                    else:
+                        # 首个分段通常已含完整请求行；不完整时按解析结果（默认通道）处理
+                        self._submit(request, client_address, *self._route(head), sel=sel)
+                self._accept_incoming(sel)
+                self._expire_idle(sel)
+        finally:
+            for key in list(sel.get_map().values()):
+                if key.fileobj is not self._wake_r:
+                    self.close_request(key.fileobj)
+            sel.close()
+
+    def _drain(self, sel, request):
+        try:
+            while request.recv(65536):
+                pass
+            done = True
+        except (BlockingIOError, InterruptedError):
+            done = False
+        except OSError:
+            done = True
+        if done:
+            sel.unregister(request)
+            self.close_request(request)
+
+    def _accept_incoming(self, sel):
+        now = time.monotonic()
+        while True:
+            try:
+                request, client_address = self._incoming.get_nowait()
+            except queue.Empty:
+                return
+            if self._pending >= MAX_PENDING:
+                self._reject(request, self.default_lane)
+                self._close_rejected(request, sel)
+                continue
+            sel.register(request, selectors.EVENT_READ, ('peek', client_address, now + PEEK_IDLE_TIMEOUT))
+            self._pending += 1
+
+    def _expire_idle(self, sel):
+        now = time.monotonic()
+        for key in list(sel.get_map().values()):
+            if key.data and key.data[2] <= now:
+                sel.unregister(key.fileobj)
+                if key.data[0] == 'peek':
+                    self._pending -= 1
+                    self._expired += 1
+                    self.shutdown_request(key.fileobj)
+                else:
+                    self.close_request(key.fileobj)
+
+    def _process_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _reject(self, request, lane: str):
+        body = ('{"error": "server busy", "lane": "%s"}' % lane).encode('utf-8')
+        reason = 'Too Many Requests' if self.reject_status == 429 else 'Service Unavailable'
+        head = (
+            f"HTTP/1.0 {self.reject_status} {reason}\r\n"
+            "Content-Type: application/json\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Retry-After: 1\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode('latin-1')
+        try:
+            request.sendall(head + body)
+        except Exception:
+            pass
+
+    def pool_stats(self) -> dict:
+        out = {name: p.stats() for name, p in self.pools.items()}
+        if self._dispatcher is not None:
+            out['dispatch'] = {'pending': self._pending, 'expired': self._expired}
+        return out
+
+    def server_close(self):
+        super().server_close()
+        if self._dispatcher is not None:
+            self._closed.set()
+            try:
+                self._wake_w.send(b'\0')
+            except OSError:
+                pass
+            self._dispatcher.join(timeout=2)
+            self._wake_r.close()
+            self._wake_w.close()
+        for p in self.pools.values():
+            p.shutdown()
+
+
+class RequestBody(io.RawIOBase):
+    """请求体的只读流：按 Content-Length 限长读取，或解码 Transfer-Encoding: chunked，不整体读入内存。"""
+
+    def __init__(self, rfile, headers):
+        self._rfile = rfile
+        self._chunked = 'chunked' in (headers.get('Transfer-Encoding') or '').lower()
+        self._remaining = 0 if self._chunked else max(0, int(headers.get('Content-Length') or 0))
+        self._eof = False
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_chunk(self):
+        line = self._rfile.readline(1024)
+        size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+        if size == 0:
+            # 跳过可能的 trailer，直到空行
+            while True:
+                t = self._rfile.readline(1024)
+                if not t or t in (b'\r\n', b'\n'):
+                    break
+            self._eof = True
+        self._remaining = size
+
+    def readinto(self, b) -> int:
+        if self._eof:
+            return 0
+        if self._remaining == 0:
+            if not self._chunked:
+                self._eof = True
+                return 0
+            self._next_chunk()
+            if self._eof:
+                return 0
+        n = min(len(b), self._remaining)
+        data = self._rfile.read(n)
+        if not data:
+            self._eof = True
+            return 0
+        b[:len(data)] = data
+        self._remaining -= len(data)
+        self.bytes_read += len(data)
+        if self._chunked and self._remaining == 0:
+            self._rfile.readline(16)  # 块尾 CRLF
+        return len(data)
@@ -0,0 +1,297 @@
+"""技术指标计算（NumPy 向量化）。
+
+所有函数接受按时间升序排列的价格序列（list / array('d') / ndarray），
+返回与输入等长的 float64 数组，样本不足的位置为 NaN。
+"""
+import math
+import re
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+TRADING_DAYS = 250
+
+
+def as_array(values) -> np.ndarray:
+    """转换为连续的 float64 数组（已是 float64 连续数组时不复制）。"""
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def _empty(n: int) -> np.ndarray:
+    return np.full(n, np.nan, dtype=np.float64)
+
+
+def sma(values, n: int) -> np.ndarray:
+    x = as_array(values)
+    out = _empty(len(x))
+    if n <= 0 or len(x) < n:
+        return out
+    c = np.cumsum(x)
+    out[n - 1] = c[n - 1]
+    out[n:] = c[n:] - c[:-n]
+    out[n - 1:] /= n
+    return out
+
+
+def ema(values, n: int) -> np.ndarray:
+    """指数均线（整段序列）：以前 n 个值的 SMA 为起点，平滑系数 2/(n+1)。用于 /data/indicators 与 MACD；analyze 的 e20 见 window_ema。"""
+    x = as_array(values)
+    out = _empty(len(x))
+    if n <= 0 or len(x) < n:
+        return out
+    k = 2.0 / (n + 1)
+    e = float(x[:n].mean())
+    out[n - 1] = e
+    # 递推本身无法向量化，逐点计算即可（O(n)）
+    tail = x[n:].tolist()
+    vals = []
+    for v in tail:
+        e = v * k + e * (1 - k)
+        vals.append(e)
+    out[n:] = vals
+    return out
+
+
+def window_ema(values, n: int) -> Optional[float]:
+    """/data/analyze 既有口径的 e20：只看最近 n 根，以其中第一根为起点递推到最新一根（不是整段序列的 ema）。"""
+    x = as_array(values)
+    if n <= 0 or len(x) < n:
+        return None
+    k = 2.0 / (n + 1)
+    e = float(x[-n])
+    for v in x[len(x) - n + 1:].tolist():
+        e = v * k + e * (1 - k)
+    return e
+
+
+def rsi(values, n: int = 14) -> np.ndarray:
+    """窗口 RSI：最近 n 个涨跌幅的涨幅和 / 跌幅和（与 /data/analyze 既有口径一致）。"""
+    x = as_array(values)
+    out = _empty(len(x))
+    if len(x) < n + 1:
+        return out
+    d = np.diff(x)
+    gains = np.cumsum(np.where(d > 0, d, 0.0))
+    losses = np.cumsum(np.where(d < 0, -d, 0.0))
+    g = gains[n - 1:] - np.concatenate(([0.0], gains[:-n]))
+    l = losses[n - 1:] - np.concatenate(([0.0], losses[:-n]))
+    rs = g / np.where(l > 0, l, 1e-6)
+    out[n:] = 100 - 100 / (1 + rs)
+    return out
+
+
+def rolling_std(values, n: int) -> np.ndarray:
+    """滚动总体标准差（ddof=0）。"""
+    x = as_array(values)
+    out = _empty(len(x))
+    if n <= 0 or len(x) < n:
+        return out
+    out[n - 1:] = sliding_window_view(x, n).std(axis=1)
+    return out
+
+
+def bollinger(values, n: int = 40, k: float = 2.0) -> Dict[str, np.ndarray]:
+    mid = sma(values, n)
+    std = rolling_std(values, n)
+    return {'mid': mid, 'lower': mid - k * std, 'upper': mid + k * std}
+
+
+def returns(values) -> np.ndarray:
+    """简单收益率，首位为 NaN。"""
+    x = as_array(values)
+    out = _empty(len(x))
+    if len(x) > 1:
+        out[1:] = np.diff(x) / x[:-1]
+    return out
+
+
+def rolling_vol(values, n: int = 60, periods: int = TRADING_DAYS) -> np.ndarray:
+    """年化波动率：最近 n 个收益率的总体标准差 × sqrt(periods)。"""
+    r = returns(values)
+    out = _empty(len(r))
+    if n <= 0 or len(r) < n + 1:
+        return out
+    out[n:] = sliding_window_view(r[1:], n).std(axis=1) * math.sqrt(periods)
+    return out
+
+
+def macd(values, fast: int = 12, slow: int = 26, signal: int = 9) -> Dict[str, np.ndarray]:
+    line = ema(values, fast) - ema(values, slow)
+    sig = _empty(len(line))
+    valid = ~np.isnan(line)
+    if valid.any():
+        start = int(np.argmax(valid))
+        sig[start:] = ema(line[start:], signal)
+    return {'macd': line, 'signal': sig, 'hist': line - sig}
+
+
+def last(series) -> Optional[float]:
+    """序列最后一个值；为 NaN 或序列为空时返回 None。"""
+    if series is None or len(series) == 0:
+        return None
+    v = float(series[-1])
+    return None if math.isnan(v) else v
+
+
+def to_list(series) -> List[Optional[float]]:
+    """转换为 JSON 友好的列表（NaN → None）。"""
+    return [None if math.isnan(v) else round(v, 6) for v in as_array(series).tolist()]
+
+
+_NAME_RE = re.compile(r'^([a-z]+)(\d*)$')
+DEFAULT_SERIES = ('sma20', 'sma60', 'ema20', 'rsi14', 'boll40', 'vol60')
+
+
+def compute(values, names: Iterable[str] = DEFAULT_SERIES) -> Dict[str, object]:
+    """按名称批量计算指标序列，如 sma20 / ema20 / rsi14 / boll40 / vol60 / macd。"""
+    x = as_array(values)
+    out = {}
+    for name in names:
+        m = _NAME_RE.match((name or '').strip().lower())
+        if not m:
+            continue
+        kind, n = m.group(1), int(m.group(2) or 0)
+        if kind == 'sma':
+            out[name] = sma(x, n or 20)
+        elif kind == 'ema':
+            out[name] = ema(x, n or 20)
+        elif kind == 'rsi':
+            out[name] = rsi(x, n or 14)
+        elif kind in ('boll', 'bb'):
+            out[name] = bollinger(x, n or 40)
+        elif kind == 'vol':
+            out[name] = rolling_vol(x, n or 60)
+        elif kind == 'macd':
+            out[name] = macd(x)
+    return out
+
+
+def technical_snapshot(values) -> Dict[str, Optional[float]]:
+    """/data/analyze 使用的最新指标值：p20/p60/e20/rsi14/vol/low/high（样本不足为 None）。"""
+    x = as_array(values)
+    if len(x) == 0:
+        return {'p20': None, 'p60': None, 'e20': None, 'rsi14': None, 'vol': None, 'low': None, 'high': None}
+    # 年化波动率：至少 30 个样本，取最近至多 60 个收益率；观察区间：最近至多 40 根的均值 ±2σ
+    band = bollinger(x, min(40, len(x)))
+    return {
+        'p20': last(sma(x, 20)),
+        'p60': last(sma(x, 60)),
+        'e20': window_ema(x, 20),
+        'rsi14': last(rsi(x, 14)),
+        'vol': last(rolling_vol(x, min(60, len(x) - 1))) if len(x) >= 30 else None,
+        'low': last(band['lower']),
+        'high': last(band['upper']),
+    }
+
+
+class IndicatorState:
+    """可持久化的滚动指标状态：每追加一根 bar 以 O(1) 更新 RSI 涨跌和、SMA/方差滚动和（e20 按尾部 20 根计算）。
+
+    只保留最近 TAIL 根收盘价用于移出窗口；历史较短时直接用尾部序列计算，口径与 technical_snapshot 一致。
+    """
+
+    SMA_WINDOWS = (20, 40, 60)
+    EMA_N = 20
+    RSI_N = 14
+    BAND_N = 40
+    VOL_N = 60
+    TAIL = VOL_N + 2
+
+    def __init__(self):
+        self.last_date = None
+        self.count = 0
+        self.tail: List[float] = []
+        self.sums = {n: 0.0 for n in self.SMA_WINDOWS}
+        self.sumsq_band = 0.0
+        self.gains = 0.0
+        self.losses = 0.0
+        self.ret_sum = 0.0
+        self.ret_sumsq = 0.0
+
+    @classmethod
+    def from_series(cls, dates: Iterable[str], closes: Iterable[float]) -> 'IndicatorState':
+        st = cls()
+        for d, c in zip(dates, closes):
+            st.update(d, c)
+        return st
+
+    @property
+    def last_close(self) -> Optional[float]:
+        return self.tail[-1] if self.tail else None
+
+    def update(self, date: str, close: float):
+        x = float(close)
+        t = self.count
+        tail = self.tail
+        tail.append(x)
+        for n in self.SMA_WINDOWS:
+            self.sums[n] += x
+            if t >= n:
+                self.sums[n] -= tail[-n - 1]
+        self.sumsq_band += x * x
+        if t >= self.BAND_N:
+            self.sumsq_band -= tail[-self.BAND_N - 1] ** 2
+        if t >= 1:
+            d = x - tail[-2]
+            self.gains += max(d, 0.0)
+            self.losses += max(-d, 0.0)
+            if t > self.RSI_N:
+                od = tail[-self.RSI_N - 1] - tail[-self.RSI_N - 2]
+                self.gains -= max(od, 0.0)
+                self.losses -= max(-od, 0.0)
+            r = (x - tail[-2]) / tail[-2] if tail[-2] else 0.0
+            self.ret_sum += r
+            self.ret_sumsq += r * r
+            if t > self.VOL_N:
+                p0, p1 = tail[-self.VOL_N - 2], tail[-self.VOL_N - 1]
+                orr = (p1 - p0) / p0 if p0 else 0.0
+                self.ret_sum -= orr
+                self.ret_sumsq -= orr * orr
+        self.count = t + 1
+        self.last_date = date
+        if len(tail) > self.TAIL:
+            del tail[:-self.TAIL]
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        if self.count < self.TAIL:
+            # 尾部即完整历史，直接复用向量化口径（含样本不足时的窗口收缩规则）
+            return technical_snapshot(self.tail)
+        bn = self.BAND_N
+        mean = self.sums[bn] / bn
+        std = math.sqrt(max(self.sumsq_band / bn - mean * mean, 0.0))
+        vn = self.VOL_N
+        rmean = self.ret_sum / vn
+        rstd = math.sqrt(max(self.ret_sumsq / vn - rmean * rmean, 0.0))
+        rs = self.gains / (self.losses if self.losses > 1e-12 else 1e-6)
+        return {
+            'p20': self.sums[20] / 20,
+            'p60': self.sums[60] / 60,
+            'e20': window_ema(self.tail, self.EMA_N),
+            'rsi14': 100 - 100 / (1 + rs),
+            'vol': rstd * math.sqrt(TRADING_DAYS),
+            'low': mean - 2 * std,
+            'high': mean + 2 * std,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'last_date': self.last_date, 'count': self.count, 'tail': self.tail,
+            'sums': {str(k): v for k, v in self.sums.items()}, 'sumsq_band': self.sumsq_band,
+            'gains': self.gains, 'losses': self.losses,
+            'ret_sum': self.ret_sum, 'ret_sumsq': self.ret_sumsq,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'IndicatorState':
+        st = cls()
+        st.last_date = d.get('last_date')
+        st.count = int(d.get('count') or 0)
+        st.tail = [float(v) for v in d.get('tail') or []]
+        st.sums.update({int(k): float(v) for k, v in (d.get('sums') or {}).items()})
+        st.sumsq_band = float(d.get('sumsq_band') or 0)
+        st.gains = float(d.get('gains') or 0)
+        st.losses = float(d.get('losses') or 0)
+        st.ret_sum = float(d.get('ret_sum') or 0)
+        st.ret_sumsq = float(d.get('ret_sumsq') or 0)
+        return st
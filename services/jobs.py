@@ -0,0 +1,163 @@
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+ACTIVE = ('queued', 'running')
+
+
+class Job:
+    """后台任务：状态、进度计数与最近事件；runner 通过 emit() 上报进度，通过 cancel_event 感知取消。"""
+
+    def __init__(self, kind: str, params: Dict, keys: Iterable[str], runner: Callable[['Job'], Dict],
+                 manager: 'JobManager'):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.keys = frozenset(keys)
+        self.runner = runner
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {'total': 0, 'done': 0, 'ok': 0, 'fail': 0, 'skipped': 0, 'written': 0}
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.events = deque(maxlen=200)
+        self._manager = manager
+
+    def emit(self, kind: str, data: Dict):
+        self._manager._emit(self, kind, data)
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id, 'kind': self.kind, 'status': self.status, 'params': self.params,
+            'created_at': self.created_at, 'started_at': self.started_at, 'finished_at': self.finished_at,
+            'progress': dict(self.progress), 'result': self.result, 'error': self.error,
+        }
+
+
+class JobManager:
+    """进程内任务队列（单个执行线程，任务依次运行）。
+
+    - submit 时若已有排队/运行中的任务与之键（如股票代码）重叠，直接返回该任务，不重复启动；
+    - cancel 置位任务的取消事件，排队中的任务直接标记为 cancelled；
+    - subscribe 返回事件队列，供 SSE 等推送通道消费；慢消费者只丢弃事件，不阻塞任务。
+    """
+
+    def __init__(self, history: int = 50):
+        self.history = history
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._subs: List[tuple] = []
+        self._seq = itertools.count(1)
+        self._thread = threading.Thread(target=self._run, name='job-runner', daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, runner: Callable[[Job], Dict], params: Optional[Dict] = None,
+               keys: Iterable[str] = ()) -> tuple:
+        """提交任务，返回 (job, created)；与活动任务重叠时 created=False。"""
+        keys = frozenset(keys)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and job.status in ACTIVE and (not keys or not job.keys or job.keys & keys):
+                    return job, False
+            job = Job(kind, params or {}, keys, runner, self)
+            self._jobs[job.id] = job
+            self._trim_locked()
+        self._emit(job, 'queued', {})
+        self._queue.put(job)
+        return job, True
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ACTIVE:
+                return job
+            job.cancel_event.set()
+            queued = job.status == 'queued'
+            if queued:
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+        if queued:
+            self._emit(job, 'finished', {'status': 'cancelled'})
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [j.to_dict() for j in reversed(self._jobs.values())]
+
+    def subscribe(self, job_id: Optional[str] = None, maxsize: int = 1000) -> queue.Queue:
+        q = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subs.append((job_id, q))
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subs = [(jid, sq) for jid, sq in self._subs if sq is not q]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+            return {'jobs': counts, 'subscribers': len(self._subs), 'queued': self._queue.qsize()}
+
+    def _emit(self, job: Job, kind: str, data: Dict):
+        # runner 可能在多个线程中上报，计数与事件序号在锁内更新
+        with self._lock:
+            p = job.progress
+            if kind == 'start':
+                p['total'] = data.get('total', 0)
+                p['done'] = data.get('resumed', 0)
+            elif kind == 'symbol':
+                status = data.get('status')
+                p['done'] += 1
+                p['ok' if status in ('ok', 'skipped') else 'fail'] += 1
+                if status == 'skipped':
+                    p['skipped'] += 1
+                p['written'] += data.get('written', 0)
+            event = {'seq': next(self._seq), 'ts': time.time(), 'job': job.id, 'type': kind,
+                     'status': job.status, 'progress': dict(p), 'data': data}
+            job.events.append(event)
+            subs = [q for jid, q in self._subs if jid is None or jid == job.id]
+        for q in subs:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def _trim_locked(self):
+        finished = [jid for jid, j in self._jobs.items() if j.status not in ACTIVE]
+        for jid in finished[:max(0, len(self._jobs) - self.history)]:
+            self._jobs.pop(jid, None)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != 'queued':
+                    continue
+                job.status = 'running'
+                job.started_at = time.time()
+            self._emit(job, 'running', {})
+            try:
+                job.result = job.runner(job)
+                status = 'cancelled' if job.cancel_event.is_set() else 'done'
+            except Exception as e:
+                job.error = str(e)
+                status = 'failed'
+            with self._lock:
+                job.status = status
+                job.finished_at = time.time()
+            self._emit(job, 'finished', {'status': status, 'error': job.error})
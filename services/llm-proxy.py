@@ -2,24 +2,28 @@
 import json
 import sys
 import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
 import requests
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
+
+import app_config
+import llm_client
+from http_pool import PooledHTTPServer
 
 ALLOW_ORIGIN = "*"
 
-# 读取统一配置（ABC/config/app.json）
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-CONFIG_DIR = os.path.join(BASE_DIR, 'config')
-CONFIG_PATH = os.path.join(CONFIG_DIR, 'app.json')
 _RL_BUCKETS = {}
+_RL_LOCK = threading.Lock()
 
-def _load_config():
-    try:
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
+# 服务线程数与每通道排队上限，可在 config/app.json 中用 llmWorkers / llmQueue 覆盖；
+# 排队已满时直接返回 429，不再堆积线程
+DEFAULT_WORKERS = 8
+DEFAULT_CONTROL_WORKERS = 2
+DEFAULT_QUEUE = 32
+# 排队优先级（越小越先执行）：请求可用 ?priority=high|low 指定
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
 
 def _client_ip(handler: BaseHTTPRequestHandler) -> str:
     try:
@@ -28,7 +32,7 @@ def _client_ip(handler: BaseHTTPRequestHandler) -> str:
         return 'unknown'
 
 def _allowed_ip(ip: str) -> bool:
-    cfg = _load_config()
+    cfg = app_config.load()
     lst = cfg.get('allowed_ips')
     if isinstance(lst, list) and lst:
         return ip in lst
@@ -38,14 +42,32 @@ def _allowed_ip(ip: str) -> bool:
 def _rate_limit_hit(bucket: str, ip: str, limit: int, window_sec: int = 60) -> bool:
     now = time.time()
     key = f"{bucket}:{ip}"
-    arr = _RL_BUCKETS.get(key) or []
-    arr = [t for t in arr if now - t < window_sec]
-    if len(arr) >= limit:
+    with _RL_LOCK:
+        arr = _RL_BUCKETS.get(key) or []
+        arr = [t for t in arr if now - t < window_sec]
+        if len(arr) >= limit:
+            _RL_BUCKETS[key] = arr
+            return True
+        arr.append(now)
         _RL_BUCKETS[key] = arr
-        return True
-    arr.append(now)
-    _RL_BUCKETS[key] = arr
-    return False
+        return False
+
+def _int_cfg(cfg: dict, name: str, default: int) -> int:
+    try:
+        v = int(cfg.get(name) or default)
+        return v if v > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+def _request_lane(method: str, path: str, query: str) -> str:
+    """按请求行选择线程池通道：模型调用走 llm，预检与统计走 control，不排在慢请求之后。"""
+    if method == 'POST':
+        return 'llm'
+    return 'control'
+
+def _request_priority(method: str, path: str, query: str) -> int:
+    level = (parse_qs(query or '').get('priority') or ['normal'])[0].strip().lower()
+    return PRIORITIES.get(level, PRIORITIES['normal'])
 
 class Handler(BaseHTTPRequestHandler):
     @staticmethod
@@ -55,7 +77,7 @@ class Handler(BaseHTTPRequestHandler):
         if explicit_key:
             return explicit_key
         # 2) 读取统一配置中的 llmKey（仅本机）
-        cfg = _load_config()
+        cfg = app_config.load()
         k = (cfg.get('llmKey') or '').strip()
         if k:
             return k
@@ -79,15 +101,33 @@ class Handler(BaseHTTPRequestHandler):
     def _set_cors(self):
         self.send_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
         self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
 
     def do_OPTIONS(self):
         self.send_response(200)
         self._set_cors()
         self.end_headers()
 
+    def do_GET(self):
+        # 缓存命中/未命中统计
+        if self.path.split('?', 1)[0] == "/llm/stats":
+            stats = {"cache": llm_client.get_cache().stats(), "upstream": llm_client.get_limiter().stats()}
+            if hasattr(self.server, 'pool_stats'):
+                stats["pools"] = self.server.pool_stats()
+            data = json.dumps(stats, ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self._set_cors()
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(404)
+        self._set_cors()
+        self.end_headers()
+        self.wfile.write(b"Not Found")
+
     def do_POST(self):
-        if self.path not in ("/llm", "/v1/chat/completions"):
+        if self.path.split('?', 1)[0] not in ("/llm", "/v1/chat/completions"):
             self.send_response(404)
             self._set_cors()
             self.end_headers()
@@ -120,62 +160,27 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": f"invalid json: {e}"}).encode('utf-8'))
             return
 
+        # 响应缓存：相同请求直接返回缓存结果；"cache": false 时跳过读取（仍写回新结果）
+        use_cache = payload.get('cache') is not False
+
         # 多模型聚合支持：providers 列表
         providers = payload.get('providers')
         if isinstance(providers, list) and providers:
-            results = []
-            for i, prov in enumerate(providers):
-                ep = prov.get('endpoint')
-                key = self._resolve_api_key(prov.get('name'), ep, prov.get('api_key'))
-                fb = prov.get('forward_body') or {}
-                if not ep:
-                    results.append({"provider": f"p{i}", "error": "missing endpoint"})
-                    continue
-                # 内置模拟：builtin:echo
-                if isinstance(ep, str) and ep.startswith('builtin:echo'):
-                    content = ' '.join([
-                        msg.get('content', '') for msg in fb.get('messages', []) if isinstance(msg, dict)
-                    ]) or fb.get('prompt') or 'OK'
-                    j = {
-                        'choices': [{'message': {'role': 'assistant', 'content': f'Echo: {content}'}}]
-                    }
-                    text = j['choices'][0]['message']['content']
-                    results.append({"provider": prov.get('name') or f"p{i}", "text": text, "raw": j})
-                    continue
-                try:
-                    headers = {"Content-Type": "application/json"}
-                    if key:
-                        headers["Authorization"] = f"Bearer {key}"
-                    resp = requests.post(ep, json=fb, headers=headers, timeout=30)
-                    resp.raise_for_status()
-                    try:
-                        j = resp.json()
-                    except Exception:
-                        j = {"raw": resp.text}
-                    text = (
-                        j.get('choices', [{}])[0].get('message', {}).get('content')
-                        or j.get('output')
-                        or json.dumps(j, ensure_ascii=False)
-                    )
-                    results.append({"provider": prov.get('name') or f"p{i}", "text": text, "raw": j})
-                except requests.exceptions.HTTPError as e:
-                    content = e.response.text if getattr(e, 'response', None) is not None else ''
-                    results.append({"provider": prov.get('name') or f"p{i}", "error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": content})
-                except requests.exceptions.ConnectionError as e:
-                    results.append({"provider": prov.get('name') or f"p{i}", "error": f"ConnectionError {e}"})
-                except requests.exceptions.Timeout as e:
-                    results.append({"provider": prov.get('name') or f"p{i}", "error": f"Timeout {e}"})
-                except Exception as e:
-                    results.append({"provider": prov.get('name') or f"p{i}", "error": str(e)})
-
-            combined = "\n\n".join([
-                f"【{r.get('provider')}】\n{r.get('text') or r.get('error')}" for r in results
-            ])
+            if payload.get('stream'):
+                # 流式：各 provider 的增量交错写入同一个 SSE 流
+                llm_client.write_fan_out_stream(self, providers, self._resolve_api_key,
+                                                deadline=payload.get('deadline'), provider_timeout=payload.get('timeout'),
+                                                use_cache=use_cache)
+                return
+            # 并发调用，deadline 到期时返回已完成的部分结果
+            result = llm_client.fan_out(providers, self._resolve_api_key,
+                                        deadline=payload.get('deadline'), provider_timeout=payload.get('timeout'),
+                                        use_cache=use_cache)
             self.send_response(200)
             self._set_cors()
             self.send_header("Content-Type", "application/json")
             self.end_headers()
-            self.wfile.write(json.dumps({"outputs": results, "combined": combined}, ensure_ascii=False).encode('utf-8'))
+            self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
             return
 
         # 单模型直通
@@ -185,7 +190,7 @@ class Handler(BaseHTTPRequestHandler):
             'model': payload.get('model', ''),
             'messages': payload.get('messages', []),
             'temperature': payload.get('temperature', 0.2),
-            'stream': False
+            'stream': bool(payload.get('stream'))
         }
         if not endpoint:
             self.send_response(400)
@@ -194,6 +199,11 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": "missing endpoint"}).encode('utf-8'))
             return
 
+        # 流式直通：上游 SSE 分块到达即转发
+        if payload.get('stream') or forward_body.get('stream'):
+            llm_client.relay_stream(self, endpoint, forward_body, api_key, use_cache=use_cache)
+            return
+
         # 内置模拟：builtin:echo
         if isinstance(endpoint, str) and endpoint.startswith('builtin:echo'):
             content = ' '.join([
@@ -211,25 +221,21 @@ class Handler(BaseHTTPRequestHandler):
             return
 
         try:
-            headers = {"Content-Type": "application/json"}
-            if api_key:
-                headers["Authorization"] = f"Bearer {api_key}"
-            resp = requests.post(endpoint, json=forward_body, headers=headers, timeout=30)
-            resp.raise_for_status()
-            data = resp.text.encode('utf-8')
-            self.send_response(200)
+            status, text, cached = llm_client.complete(endpoint, forward_body, api_key, use_cache=use_cache)
+            data = text.encode('utf-8') if text or status < 400 else json.dumps({"error": f"HTTPError {status}"}).encode('utf-8')
+            self.send_response(status)
             self._set_cors()
             self.send_header("Content-Type", "application/json")
+            self.send_header("X-Cache", cached.upper())
             self.end_headers()
             self.wfile.write(data)
-        except requests.exceptions.HTTPError as e:
-            content = e.response.text if getattr(e, 'response', None) is not None else ''
-            code = getattr(e.response, 'status_code', 500)
-            self.send_response(code)
+        except llm_client.UpstreamBusy as e:
+            self.send_response(429)
             self._set_cors()
             self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "1")
             self.end_headers()
-            self.wfile.write(content.encode('utf-8') if content else json.dumps({"error": str(e)}).encode('utf-8'))
+            self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
         except requests.exceptions.ConnectionError as e:
             self.send_response(502)
             self._set_cors()
@@ -257,12 +263,22 @@ def main():
             port = int(sys.argv[1])
         except ValueError:
             pass
-    server = HTTPServer(('0.0.0.0', port), Handler)
+    cfg = app_config.load()
+    queue_size = _int_cfg(cfg, 'llmQueue', DEFAULT_QUEUE)
+    lanes = {
+        'llm': (_int_cfg(cfg, 'llmWorkers', DEFAULT_WORKERS), queue_size),
+        'control': (DEFAULT_CONTROL_WORKERS, queue_size),
+    }
+    server = PooledHTTPServer(('0.0.0.0', port), Handler, lanes, classify=_request_lane,
+                              reject_status=429, prioritize=_request_priority)
     print(f"LLM proxy running on http://localhost:{port}/llm")
+    print(f"[HTTP] workers: llm={lanes['llm'][0]} queue={queue_size}")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
+    finally:
+        server.server_close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import app_config
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_PATH = os.path.join(BASE_DIR, 'data', 'llm_cache.db')
+
+# 有效期与容量上限，可在 config/app.json 中用 llmCacheTtl（秒）/ llmCacheMaxMB 覆盖
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# 淘汰时降到上限的这一比例以下，避免每次写入都触发淘汰
+EVICT_TARGET = 0.9
+PURGE_EVERY = 200
+
+
+def cache_key(endpoint: str, body: Dict) -> str:
+    """请求的内容哈希：endpoint + model + messages + temperature 的规范化 JSON（键排序、紧凑分隔）的 sha256。"""
+    canon = {
+        'endpoint': (endpoint or '').strip(),
+        'model': body.get('model'),
+        'messages': body.get('messages'),
+        'temperature': body.get('temperature'),
+    }
+    if body.get('prompt') is not None:
+        canon['prompt'] = body.get('prompt')
+    data = json.dumps(canon, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """按内容哈希缓存 LLM 响应正文（SQLite 持久化，线程安全）。
+
+    - 条目超过 ttl 秒即失效；总字节数超过 max_bytes 时按最近使用时间淘汰；
+    - lead()/done() 登记在途请求：相同 key 的后来者等待首个请求完成后直接读缓存，不重复请求上游。
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._bytes = 0
+        self._puts = 0
+        self._inflight: Dict[str, threading.Event] = {}
+        self._counters = {'hits': 0, 'misses': 0, 'bypass': 0, 'coalesced': 0, 'stores': 0,
+                          'evictions': 0, 'expired': 0, 'errors': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    body TEXT,
+                    size INTEGER,
+                    created_at REAL,
+                    expires_at REAL,
+                    last_used REAL
+                )
+                '''
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)')
+            conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (time.time(),))
+            conn.commit()
+            self._bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, record: bool = True) -> Optional[str]:
+        """未过期时返回缓存的响应正文并刷新最近使用时间；否则返回 None。"""
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                row = conn.execute('SELECT body, expires_at, size FROM llm_cache WHERE key = ?', (key,)).fetchone()
+                if row and row[1] <= now:
+                    conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                    conn.commit()
+                    self._bytes -= row[2] or 0
+                    self._counters['expired'] += 1
+                    row = None
+                if row:
+                    conn.execute('UPDATE llm_cache SET last_used = ? WHERE key = ?', (now, key))
+                    conn.commit()
+                if record:
+                    self._counters['hits' if row else 'misses'] += 1
+                return row[0] if row else None
+        except sqlite3.Error:
+            with self._lock:
+                self._counters['errors'] += 1
+            return None
+
+    def put(self, key: str, body: str):
+        now = time.time()
+        size = len(body.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                old = conn.execute('SELECT size FROM llm_cache WHERE key = ?', (key,)).fetchone()
+                conn.execute(
+                    'INSERT OR REPLACE INTO llm_cache (key, body, size, created_at, expires_at, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, body, size, now, now + self.ttl, now)
+                )
+                self._bytes += size - (old[0] if old else 0)
+                self._counters['stores'] += 1
+                self._puts += 1
+                if self._puts % PURGE_EVERY == 0:
+                    self._purge_locked(conn, now)
+                if self._bytes > self.max_bytes:
+                    self._evict_locked(conn)
+                conn.commit()
+        except sqlite3.Error:
+            with self._lock:
+                self._counters['errors'] += 1
+
+    def _purge_locked(self, conn: sqlite3.Connection, now: float):
+        n = conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,)).rowcount
+        if n:
+            self._counters['expired'] += n
+            self._bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+
+    def _evict_locked(self, conn: sqlite3.Connection):
+        target = self.max_bytes * EVICT_TARGET
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM llm_cache ORDER BY last_used'):
+            if self._bytes <= target:
+                break
+            victims.append((key,))
+            self._bytes -= size or 0
+        conn.executemany('DELETE FROM llm_cache WHERE key = ?', victims)
+        self._counters['evictions'] += len(victims)
+
+    def lead(self, key: str) -> Optional[threading.Event]:
+        """登记在途请求：返回 None 表示由调用者请求上游（完成后必须调用 done）；否则返回应等待的事件。"""
+        with self._lock:
+            ev = self._inflight.get(key)
+            if ev is None:
+                self._inflight[key] = threading.Event()
+            return ev
+
+    def done(self, key: str):
+        with self._lock:
+            ev = self._inflight.pop(key, None)
+        if ev is not None:
+            ev.set()
+
+    def wait_for(self, key: str, ev: threading.Event, timeout: float) -> Optional[str]:
+        """等待相同请求完成后读取缓存；超时或对方失败（未缓存）时返回 None。"""
+        ev.wait(timeout)
+        body = self.get(key, record=False)
+        if body is not None:
+            with self._lock:
+                self._counters['coalesced'] += 1
+        return body
+
+    def lookup(self, key: str, wait_timeout: float, bypass: bool = False) -> Tuple[Optional[str], bool]:
+        """查缓存并登记在途请求，返回 (缓存正文, 是否由调用者请求上游并在结束后调用 done)。
+
+        相同请求正在进行时等待其完成再读缓存；bypass 时跳过读取，也不与在途请求合并。
+        """
+        if bypass:
+            self.count_bypass()
+            return None, False
+        body = self.get(key)
+        if body is not None:
+            return body, False
+        ev = self.lead(key)
+        if ev is None:
+            return None, True
+        return self.wait_for(key, ev, wait_timeout), False
+
+    def fetch(self, key: str, fn: Callable[[], Tuple[int, str]], wait_timeout: float,
+              bypass: bool = False) -> Tuple[int, str, str]:
+        """读缓存或调用 fn() -> (状态码, 正文)，状态码 200 时写入缓存。返回 (状态码, 正文, 'hit'/'miss'/'bypass')。
+
+        bypass 时跳过读取但仍写入新结果（即强制刷新）。
+        """
+        body, leader = self.lookup(key, wait_timeout, bypass)
+        if body is not None:
+            return 200, body, 'hit'
+        try:
+            status, text = fn()
+            if status == 200 and text:
+                self.put(key, text)
+            return status, text, 'bypass' if bypass else 'miss'
+        finally:
+            if leader:
+                self.done(key)
+
+    def count_bypass(self):
+        with self._lock:
+            self._counters['bypass'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._counters)
+            entries = 0
+            try:
+                entries = self._connect().execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+            except sqlite3.Error:
+                pass
+            lookups = out['hits'] + out['misses']
+            out.update({
+                'entries': entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'in_flight': len(self._inflight),
+                'hit_rate': round(out['hits'] / lookups, 4) if lookups else None,
+            })
+            return out
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def _num(cfg: dict, name: str, default):
+    try:
+        v = float(cfg.get(name) or default)
+        return v if v > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+def get_cache() -> LLMCache:
+    """进程内共享的 LLM 响应缓存（首次使用时按配置创建）。"""
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                cfg = app_config.load()
+                _CACHE = LLMCache(
+                    ttl=_num(cfg, 'llmCacheTtl', DEFAULT_TTL),
+                    max_bytes=int(_num(cfg, 'llmCacheMaxMB', DEFAULT_MAX_BYTES / 1024 / 1024) * 1024 * 1024),
+                )
+    return _CACHE
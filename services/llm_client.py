@@ -0,0 +1,551 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+import app_config
+from upstream import get_client
+from llm_cache import cache_key, get_cache
+
+# 多模型聚合：整体截止时间与单个 provider 的读取超时（秒），请求体中可用 deadline / timeout 覆盖
+DEFAULT_DEADLINE = 45
+DEFAULT_PROVIDER_TIMEOUT = 30
+FANOUT_WORKERS = 16
+# 每个上游主机的并发请求上限与等待空位的最长时间（秒），可在 config/app.json 中用
+# llmUpstreamConcurrency / llmUpstreamWait 覆盖
+DEFAULT_UPSTREAM_CONCURRENCY = 4
+DEFAULT_UPSTREAM_WAIT = 10
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_LIMITER = None
+
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='llm-fanout')
+    return _POOL
+
+
+class UpstreamBusy(Exception):
+    """上游主机的并发数已满且等待超时。"""
+
+
+class UpstreamLimiter:
+    """按上游主机限制并发请求数：超过上限的请求最多等待 wait 秒，仍无空位时抛出 UpstreamBusy。"""
+
+    def __init__(self, limit: int = DEFAULT_UPSTREAM_CONCURRENCY, wait: float = DEFAULT_UPSTREAM_WAIT):
+        self.limit = max(1, int(limit))
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def acquire(self, endpoint: str, timeout: Optional[float] = None) -> Callable[[], None]:
+        """占用 endpoint 所在主机的一个并发名额，返回释放函数（只应调用一次）。"""
+        host = urlparse(endpoint or '').netloc.lower()
+        with self._lock:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = threading.BoundedSemaphore(self.limit)
+                self._counts[host] = {'active': 0, 'waiting': 0, 'rejected': 0, 'requests': 0}
+            counts = self._counts[host]
+            counts['waiting'] += 1
+        ok = sem.acquire(timeout=min(self.wait, timeout) if timeout else self.wait)
+        with self._lock:
+            counts['waiting'] -= 1
+            if not ok:
+                counts['rejected'] += 1
+            else:
+                counts['active'] += 1
+                counts['requests'] += 1
+        if not ok:
+            raise UpstreamBusy(f"upstream busy: {host} ({self.limit} concurrent)")
+
+        def release():
+            with self._lock:
+                counts['active'] -= 1
+            sem.release()
+        return release
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'limit': self.limit, 'wait': self.wait,
+                    'hosts': {h: dict(c) for h, c in self._counts.items()}}
+
+
+def get_limiter() -> UpstreamLimiter:
+    """进程内共享的上游并发限制（首次使用时按配置创建）。"""
+    global _LIMITER
+    if _LIMITER is None:
+        with _POOL_LOCK:
+            if _LIMITER is None:
+                cfg = app_config.load()
+                _LIMITER = UpstreamLimiter(
+                    limit=int(_seconds(cfg.get('llmUpstreamConcurrency'), DEFAULT_UPSTREAM_CONCURRENCY)),
+                    wait=_seconds(cfg.get('llmUpstreamWait'), DEFAULT_UPSTREAM_WAIT),
+                )
+    return _LIMITER
+
+
+def _seconds(v, default: float) -> float:
+    try:
+        v = float(v)
+        return v if v > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+def echo_response(body: Dict) -> Dict:
+    """内置模拟 builtin:echo：回显消息内容。"""
+    content = ' '.join([
+        msg.get('content', '') for msg in body.get('messages', []) if isinstance(msg, dict)
+    ]) or body.get('prompt') or 'OK'
+    return {'choices': [{'message': {'role': 'assistant', 'content': f'Echo: {content}'}}]}
+
+
+def response_text(j: Dict) -> str:
+    return (
+        j.get('choices', [{}])[0].get('message', {}).get('content')
+        or j.get('output')
+        or json.dumps(j, ensure_ascii=False)
+    )
+
+
+def _headers(key: Optional[str]) -> Dict:
+    headers = {"Content-Type": "application/json"}
+    if key:
+        headers["Authorization"] = f"Bearer {key}"
+    return headers
+
+
+def complete(endpoint: str, body: Dict, key: Optional[str], read_timeout: Optional[float] = None,
+             use_cache: bool = True) -> Tuple[int, str, str]:
+    """非流式调用上游，返回 (状态码, 响应正文, 缓存状态 hit/miss/bypass)；网络异常照常抛出。
+
+    相同请求（endpoint/model/messages/temperature）命中缓存时不访问上游；并发的相同请求只发一次。
+    use_cache=False 时跳过读取，成功结果仍写回缓存。上游主机并发已满且等待超时时抛出 UpstreamBusy。
+    """
+    def call():
+        release = get_limiter().acquire(endpoint)
+        try:
+            resp = get_client().post(endpoint, json=body, headers=_headers(key), read_timeout=read_timeout)
+            return resp.status_code, resp.text
+        finally:
+            release()
+
+    wait = _seconds(read_timeout, DEFAULT_PROVIDER_TIMEOUT)
+    return get_cache().fetch(cache_key(endpoint, body), call, wait, bypass=not use_cache)
+
+
+def call_provider(prov: Dict, index: int, resolve_key: Callable, read_timeout: Optional[float] = None,
+                  use_cache: bool = True) -> Dict:
+    """调用单个 provider，返回 {provider, text, raw} 或 {provider, error}，附带 latency_ms。"""
+    name = prov.get('name') or f"p{index}"
+    t0 = time.perf_counter()
+    out = _call(prov, index, name, resolve_key, read_timeout, use_cache)
+    out['latency_ms'] = int((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def _call(prov: Dict, index: int, name: str, resolve_key: Callable, read_timeout: Optional[float],
+          use_cache: bool) -> Dict:
+    ep = prov.get('endpoint')
+    fb = prov.get('forward_body') or {}
+    if not ep:
+        return {"provider": f"p{index}", "error": "missing endpoint"}
+    if isinstance(ep, str) and ep.startswith('builtin:echo'):
+        j = echo_response(fb)
+        return {"provider": name, "text": response_text(j), "raw": j}
+    try:
+        key = resolve_key(prov.get('name'), ep, prov.get('api_key'))
+        status, text, cached = complete(ep, fb, key, read_timeout, use_cache)
+        if status >= 400:
+            return {"provider": name, "error": f"HTTPError {status}", "raw": text}
+        try:
+            j = json.loads(text)
+        except Exception:
+            j = {"raw": text}
+        return {"provider": name, "text": response_text(j), "raw": j, "cache": cached}
+    except Exception as e:
+        return _error(name, e)
+
+
+def _error(name: str, e: Exception) -> Dict:
+    if isinstance(e, UpstreamBusy):
+        return {"provider": name, "error": str(e)}
+    if isinstance(e, requests.exceptions.HTTPError):
+        content = e.response.text if getattr(e, 'response', None) is not None else ''
+        return {"provider": name, "error": f"HTTPError {getattr(e.response, 'status_code', '')}", "raw": content}
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return {"provider": name, "error": f"ConnectionError {e}"}
+    if isinstance(e, requests.exceptions.Timeout):
+        return {"provider": name, "error": f"Timeout {e}"}
+    return {"provider": name, "error": str(e)}
+
+
+def fan_out(providers: List[Dict], resolve_key: Callable, deadline: Optional[float] = None,
+            provider_timeout: Optional[float] = None, use_cache: bool = True) -> Dict:
+    """并发调用多个 provider，最多等待 deadline 秒，返回 {outputs, combined, partial, elapsed_ms}。
+
+    每个 provider 的读取超时取其 timeout 字段（默认 provider_timeout），且不超过 deadline；
+    截止时仍未返回的 provider 记为 pending 错误，其余结果照常返回（outputs 保持请求中的顺序）。
+    """
+    deadline = _seconds(deadline, DEFAULT_DEADLINE)
+    default_timeout = _seconds(provider_timeout, DEFAULT_PROVIDER_TIMEOUT)
+    t0 = time.perf_counter()
+    pool = _get_pool()
+    futures = []
+    for i, prov in enumerate(providers):
+        prov = prov if isinstance(prov, dict) else {}
+        timeout = min(_seconds(prov.get('timeout'), default_timeout), deadline)
+        futures.append(pool.submit(call_provider, prov, i, resolve_key, timeout, use_cache))
+    wait(futures, timeout=deadline)
+    elapsed = int((time.perf_counter() - t0) * 1000)
+    results = []
+    for i, fut in enumerate(futures):
+        prov = providers[i] if isinstance(providers[i], dict) else {}
+        if fut.done():
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                results.append({"provider": prov.get('name') or f"p{i}", "error": str(e), "latency_ms": elapsed})
+        else:
+            # 未完成的调用在后台线程中按自身超时结束，结果丢弃
+            results.append({"provider": prov.get('name') or f"p{i}", "error": f"deadline exceeded ({deadline:g}s)",
+                            "pending": True, "latency_ms": elapsed})
+    return {
+        "outputs": results,
+        "combined": combine(results),
+        "partial": any(r.get('pending') for r in results),
+        "elapsed_ms": elapsed,
+    }
+
+
+def combine(results: List[Dict]) -> str:
+    return "\n\n".join([
+        f"【{r.get('provider')}】\n{r.get('text') or r.get('error')}" for r in results
+    ])
+
+
+# ---- 流式（SSE）----
+
+def sse_event(data, event: Optional[str] = None) -> bytes:
+    body = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    head = f"event: {event}\n" if event else ''
+    return f"{head}data: {body}\n\n".encode('utf-8')
+
+
+def echo_stream(body: Dict) -> Iterator[bytes]:
+    """builtin:echo 的流式版本：按词输出 OpenAI 兼容的 chat.completion.chunk。"""
+    text = response_text(echo_response(body))
+    for i, word in enumerate(text.split(' ')):
+        piece = word if i == 0 else ' ' + word
+        yield sse_event({'choices': [{'index': 0, 'delta': {'content': piece}}]})
+    yield sse_event('[DONE]')
+
+
+def open_stream(endpoint: str, body: Dict, key: Optional[str], read_timeout: Optional[float] = None) -> requests.Response:
+    """以 stream=True 请求上游（body 中 stream 置为 True），返回未读取正文的响应；非 2xx 时抛出 HTTPError。"""
+    resp = get_client().post(endpoint, json=dict(body, stream=True), headers=_headers(key),
+                             read_timeout=read_timeout, stream=True)
+    if resp.status_code >= 400:
+        # 读出错误正文后再抛出，调用方可照常取 e.response.text
+        resp.content
+        resp.close()
+    resp.raise_for_status()
+    return resp
+
+
+def iter_chunks(resp: requests.Response) -> Iterator[bytes]:
+    """按到达顺序产出上游正文：chunked 编码逐块读取；否则用 read1 取当前可读的数据，
+    不等凑满缓冲区（iter_content / iter_lines 会等满一块才返回）。"""
+    raw = resp.raw
+    if getattr(raw, 'chunked', False) or not hasattr(raw, 'read1'):
+        yield from resp.iter_content(chunk_size=None)
+        return
+    while True:
+        data = raw.read1(65536)
+        if not data:
+            return
+        yield data
+
+
+def _iter_lines(resp: requests.Response) -> Iterator[bytes]:
+    buf = b''
+    for chunk in iter_chunks(resp):
+        buf += chunk
+        *lines, buf = buf.split(b'\n')
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if buf:
+        yield buf
+
+
+def _delta_piece(line: bytes) -> Optional[str]:
+    """解析一行 SSE：返回 data 中的 delta/message 文本；[DONE] 返回 None，其余无内容的行返回空串。"""
+    if not line.startswith(b'data:'):
+        return ''
+    data = line[5:].strip()
+    if data == b'[DONE]':
+        return None
+    try:
+        choice = (json.loads(data).get('choices') or [{}])[0]
+    except Exception:
+        return ''
+    return (choice.get('delta') or {}).get('content') or (choice.get('message') or {}).get('content') or ''
+
+
+def iter_deltas(resp: requests.Response) -> Iterator[str]:
+    """逐段产出上游增量文本：SSE 解析各 data 行的 delta.content；上游未按流式返回时整体产出一次。"""
+    if 'text/event-stream' not in (resp.headers.get('Content-Type') or ''):
+        try:
+            j = json.loads(resp.content.decode('utf-8'))
+        except Exception:
+            j = {"raw": resp.text}
+        yield response_text(j)
+        return
+    for line in _iter_lines(resp):
+        piece = _delta_piece(line)
+        if piece is None:
+            return
+        if piece:
+            yield piece
+
+
+def completion_body(model, text: str) -> str:
+    """把流式输出拼接的全文保存为非流式 chat.completion 响应（供缓存复用）。"""
+    return json.dumps({
+        'object': 'chat.completion', 'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+    }, ensure_ascii=False)
+
+
+def _replay(handler, cached: str):
+    """缓存命中时以 SSE 一次性返回全文。"""
+    try:
+        text = response_text(json.loads(cached))
+    except Exception:
+        text = cached
+    _start_sse(handler, 'text/event-stream', cache='HIT')
+    handler.wfile.write(sse_event({'choices': [{'index': 0, 'delta': {'content': text}}]}))
+    handler.wfile.write(sse_event('[DONE]'))
+
+
+def relay_stream(handler, endpoint: str, body: Dict, key: Optional[str], use_cache: bool = True):
+    """单模型流式直通：上游响应按到达的分块原样转发给客户端（保持上游 Content-Type）。
+
+    转发的同时拼接全文，完整结束后写入缓存；命中缓存（或等到相同的在途请求完成）时直接回放。
+    """
+    if isinstance(endpoint, str) and endpoint.startswith('builtin:echo'):
+        _start_sse(handler, 'text/event-stream')
+        for chunk in echo_stream(body):
+            handler.wfile.write(chunk)
+            handler.wfile.flush()
+        return
+    cache = get_cache()
+    ckey = cache_key(endpoint, body)
+    cached, leader = cache.lookup(ckey, DEFAULT_PROVIDER_TIMEOUT, bypass=not use_cache)
+    if cached is not None:
+        return _replay(handler, cached)
+    try:
+        _relay(handler, endpoint, body, key, lambda text: cache.put(ckey, text), 'MISS' if use_cache else 'BYPASS')
+    finally:
+        if leader:
+            cache.done(ckey)
+
+
+def _relay(handler, endpoint: str, body: Dict, key: Optional[str], store: Callable[[str], None], cache_state: str):
+    release = None
+    try:
+        # 流式响应在整个转发期间占用上游并发名额
+        release = get_limiter().acquire(endpoint)
+        resp = open_stream(endpoint, body, key)
+    except Exception as e:
+        if release:
+            release()
+        err = _error('', e)
+        code = 429 if isinstance(e, UpstreamBusy) else (
+            504 if isinstance(e, requests.exceptions.Timeout) else (
+                502 if isinstance(e, requests.exceptions.ConnectionError) else (
+                    getattr(getattr(e, 'response', None), 'status_code', None) or 500)))
+        data = (err.get('raw') or json.dumps({"error": err['error']}, ensure_ascii=False)).encode('utf-8')
+        handler.send_response(code)
+        handler._set_cors()
+        handler.send_header("Content-Type", "application/json")
+        handler.end_headers()
+        handler.wfile.write(data)
+        return
+    ctype = resp.headers.get('Content-Type') or 'text/event-stream'
+    sse = 'text/event-stream' in ctype
+    parts, raw, buf, finished = [], [], b'', False
+    try:
+        _start_sse(handler, ctype, cache=cache_state)
+        for chunk in iter_chunks(resp):
+            handler.wfile.write(chunk)
+            handler.wfile.flush()
+            if not sse:
+                raw.append(chunk)
+                continue
+            buf += chunk
+            *lines, buf = buf.split(b'\n')
+            for line in lines:
+                piece = _delta_piece(line.rstrip(b'\r'))
+                if piece is None:
+                    finished = True
+                elif piece:
+                    parts.append(piece)
+        finished = finished or not sse
+    except (BrokenPipeError, ConnectionResetError):
+        return
+    except requests.exceptions.RequestException as e:
+        # 响应头已发出，只能在流内报告错误
+        try:
+            handler.wfile.write(sse_event({"error": _error('', e)['error']}, 'error'))
+        except Exception:
+            pass
+        return
+    finally:
+        resp.close()
+        release()
+    # 只缓存完整结束的响应
+    if finished:
+        if sse and parts:
+            store(completion_body(body.get('model'), ''.join(parts)))
+        elif not sse and raw:
+            store(b''.join(raw).decode('utf-8', 'replace'))
+
+
+def _start_sse(handler, content_type: str, cache: Optional[str] = None):
+    handler.send_response(200)
+    handler._set_cors()
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Cache-Control", "no-cache")
+    handler.send_header("X-Accel-Buffering", "no")
+    if cache:
+        handler.send_header("X-Cache", cache)
+    handler.end_headers()
+
+
+def fan_out_stream(providers: List[Dict], resolve_key: Callable, deadline: Optional[float] = None,
+                   provider_timeout: Optional[float] = None, use_cache: bool = True) -> Iterator[Tuple[str, Dict]]:
+    """并发流式调用多个 provider，把各自的增量合并为一个事件序列 (event, data)：
+
+    - delta：{provider, index, delta}，按到达顺序交错；
+    - done：{provider, index, text | error, latency_ms, first_token_ms}，每个 provider 一次；
+    - end：{partial, elapsed_ms, combined}，最后一个事件。
+    deadline 到期时未完成的 provider 以 pending 的 done 事件结束（附已收到的部分文本），其后台读取随即停止。
+    """
+    deadline = _seconds(deadline, DEFAULT_DEADLINE)
+    default_timeout = _seconds(provider_timeout, DEFAULT_PROVIDER_TIMEOUT)
+    t0 = time.perf_counter()
+    events = queue.Queue()
+    stop = threading.Event()
+    cache = get_cache()
+    names = [(p.get('name') if isinstance(p, dict) else None) or f"p{i}" for i, p in enumerate(providers)]
+
+    def run(i: int, prov: Dict, timeout: float):
+        started = time.perf_counter()
+        first, parts, cached = None, [], None
+        try:
+            ep = prov.get('endpoint')
+            if not ep:
+                out = {"provider": f"p{i}", "error": "missing endpoint"}
+            else:
+                fb = prov.get('forward_body') or {}
+                ckey, leader, resp, release = None, False, None, None
+                if isinstance(ep, str) and ep.startswith('builtin:echo'):
+                    pieces = iter([response_text(echo_response(fb))])
+                else:
+                    ckey = cache_key(ep, fb)
+                    body, leader = cache.lookup(ckey, timeout, bypass=not use_cache)
+                    if body is not None:
+                        cached = 'hit'
+                        pieces = iter([response_text(json.loads(body))])
+                    else:
+                        cached = 'miss' if use_cache else 'bypass'
+                try:
+                    if ckey and cached != 'hit':
+                        release = get_limiter().acquire(ep, timeout)
+                        resp = open_stream(ep, fb, resolve_key(prov.get('name'), ep, prov.get('api_key')), timeout)
+                        pieces = iter_deltas(resp)
+                    for piece in pieces:
+                        if stop.is_set():
+                            break
+                        if first is None:
+                            first = int((time.perf_counter() - started) * 1000)
+                        parts.append(piece)
+                        events.put(('delta', {"provider": names[i], "index": i, "delta": piece}))
+                    if resp is not None and parts and not stop.is_set():
+                        cache.put(ckey, completion_body(fb.get('model'), ''.join(parts)))
+                finally:
+                    if resp is not None:
+                        resp.close()
+                    if release:
+                        release()
+                    if leader:
+                        cache.done(ckey)
+                out = {"provider": names[i], "text": ''.join(parts)}
+                if cached:
+                    out['cache'] = cached
+        except Exception as e:
+            out = _error(names[i], e)
+        out.update(index=i, latency_ms=int((time.perf_counter() - started) * 1000), first_token_ms=first)
+        events.put(('done', out))
+
+    pool = _get_pool()
+    for i, prov in enumerate(providers):
+        prov = prov if isinstance(prov, dict) else {}
+        pool.submit(run, i, prov, min(_seconds(prov.get('timeout'), default_timeout), deadline))
+    outputs: List[Optional[Dict]] = [None] * len(providers)
+    received: List[List[str]] = [[] for _ in providers]
+    end = t0 + deadline
+    try:
+        while any(o is None for o in outputs):
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                kind, data = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if kind == 'done':
+                outputs[data['index']] = data
+            else:
+                received[data['index']].append(data['delta'])
+            yield kind, data
+        elapsed = int((time.perf_counter() - t0) * 1000)
+        for i, o in enumerate(outputs):
+            if o is None:
+                # 截止时已收到的部分文本一并返回
+                outputs[i] = {"provider": names[i], "index": i, "error": f"deadline exceeded ({deadline:g}s)",
+                              "pending": True, "latency_ms": elapsed, "text": ''.join(received[i]) or None}
+                yield 'done', outputs[i]
+        yield 'end', {"partial": any(o.get('pending') for o in outputs), "elapsed_ms": elapsed,
+                      "combined": combine(outputs)}
+    finally:
+        stop.set()
+
+
+def write_fan_out_stream(handler, providers: List[Dict], resolve_key: Callable, deadline=None, provider_timeout=None,
+                         use_cache: bool = True):
+    """把 fan_out_stream 的事件以 SSE 写给客户端；客户端断开时停止全部上游读取。"""
+    _start_sse(handler, 'text/event-stream')
+    stream = fan_out_stream(providers, resolve_key, deadline, provider_timeout, use_cache)
+    try:
+        for event, data in stream:
+            handler.wfile.write(sse_event(data, event))
+            handler.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stream.close()
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Set
+
+# 推送的行情字段；增量帧只包含相对上次发送发生变化的字段
+QUOTE_FIELDS = ('last', 'volume', 'error', 'note')
+# 紧凑编码的字段缩写
+COMPACT_KEYS = {'last': 'l', 'volume': 'v', 'error': 'e', 'note': 'n'}
+
+
+def _offer(q: asyncio.Queue, item):
+    """只保留最新一条：慢客户端不会积压旧行情。"""
+    if q.full():
+        try:
+            q.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    q.put_nowait(item)
+
+
+def queue_sink(q: asyncio.Queue) -> Callable[[str, dict], None]:
+    """单代码订阅：把广播结果放进只保留最新一条的队列。"""
+    return lambda symbol, payload: _offer(q, payload)
+
+
+class DeltaSubscriber:
+    """多代码订阅者：累积各代码最新行情，按批次产出仅含变化字段的帧。"""
+
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self.symbols: Set[str] = set()
+        self.changed = asyncio.Event()
+        self._pending: Dict[str, dict] = {}
+        self._sent: Dict[str, dict] = {}
+
+    def __call__(self, symbol: str, payload: dict):
+        self._pending[symbol] = payload
+        self.changed.set()
+
+    def forget(self, symbol: str):
+        self.symbols.discard(symbol)
+        self._pending.pop(symbol, None)
+        self._sent.pop(symbol, None)
+
+    def resend_all(self):
+        """下次批次发送完整字段（客户端请求快照时使用）。"""
+        for sym, fields in self._sent.items():
+            self._pending.setdefault(sym, dict(fields))
+        self._sent.clear()
+        self.changed.set()
+
+    def drain(self) -> Dict[str, dict]:
+        updates = {}
+        pending, self._pending = self._pending, {}
+        for sym, payload in pending.items():
+            if sym not in self.symbols:
+                continue
+            prev = self._sent.setdefault(sym, {})
+            delta = {}
+            for f in QUOTE_FIELDS:
+                if f in payload and prev.get(f) != payload[f]:
+                    delta[f] = payload[f]
+                    prev[f] = payload[f]
+            if delta:
+                updates[sym] = delta
+        return updates
+
+    def encode(self, updates: Dict[str, dict]) -> str:
+        ts = int(time.time())
+        if self.compact:
+            rows = [[sym, {COMPACT_KEYS[k]: v for k, v in d.items()}] for sym, d in updates.items()]
+            return json.dumps({'t': 'b', 'ts': ts, 'u': rows}, ensure_ascii=False, separators=(',', ':'))
+        return json.dumps({'type': 'batch', 'ts': ts, 'updates': updates}, ensure_ascii=False)
+
+
+class QuoteHub:
+    """按代码共享的行情轮询中心（运行在 WebSocket 事件循环内）。
+
+    - 每个代码只有一个轮询任务，结果广播给该代码的全部订阅者；
+    - 阻塞的行情拉取放到线程池执行，不占用事件循环；
+    - 最后一个订阅者离开时自动停止该代码的轮询。
+    """
+
+    def __init__(self, fetch: Callable[[str], dict], interval: float = 2.0, max_workers: int = 8):
+        self.fetch = fetch
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ws-fetch')
+        # 订阅者为 sink(symbol, payload) 可调用对象
+        self._subs: Dict[str, Set[Callable]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._latest: Dict[str, dict] = {}
+        self._polls = 0
+
+    def subscribe(self, symbol: str, sink: Callable[[str, dict], None]):
+        self._subs.setdefault(symbol, set()).add(sink)
+        if symbol in self._latest:
+            sink(symbol, self._latest[symbol])
+        task = self._tasks.get(symbol)
+        if task is None or task.done():
+            self._tasks[symbol] = asyncio.get_running_loop().create_task(self._poll(symbol))
+
+    def unsubscribe(self, symbol: str, sink: Callable[[str, dict], None]):
+        subs = self._subs.get(symbol)
+        if subs is None:
+            return
+        subs.discard(sink)
+        if not subs:
+            self._subs.pop(symbol, None)
+            self._latest.pop(symbol, None)
+            task = self._tasks.pop(symbol, None)
+            if task is not None:
+                task.cancel()
+
+    async def _poll(self, symbol: str):
+        loop = asyncio.get_running_loop()
+        while self._subs.get(symbol):
+            try:
+                payload = await loop.run_in_executor(self._executor, self.fetch, symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                payload = {'symbol': symbol, 'error': str(e)}
+            self._polls += 1
+            if not self._subs.get(symbol):
+                break
+            self._latest[symbol] = payload
+            for sink in list(self._subs.get(symbol, ())):
+                try:
+                    sink(symbol, payload)
+                except Exception:
+                    pass
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        try:
+            subs = {s: len(qs) for s, qs in list(self._subs.items())}
+        except RuntimeError:
+            subs = {}
+        return {
+            'symbols': len(subs),
+            'subscribers': sum(subs.values()),
+            'pollers': len(self._tasks),
+            'polls': self._polls,
+        }
@@ -0,0 +1,238 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+# ttl 可为秒数，或 callable(now) -> 过期时间戳（如“到下一个交易时段”）
+TTL = Union[float, Callable[[float], float]]
+
+
+class _Entry:
+    __slots__ = ('value', 'stored_at', 'expires_at', 'stale_until', 'size')
+
+    def __init__(self, value, stored_at, expires_at, stale_until, size):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+
+
+def _estimate_size(value) -> int:
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+    except Exception:
+        return 256
+
+
+class DiskCache:
+    """SQLite 持久化的二级缓存：保存序列化值与过期时间，网关重启后可直接复用。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    stored_at REAL,
+                    expires_at REAL,
+                    stale_until REAL
+                )
+                '''
+            )
+            self._conn.commit()
+        return self._conn
+
+    def load_all(self, now: float):
+        """清理已彻底过期的条目，并返回其余条目 (key, value, stored_at, expires_at, stale_until)。"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM response_cache WHERE stale_until <= ?', (now,))
+            conn.commit()
+            rows = conn.execute(
+                'SELECT key, value, stored_at, expires_at, stale_until FROM response_cache ORDER BY stored_at'
+            ).fetchall()
+        out = []
+        for key, value, stored_at, expires_at, stale_until in rows:
+            try:
+                out.append((key, json.loads(value), stored_at, expires_at, stale_until))
+            except Exception:
+                continue
+        return out
+
+    def put(self, key: str, value, stored_at: float, expires_at: float, stale_until: float):
+        data = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, stored_at, expires_at, stale_until) VALUES (?, ?, ?, ?, ?)',
+                (key, data, stored_at, expires_at, stale_until)
+            )
+            self._puts += 1
+            if self._puts % 500 == 0:
+                conn.execute('DELETE FROM response_cache WHERE stale_until <= ?', (time.time(),))
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+
+
+class ResponseCache:
+    """有界 LRU + TTL 响应缓存（线程安全）。
+
+    - 按条目数与估算字节数双重限制，超出时淘汰最久未使用的条目；
+    - 按键前缀（如 global_quote:IBM 的 global_quote）选择 TTL 策略；
+    - 过期后在 stale 宽限期内仍可返回旧值（state='stale'），由调用方后台刷新；
+    - 可选 backend（DiskCache）作为二级缓存：写入时同步落盘，首次访问时批量加载。
+    """
+
+    def __init__(self, max_entries: int = 2000, max_bytes: int = 32 * 1024 * 1024,
+                 policies: Optional[Dict[str, Dict[str, TTL]]] = None, default_ttl: float = 60,
+                 default_stale: float = 0, backend: Optional[DiskCache] = None):
+        self.backend = backend
+        self._loaded = backend is None
+        self._load_lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policies = policies or {}
+        self.default_ttl = default_ttl
+        self.default_stale = default_stale
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sets_since_purge = 0
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0,
+                          'disk_loaded': 0, 'disk_errors': 0}
+
+    @staticmethod
+    def kind_of(key: str) -> str:
+        return key.split(':', 1)[0]
+
+    def _expiry(self, key: str, now: float) -> Tuple[float, float]:
+        policy = self.policies.get(self.kind_of(key)) or {}
+        ttl = policy.get('ttl', self.default_ttl)
+        expires_at = ttl(now) if callable(ttl) else now + float(ttl)
+        stale_until = expires_at + float(policy.get('stale', self.default_stale) or 0)
+        return expires_at, stale_until
+
+    def get(self, key: str, record: bool = True) -> Tuple[Any, Optional[str]]:
+        """返回 (value, state)；state 为 'fresh' / 'stale'，未命中为 (None, None)。record=False 时不计入命中统计。"""
+        self._ensure_loaded()
+        now = time.time()
+        with self._lock:
+            e = self._data.get(key)
+            if e is None:
+                state = None
+            elif now < e.expires_at:
+                state = 'fresh'
+            elif now < e.stale_until:
+                state = 'stale'
+            else:
+                self._remove(key)
+                self._counters['expired'] += 1
+                e, state = None, None
+            if record:
+                self._counters[{'fresh': 'hits', 'stale': 'stale_hits', None: 'misses'}[state]] += 1
+            if e is None:
+                return None, None
+            self._data.move_to_end(key)
+            return e.value, state
+
+    def set(self, key: str, value: Any, stored_at: Optional[float] = None,
+            expires_at: Optional[float] = None, stale_until: Optional[float] = None):
+        self._ensure_loaded()
+        now = time.time()
+        stored_at = stored_at or now
+        if expires_at is None:
+            expires_at, stale_until = self._expiry(key, stored_at)
+        elif stale_until is None:
+            stale_until = expires_at
+        self._store(key, value, stored_at, expires_at, stale_until, now)
+        if self.backend is not None:
+            try:
+                self.backend.put(key, value, stored_at, expires_at, stale_until)
+            except Exception:
+                with self._lock:
+                    self._counters['disk_errors'] += 1
+
+    def _store(self, key, value, stored_at, expires_at, stale_until, now):
+        size = _estimate_size(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = _Entry(value, stored_at, expires_at, stale_until, size)
+            self._bytes += size
+            self._sets_since_purge += 1
+            if self._sets_since_purge >= 100:
+                self._purge_locked(now)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, old = self._data.popitem(last=False)
+                self._bytes -= old.size
+                self._counters['evictions'] += 1
+
+    def _ensure_loaded(self):
+        """首次访问时从二级缓存批量加载仍在宽限期内的条目（保持原有过期时间），加载期间其他线程等待。"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                now = time.time()
+                rows = self.backend.load_all(now)
+                for key, value, stored_at, expires_at, stale_until in rows:
+                    self._store(key, value, stored_at, expires_at, stale_until, now)
+                with self._lock:
+                    self._counters['disk_loaded'] += len(rows)
+            except Exception:
+                with self._lock:
+                    self._counters['disk_errors'] += 1
+            finally:
+                self._loaded = True
+
+    def _remove(self, key: str):
+        e = self._data.pop(key, None)
+        if e is not None:
+            self._bytes -= e.size
+
+    def _purge_locked(self, now: float):
+        dead = [k for k, e in self._data.items() if now >= e.stale_until]
+        for k in dead:
+            self._remove(k)
+        self._counters['expired'] += len(dead)
+        self._sets_since_purge = 0
+
+    def purge_expired(self):
+        with self._lock:
+            self._purge_locked(time.time())
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out.update({
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            })
+            return out
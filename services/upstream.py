@@ -0,0 +1,92 @@
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import app_config
+
+# 连接池与超时默认值，可在 config/app.json 中覆盖：
+# upstreamPoolSize / upstreamConnectTimeout / upstreamReadTimeout
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+class UpstreamClient:
+    """共享的上游 HTTP 客户端：按 host 复用 keep-alive 连接池，连接/读取超时分开设置，可跨线程使用。"""
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url: str) -> requests.Session:
+        p = urlparse(url)
+        host = f"{p.scheme}://{p.netloc}".lower()
+        with self._lock:
+            sess = self._sessions.get(host)
+            if sess is None:
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                sess.mount(host + '/', adapter)
+                self._sessions[host] = sess
+            return sess
+
+    def timeout(self, read_timeout: float | None = None):
+        return (self.connect_timeout, read_timeout or self.read_timeout)
+
+    def get(self, url: str, params=None, read_timeout: float | None = None, **kwargs) -> requests.Response:
+        return self._session(url).get(url, params=params, timeout=self.timeout(read_timeout), **kwargs)
+
+    def post(self, url: str, json=None, headers=None, read_timeout: float | None = None, **kwargs) -> requests.Response:
+        return self._session(url).post(url, json=json, headers=headers, timeout=self.timeout(read_timeout), **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hosts = list(self._sessions.keys())
+        return {
+            'hosts': hosts,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+        }
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for s in sessions:
+            try:
+                s.close()
+            except Exception:
+                pass
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _num(cfg: dict, name: str, default):
+    try:
+        v = float(cfg.get(name) or default)
+        return v if v > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+def get_client() -> UpstreamClient:
+    """进程内共享的上游客户端（首次使用时按配置创建）。"""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                cfg = app_config.load()
+                _CLIENT = UpstreamClient(
+                    pool_size=int(_num(cfg, 'upstreamPoolSize', DEFAULT_POOL_SIZE)),
+                    connect_timeout=_num(cfg, 'upstreamConnectTimeout', DEFAULT_CONNECT_TIMEOUT),
+                    read_timeout=_num(cfg, 'upstreamReadTimeout', DEFAULT_READ_TIMEOUT),
+                )
+    return _CLIENT